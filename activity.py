@@ -0,0 +1,262 @@
+"""
+Distinct active users per day / week / month (HyperLogLog or exact sets)
+"""
+import asyncio
+import base64
+import hashlib
+import logging
+import math
+import zlib
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Tuple
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from config import supabase, ACTIVITY_MODE, ACTIVITY_HLL_PRECISION
+
+logger = logging.getLogger(__name__)
+
+
+def _hash64(user_id) -> int:
+    return int.from_bytes(hashlib.blake2b(str(user_id).encode(), digest_size=8).digest(), 'big')
+
+
+class HyperLogLog:
+    """Fixed-size distinct counter: 2**precision one-byte registers.
+
+    Standard error is about 1.04 / sqrt(2**precision) (0.8% at p=14, 16 KB).
+    Sketches of the same precision merge by taking register-wise maxima.
+    """
+    kind = 'hll'
+
+    def __init__(self, precision: int = ACTIVITY_HLL_PRECISION):
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+        self._count = None
+
+    def add(self, user_id):
+        x = _hash64(user_id)
+        index = x >> (64 - self.precision)
+        rest = x & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+            self._count = None
+
+    def merge(self, other: 'HyperLogLog'):
+        if other.precision != self.precision:
+            raise ValueError(f"Cannot merge HLL p={other.precision} into p={self.precision}")
+        # In place: a fresh bytearray swapped in would drop any add() made meanwhile
+        registers = self.registers
+        for index, rank in enumerate(other.registers):
+            if rank > registers[index]:
+                registers[index] = rank
+        self._count = None
+
+    def count(self) -> int:
+        if self._count is None:
+            m = len(self.registers)
+            alpha = 0.7213 / (1 + 1.079 / m)
+            estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+            zeros = self.registers.count(0)
+            if estimate <= 2.5 * m and zeros:
+                estimate = m * math.log(m / zeros)  # linear counting for small sets
+            self._count = int(round(estimate))
+        return self._count
+
+    def to_bytes(self) -> bytes:
+        return bytes([self.precision]) + bytes(self.registers)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'HyperLogLog':
+        sketch = cls(data[0])
+        sketch.registers = bytearray(data[1:])
+        return sketch
+
+
+class ExactSet:
+    """Same interface as HyperLogLog, exact, O(users) memory; for small deployments"""
+    kind = 'exact'
+
+    def __init__(self):
+        self.members = set()
+
+    def add(self, user_id):
+        self.members.add(int(user_id))
+
+    def merge(self, other: 'ExactSet'):
+        self.members |= other.members
+
+    def count(self) -> int:
+        return len(self.members)
+
+    def to_bytes(self) -> bytes:
+        return b''.join(m.to_bytes(8, 'big', signed=True) for m in sorted(self.members))
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'ExactSet':
+        sketch = cls()
+        sketch.members = {int.from_bytes(data[i:i + 8], 'big', signed=True) for i in range(0, len(data), 8)}
+        return sketch
+
+
+SKETCH_TYPES = {'hll': HyperLogLog, 'exact': ExactSet}
+
+
+def encode_sketch(sketch) -> str:
+    return _encode(sketch.to_bytes())
+
+
+def _encode(data: bytes) -> str:
+    return base64.b64encode(zlib.compress(data)).decode()
+
+
+def decode_sketch(kind: str, data: str):
+    return SKETCH_TYPES[kind].from_bytes(zlib.decompress(base64.b64decode(data)))
+
+
+def period_keys(now: datetime) -> Dict[str, str]:
+    iso_year, iso_week, _ = now.isocalendar()
+    return {
+        'day': f"day:{now.strftime('%Y-%m-%d')}",
+        'week': f"week:{iso_year}-W{iso_week:02d}",
+        'month': f"month:{now.strftime('%Y-%m')}",
+    }
+
+
+class ActivityTracker:
+    """One sketch per period key; only the current periods are kept in memory"""
+
+    def __init__(self, mode: str = ACTIVITY_MODE):
+        self.sketch_type = SKETCH_TYPES[mode]
+        self.sketches: Dict[str, object] = {}
+        self.dirty = set()
+
+    def _sketch(self, key: str):
+        sketch = self.sketches.get(key)
+        if sketch is None:
+            sketch = self.sketches[key] = self.sketch_type()
+        return sketch
+
+    def record(self, user_id, now: datetime = None):
+        for key in period_keys(now or datetime.now(timezone.utc)).values():
+            self._sketch(key).add(user_id)
+            self.dirty.add(key)
+
+    def counts(self, now: datetime = None) -> Dict[str, int]:
+        """{'day': DAU, 'week': WAU, 'month': MAU} for the periods containing now"""
+        keys = period_keys(now or datetime.now(timezone.utc))
+        return {period: self.sketches[key].count() if key in self.sketches else 0
+                for period, key in keys.items()}
+
+    def merge_persisted(self, key: str, sketch):
+        if isinstance(sketch, self.sketch_type):
+            self._sketch(key).merge(sketch)
+
+    def prune(self, now: datetime):
+        """Drop finished periods once they've been flushed"""
+        current = set(period_keys(now).values())
+        for key in list(self.sketches):
+            if key not in current and key not in self.dirty:
+                del self.sketches[key]
+
+
+activity_tracker = ActivityTracker()
+
+
+# ==================== PERSISTENCE ====================
+
+def _load_rows(keys: List[str]) -> List[Dict]:
+    result = supabase.table('activity_sketches')\
+        .select('period, kind, sketch')\
+        .in_('period', keys)\
+        .execute()
+    return result.data or []
+
+
+def _load_sketches(keys: List[str]) -> List[Tuple[str, object]]:
+    """Persisted sketches for these periods, decoded (worker thread)"""
+    return [(row['period'], decode_sketch(row['kind'], row['sketch'])) for row in _load_rows(keys)]
+
+
+def _upsert_sketches(rows: List[Dict]):
+    """Compress the snapshots and write them (worker thread)"""
+    for row in rows:
+        row['sketch'] = _encode(row.pop('snapshot'))
+    supabase.table('activity_sketches').upsert(rows).execute()
+
+
+# The sketches themselves are only read and merged on the event loop, where
+# track_activity adds to them; worker threads get decoded copies and byte snapshots
+
+async def load_activity_sketches(now: datetime):
+    """Merge persisted sketches for the current periods into memory (startup)"""
+    persisted = await asyncio.to_thread(_load_sketches, list(period_keys(now).values()))
+    for key, sketch in persisted:
+        activity_tracker.merge_persisted(key, sketch)
+
+
+async def flush_activity_sketches(now: datetime) -> int:
+    """Read-merge-write every dirty sketch so several bot processes can share periods"""
+    keys = list(activity_tracker.dirty)
+    if not keys:
+        return 0
+    # Keys dirtied again while we're writing stay dirty for the next flush
+    activity_tracker.dirty.clear()
+
+    try:
+        for key, sketch in await asyncio.to_thread(_load_sketches, keys):
+            activity_tracker.merge_persisted(key, sketch)
+
+        rows = [{
+            'period': key,
+            'kind': activity_tracker.sketch_type.kind,
+            'snapshot': activity_tracker.sketches[key].to_bytes(),
+            'approx_count': activity_tracker.sketches[key].count(),
+            'updated_at': now.isoformat()
+        } for key in keys]
+        await asyncio.to_thread(_upsert_sketches, rows)
+    except Exception:
+        activity_tracker.dirty.update(keys)
+        raise
+
+    activity_tracker.prune(now)
+    return len(rows)
+
+
+async def flush_activity_job(context: ContextTypes.DEFAULT_TYPE):
+    """Periodic job: persist dirty sketches"""
+    try:
+        await flush_activity_sketches(datetime.now(timezone.utc))
+    except Exception as e:
+        logger.error(f"Error flushing activity sketches: {e}")
+
+
+async def load_activity_job(context: ContextTypes.DEFAULT_TYPE):
+    """Startup job: pick up counts persisted before the restart"""
+    try:
+        await load_activity_sketches(datetime.now(timezone.utc))
+    except Exception as e:
+        logger.error(f"Error loading activity sketches: {e}")
+
+
+async def track_activity(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """TypeHandler (group -1): every handled update counts its user as active"""
+    if update.effective_user:
+        activity_tracker.record(update.effective_user.id)
+
+
+def get_active_user_counts() -> Dict[str, int]:
+    return activity_tracker.counts()
+
+
+def estimate_union(sketches: Iterable) -> int:
+    """Distinct users across several same-kind sketches (e.g. a custom range of days)"""
+    sketches = list(sketches)
+    if not sketches:
+        return 0
+    union = type(sketches[0]).from_bytes(sketches[0].to_bytes())
+    for sketch in sketches[1:]:
+        union.merge(sketch)
+    return union.count()
@@ -1,104 +1,145 @@
+import html
+
 from config import *
+from profiler import sampler, save_profile
+from query_trace import tracer
+from router import Router
+from single_flight import single_flight
+from telegram.constants import ParseMode
 
-async def get_total_users() -> int:
-    try:
-        result = supabase.table('friends_users').select('telegram_id', count='exact').execute()
-        return result.count or 0
-    except Exception as e:
-        logger.error(f"Error getting total users: {e}")
-        return 0
+# In-memory dashboard snapshot: rebuilt by one RPC on a schedule, with
+# totals bumped in place between rebuilds as rows are inserted
+DASHBOARD_STATS = (
+    'total_users', 'premium_users', 'total_birthdays', 'total_tests', 'total_results',
+    'total_streaks', 'longest_streak', 'average_streak'
+)
 
-async def get_total_birthdays() -> int:
-    try:
-        result = supabase.table('birthdays').select('id', count='exact').execute()
-        return result.count or 0
-    except Exception as e:
-        logger.error(f"Error getting total birthdays: {e}")
-        return 0
+_dashboard: Optional[Dict] = None
+_dashboard_at: Optional[datetime] = None
 
-async def get_total_tests() -> int:
-    try:
-        result = supabase.table('tests').select('id', count='exact').execute()
-        return result.count or 0
-    except Exception as e:
-        logger.error(f"Error getting total tests: {e}")
-        return 0
 
-async def get_total_test_results() -> int:
-    try:
-        result = supabase.table('test_results').select('id', count='exact').execute()
-        return result.count or 0
-    except Exception as e:
-        logger.error(f"Error getting total test results: {e}")
-        return 0
+def empty_dashboard_stats() -> Dict:
+    return {name: 0 for name in DASHBOARD_STATS}
 
-async def get_todays_active_users() -> int:
-    try:
-        today_start = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0).isoformat()
-        # Count users who created a birthday or test or result today
-        birthdays_today = supabase.table('birthdays').select('user_id').gte('created_at', today_start).execute()
-        tests_today = supabase.table('tests').select('user_id').gte('created_at', today_start).execute()
-        results_today = supabase.table('test_results').select('user_id').gte('created_at', today_start).execute()
-
-        unique_users = set()
-        for row in (birthdays_today.data or []):
-            unique_users.add(row['user_id'])
-        for row in (tests_today.data or []):
-            unique_users.add(row['user_id'])
-        for row in (results_today.data or []):
-            unique_users.add(row['user_id'])
-        return len(unique_users)
-    except Exception as e:
-        logger.error(f"Error getting today's active users: {e}")
-        return 0
 
-async def get_premium_users() -> int:
-    try:
-        result = supabase.table('friends_users').select('telegram_id', count='exact').eq('is_premium', True).execute()
-        return result.count or 0
-    except Exception as e:
-        logger.error(f"Error getting premium users: {e}")
-        return 0
-    
+def fetch_dashboard_stats() -> Dict:
+    """All dashboard counters in one server-side aggregate"""
+    result = supabase.rpc('admin_dashboard_stats', {}).execute()
+    return {**empty_dashboard_stats(), **(result.data or {})}
 
-async def get_total_streaks():
-    """Get total number of active streaks"""
+
+@single_flight
+async def refresh_dashboard_stats() -> Dict:
+    global _dashboard, _dashboard_at
     try:
-        result = supabase.table('friendship_streaks')\
-            .select('id', count='exact')\
-            .gt('current_streak', 0)\
-            .execute()
-        return result.count if result.count else 0
+        _dashboard = await asyncio.to_thread(fetch_dashboard_stats)
+        _dashboard_at = datetime.now(timezone.utc)
+        logger.info(f"ADMIN_STATS_REFRESHED: {_dashboard}")
     except Exception as e:
-        logger.error(f"Error getting total streaks: {e}")
-        return 0
+        logger.error(f"Error refreshing admin stats: {e}")
+    return _dashboard or empty_dashboard_stats()
+
+
+async def get_dashboard_stats() -> Dict:
+    """Dashboard counters from memory; only the very first call waits for the DB"""
+    if _dashboard is None:
+        await refresh_dashboard_stats()
+    stats = dict(_dashboard or empty_dashboard_stats())
+    stats['updated_at'] = _dashboard_at
+    return stats
+
 
-async def get_longest_streak():
-    """Get the longest current streak"""
+def bump_stat(name: str, delta: int = 1):
+    """Keep a total current between snapshots after an insert"""
+    if _dashboard is not None:
+        _dashboard[name] = _dashboard.get(name, 0) + delta
+
+
+async def refresh_dashboard_stats_job(context: ContextTypes.DEFAULT_TYPE):
+    """Periodic job: rebuild the snapshot so derived stats don't drift"""
+    await refresh_dashboard_stats()
+
+
+async def admin_refresh_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /admin_refresh: force a dashboard rebuild (admins only)"""
+    if update.effective_user.id not in NOTIFICATION_ADMIN_IDS:
+        return
+
+    stats = await refresh_dashboard_stats()
+    await update.message.reply_text(
+        "🔄 <b>Stats refreshed</b>\n\n" + "\n".join(f"• {name}: {stats[name]}" for name in DASHBOARD_STATS),
+        parse_mode=ParseMode.HTML
+    )
+
+
+async def trace_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /trace [on [minutes] | off]: per-update query tracing (admins only)"""
+    if update.effective_user.id not in NOTIFICATION_ADMIN_IDS:
+        return
+
+    action = context.args[0].lower() if context.args else 'status'
+    if action == 'on':
+        try:
+            minutes = float(context.args[1]) if len(context.args) > 1 else QUERY_TRACE_MINUTES
+        except ValueError:
+            minutes = QUERY_TRACE_MINUTES
+        tracer.enable(minutes, QUERY_TRACE_FILE, QUERY_TRACE_REPEAT_THRESHOLD)
+    elif action == 'off':
+        tracer.disable()
+
+    if tracer.enabled:
+        status = f"🔍 <b>Query trace ON</b> for {tracer.remaining_minutes():.1f} more min"
+    else:
+        status = "🔍 <b>Query trace OFF</b>"
+    await update.message.reply_text(
+        f"{status}\n\n• Traced updates: {tracer.traced}\n• Flagged N+1: {tracer.flagged}\n"
+        f"• File: {tracer.path or QUERY_TRACE_FILE or 'logs only'}\n\n/trace on [minutes] | /trace off",
+        parse_mode=ParseMode.HTML
+    )
+    logger.info(f"QUERY_TRACE_COMMAND: User {update.effective_user.id} | {action}")
+
+
+async def run_profile(bot, chat_id: int, seconds: float):
+    """Sample for `seconds`, keep the collapsed stacks locally and send them to the admin"""
     try:
-        result = supabase.table('friendship_streaks')\
-            .select('current_streak')\
-            .order('current_streak', desc=True)\
-            .limit(1)\
-            .execute()
-        if result.data:
-            return result.data[0]['current_streak']
-        return 0
+        profile = await asyncio.to_thread(sampler.run, seconds)
+        path = save_profile(profile, PROFILE_DIR)
+        summary = profile.summary()
+        logger.info(f"PROFILE_DONE: {profile.samples} samples | {path}")
+        await bot.send_document(
+            chat_id=chat_id,
+            document=profile.collapsed().encode(),
+            filename=os.path.basename(path),
+            caption=f"🔬 Profile: {profile.elapsed:.0f} s, {profile.samples} samples\nflamegraph.pl / speedscope.app"
+        )
+        await bot.send_message(chat_id=chat_id, text=f"<pre>{html.escape(summary[:3900])}</pre>", parse_mode=ParseMode.HTML)
     except Exception as e:
-        logger.error(f"Error getting longest streak: {e}")
-        return 0
+        logger.error(f"Error running profile: {e}")
+        await bot.send_message(chat_id=chat_id, text=f"❌ Profile failed: {html.escape(str(e))}")
+
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /profile [seconds]: sample the running process (admins only)"""
+    if update.effective_user.id not in ADMIN_IDS:
+        return
 
-async def get_average_streak():
-    """Get average streak length among active streaks"""
+    if sampler.running:
+        await update.message.reply_text("⏳ A profile is already running")
+        return
     try:
-        result = supabase.table('friendship_streaks')\
-            .select('current_streak')\
-            .gt('current_streak', 0)\
-            .execute()
-        if result.data:
-            streaks = [s['current_streak'] for s in result.data]
-            return sum(streaks) / len(streaks) if streaks else 0
-        return 0
-    except Exception as e:
-        logger.error(f"Error getting average streak: {e}")
-        return 0
\ No newline at end of file
+        seconds = float(context.args[0]) if context.args else PROFILE_SECONDS
+    except ValueError:
+        seconds = PROFILE_SECONDS
+    seconds = max(1.0, min(seconds, PROFILE_MAX_SECONDS))
+
+    # In the background: updates are processed one at a time, and the
+    # profile should see them, not wait behind this handler
+    context.application.create_task(run_profile(context.bot, update.effective_chat.id, seconds))
+    await update.message.reply_text(f"🔬 Profiling for {seconds:.0f} s…")
+    logger.info(f"PROFILE_STARTED: User {update.effective_user.id} | {seconds} s")
+
+
+def register_routes(router: Router):
+    router.command('admin_refresh', admin_refresh_command)
+    router.command('trace', trace_command)
+    router.command('profile', profile_command)
@@ -13,6 +13,7 @@ logger = logging.getLogger(__name__)
 
 # Import from main
 from config import supabase
+from router import Router, REST, callback_data
 
 # Premium subscription prices (in UZS)
 PREMIUM_PRICES = {
@@ -295,6 +296,17 @@ def get_user_language(user_id: int) -> str:
     return 'en'
 
 
+def is_user_premium(user_id: int) -> bool:
+    """Check if user is premium"""
+    try:
+        result = supabase.table('friends_users').select('is_premium').eq('telegram_id', str(user_id)).execute()
+        if result.data:
+            return result.data[0].get('is_premium', False)
+    except Exception as e:
+        logger.error(f"Error checking premium status: {e}")
+    return False
+
+
 def get_period_name(plan_key: str, lang: str) -> str:
     """Get period name in user's language"""
     period_names = {
@@ -395,8 +407,8 @@ async def subscribe_callback(update: Update, context: ContextTypes.DEFAULT_TYPE)
     username = query.from_user.username or query.from_user.first_name
     lang = get_user_language(user_id)
     
-    # Extract plan from callback data
-    plan_key = query.data.replace("subscribe_", "")
+    # Plan from callback data: subscribe_PLAN
+    plan_key = context.args[0]
     
     if plan_key not in PREMIUM_PRICES:
         await query.answer("❌ Invalid plan", show_alert=True)
@@ -459,11 +471,11 @@ Foydalanuvchi to'lov chekini yuboradi.
         [
             InlineKeyboardButton(
                 "✅ Tasdiqlash",
-                callback_data=f"approve_premium_{user_id}_{plan_months}"
+                callback_data=callback_data("approve_premium", user_id, plan_months)
             ),
             InlineKeyboardButton(
                 "❌ Rad etish",
-                callback_data=f"decline_premium_{user_id}_{plan_months}"
+                callback_data=callback_data("decline_premium", user_id, plan_months)
             )
         ]
     ]
@@ -510,11 +522,8 @@ async def approve_premium_payment(update: Update, context: ContextTypes.DEFAULT_
     await query.answer()
     
     try:
-        # Extract user_id and plan from callback data
-        # Format: approve_premium_USER_ID_PLAN
-        data_parts = query.data.split('_')
-        user_id = int(data_parts[2])
-        plan_key = data_parts[3]  # e.g., "1", "3", "6", "12" (months)
+        # Callback data: approve_premium_USER_ID_PLAN
+        user_id, plan_key = context.args  # plan_key e.g. "1", "3", "6", "12" (months)
         
         # Map plan to months
         months_map = {
@@ -582,10 +591,8 @@ async def decline_premium_payment(update: Update, context: ContextTypes.DEFAULT_
     await query.answer()
     
     try:
-        # Extract user_id from callback data
-        # Format: decline_premium_USER_ID_PLAN
-        data_parts = query.data.split('_')
-        user_id = int(data_parts[2])
+        # Callback data: decline_premium_USER_ID_PLAN
+        user_id = context.args[0]
         
         # Get user language
         user_lang = get_user_language(user_id)
@@ -617,4 +624,11 @@ async def decline_premium_payment(update: Update, context: ContextTypes.DEFAULT_
         
     except Exception as e:
         logger.error(f"Error declining premium: {e}")
-        await query.answer("❌ Error processing decline", show_alert=True)
\ No newline at end of file
+        await query.answer("❌ Error processing decline", show_alert=True)
+
+
+def register_routes(router: Router):
+    router.callback('premium', premium_info_handler)
+    router.callback('subscribe', subscribe_callback, REST)
+    router.callback('approve_premium', approve_premium_payment, int, str)
+    router.callback('decline_premium', decline_premium_payment, int, str)
@@ -0,0 +1,741 @@
+"""
+Micro-benchmarks over synthetic data
+
+Usage:
+    python bench.py                 # list benchmarks
+    python bench.py friend_match    # run one
+    python bench.py all
+
+A benchmark that returns False failed its budget; the run then exits 1.
+"""
+import glob
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from statistics import median
+
+# Cold start = fresh interpreter -> import main -> build_application(), median of STARTUP_RUNS
+STARTUP_BUDGET_SECONDS = float(os.environ.get('STARTUP_BUDGET_SECONDS', '1.0'))
+STARTUP_RUNS = 5
+STARTUP_ENV = {
+    'BOT_TOKEN': '123456:startup-bench', 'GOOGLE_API_KEY': 'startup-bench',
+    'ACTIVITY_SUPABASE_URL': 'http://127.0.0.1:54321', 'ACTIVITY_SUPABASE_KEY': 'startup.bench.key',
+}
+_STARTUP_PROBE = '''
+import json, time
+start = time.perf_counter()
+import main, config
+imported = time.perf_counter()
+main.build_application()
+built = time.perf_counter()
+print(json.dumps({
+    'import': imported - start, 'build': built - imported,
+    'eager_clients': [name for name, client in (('supabase', config.supabase._target), ('gemini', config.model._model))
+                      if getattr(client, 'initialized', True)],
+}))
+'''
+
+
+def timeit(fn, repeat: int = 20):
+    """Run fn `repeat` times, return (median_seconds, last_result)"""
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return median(timings), result
+
+
+def random_sheet(rng: random.Random) -> int:
+    from config import TEST_OPTIONS_PER_QUESTION
+    from test_cache import pack_answers
+    return pack_answers({q: rng.randrange(TEST_OPTIONS_PER_QUESTION) for q in range(15)})
+
+
+def bench_friend_match(friends: int = 500):
+    """Similarity matrix + ranking for a user with `friends` connections"""
+    import numpy as np
+    from friend_match import ComparisonBuilder, KNOWS_ME, I_KNOW, ALIKE, SAME_VIEW
+
+    rng = random.Random(42)
+    my_key = random_sheet(rng)
+    rows = []
+    for f in range(friends):
+        friend_id = str(10_000 + f)
+        rows.append((friend_id, KNOWS_ME, random_sheet(rng), my_key))
+        if rng.random() < 0.5:
+            rows.append((friend_id, I_KNOW, random_sheet(rng), random_sheet(rng)))
+        rows.append((friend_id, ALIKE, random_sheet(rng), my_key))
+        for _ in range(rng.randrange(4)):
+            rows.append((friend_id, SAME_VIEW, random_sheet(rng), random_sheet(rng)))
+
+    def run():
+        builder = ComparisonBuilder()
+        for row in rows:
+            builder.add_packed(*row)
+        _, _, overall = builder.compute()
+        return np.argsort(-overall)[:10]
+
+    seconds, top = timeit(run)
+    print(f"friend_match: {friends} friends, {len(rows)} comparisons -> {seconds * 1000:.2f} ms (median)")
+    print(f"  top friend indexes: {[int(i) for i in top]}")
+
+
+class CountingSupabase:
+    """Stand-in client for load tests: counts queries and simulates latency"""
+
+    def __init__(self, latency: float = 0.02, rows=None):
+        self.latency = latency
+        self.rows = rows or {}
+        self.queries = 0
+
+    def table(self, name: str):
+        return _CountingQuery(self, name)
+
+    def rpc(self, name: str, params=None):
+        return _CountingQuery(self, name)
+
+
+class _CountingQuery:
+    def __init__(self, client: CountingSupabase, table: str):
+        self.client = client
+        self.table = table
+
+    def __getattr__(self, _):
+        return lambda *args, **kwargs: self
+
+    @property
+    def not_(self):
+        return self
+
+    def execute(self):
+        from types import SimpleNamespace
+        self.client.queries += 1
+        time.sleep(self.client.latency)
+        data = self.client.rows.get(self.table, [])
+        return SimpleNamespace(data=data, count=len(data))
+
+
+def bench_single_flight(viewers=(1, 10, 100, 1000)):
+    """DB queries for N concurrent leaderboard / viral test / admin stats reads"""
+    import asyncio
+    from unittest import mock
+    import admin
+    import leaderboard
+    import test_cache
+
+    answers = {str(q): q % 4 for q in range(15)}
+    fake = CountingSupabase(rows={'tests': [{'user_id': '1', 'answers': answers, 'archived_at': None}]})
+
+    scenarios = {
+        'leaderboard': lambda: leaderboard.get_leaderboard_snapshot(),
+        'test_definition': lambda: test_cache.load_test_definition('viral-test'),
+        'admin_stats': lambda: admin.refresh_dashboard_stats(),
+    }
+
+    def reset():
+        leaderboard._snapshot = None
+        test_cache.test_cache.invalidate('viral-test')
+
+    async def run(make_call, n):
+        reset()
+        fake.queries = 0
+        start = time.perf_counter()
+        await asyncio.gather(*(make_call() for _ in range(n)))
+        return fake.queries, time.perf_counter() - start
+
+    with mock.patch.object(leaderboard, 'supabase', fake), \
+            mock.patch.object(test_cache, 'supabase', fake), \
+            mock.patch.object(admin, 'supabase', fake):
+        print(f"single_flight: simulated query latency {fake.latency * 1000:.0f} ms")
+        for name, make_call in scenarios.items():
+            for n in viewers:
+                queries, seconds = asyncio.run(run(make_call, n))
+                print(f"  {name:<16} {n:>5} concurrent -> {queries:>2} DB queries, {seconds * 1000:7.1f} ms")
+
+
+class SQLiteQuery:
+    """The supabase builder calls the streak-risk query uses, run as real SQL on SQLite"""
+    _OPS = {'eq': '=', 'gt': '>', 'gte': '>=', 'lt': '<', 'lte': '<='}
+
+    def __init__(self, client: 'SQLiteSupabase', table: str):
+        self.client = client
+        self.table = table
+        self.columns = '*'
+        self.where: list = []
+        self.params: list = []
+        self.ordering: list = []
+        self.row_limit = None
+
+    def select(self, columns: str = '*'):
+        self.columns = columns
+        return self
+
+    def _compare(self, op: str, column: str, value):
+        self.where.append(f"{column} {self._OPS[op]} ?")
+        self.params.append(value)
+        return self
+
+    def eq(self, column, value):
+        return self._compare('eq', column, value)
+
+    def gt(self, column, value):
+        return self._compare('gt', column, value)
+
+    def gte(self, column, value):
+        return self._compare('gte', column, value)
+
+    def lt(self, column, value):
+        return self._compare('lt', column, value)
+
+    def lte(self, column, value):
+        return self._compare('lte', column, value)
+
+    def _logic(self, expr: str, joiner: str) -> str:
+        """PostgREST or=(...)/and(...) text -> SQL, appending its parameters"""
+        import re
+        from fake_supabase import _split_top_level
+        terms = []
+        for part in _split_top_level(expr):
+            nested = re.fullmatch(r'(and|or)\((.*)\)', part)
+            if nested:
+                terms.append(self._logic(nested.group(2), f" {nested.group(1).upper()} "))
+                continue
+            column, op, value = part.split('.', 2)
+            terms.append(f"{column} {self._OPS[op]} ?")
+            value = value.strip('"')
+            self.params.append(int(value) if value.isdigit() else value)
+        return '(' + joiner.join(terms) + ')'
+
+    def or_(self, expr: str):
+        self.where.append(self._logic(expr, ' OR '))
+        return self
+
+    def order(self, column: str, desc: bool = False):
+        self.ordering.append(f"{column} DESC" if desc else column)
+        return self
+
+    def limit(self, n: int):
+        self.row_limit = n
+        return self
+
+    def sql(self) -> str:
+        sql = f"SELECT {self.columns} FROM {self.table}"
+        if self.where:
+            sql += " WHERE " + " AND ".join(self.where)
+        if self.ordering:
+            sql += " ORDER BY " + ", ".join(self.ordering)
+        if self.row_limit is not None:
+            sql += f" LIMIT {self.row_limit}"
+        return sql
+
+    def execute(self):
+        from types import SimpleNamespace
+        self.client.queries.append((self.sql(), list(self.params)))
+        cursor = self.client.connection.execute(self.sql(), self.params)
+        names = [column[0] for column in cursor.description]
+        return SimpleNamespace(data=[dict(zip(names, row)) for row in cursor.fetchall()])
+
+
+class SQLiteSupabase:
+    """Stand-in client backed by an SQLite connection; remembers every statement it ran"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.queries: list = []
+
+    def table(self, name: str) -> SQLiteQuery:
+        return SQLiteQuery(self, name)
+
+
+def bench_streak_risk(rows: int = 1_000_000, budget_seconds: float = 10.0):
+    """iter_at_risk_streaks + group_by_recipient over synthetic friendship_streaks rows (SQLite, shipped index)"""
+    import re
+    import sqlite3
+    from datetime import datetime, timedelta, timezone
+    from unittest import mock
+    import streak_reminders
+
+    rng = random.Random(7)
+    day = 86_400
+    today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    yesterday = today - timedelta(days=1)
+    oldest = int(today.timestamp()) - 60 * day
+    users = max(rows // 4, 2)
+
+    connection = sqlite3.connect(':memory:')
+    connection.execute('CREATE TABLE friendship_streaks (id INTEGER PRIMARY KEY, user_id INTEGER, '
+                       'friend_id INTEGER, current_streak INTEGER, last_interaction TEXT)')
+    # Timestamps stored the way the job compares them: ISO 8601 UTC text
+    connection.executemany('INSERT INTO friendship_streaks VALUES (?, ?, ?, ?, ?)', (
+        (row_id, rng.randrange(1, users), rng.randrange(1, users),
+         rng.randrange(0, 100) if rng.random() < 0.7 else 0,
+         datetime.fromtimestamp(oldest + rng.randrange(61 * day), timezone.utc).isoformat())
+        for row_id in range(1, rows + 1)
+    ))
+    # The partial index exactly as database_schema.sql creates it
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'database_schema.sql')) as schema:
+        index_ddl = re.search(r'create index if not exists friendship_streaks_live_last_id_idx[^;]+;',
+                              schema.read()).group(0)
+    connection.execute(index_ddl)
+    connection.execute('ANALYZE')
+
+    client = SQLiteSupabase(connection)
+
+    def select_and_group():
+        client.queries.clear()
+        candidates = list(streak_reminders.iter_at_risk_streaks(yesterday, today))
+        return len(candidates), len(client.queries), streak_reminders.group_by_recipient(candidates)
+
+    with mock.patch.object(streak_reminders, 'supabase', client):
+        seconds, (matched, pages, grouped) = timeit(select_and_group, repeat=3)
+
+    # A keyset page (second one: with the or_ continuation) must be an index range scan
+    sql, params = client.queries[1] if len(client.queries) > 1 else client.queries[0]
+    plan = [row[-1] for row in connection.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+
+    print(f"streak_risk: {rows:,} streak rows -> {matched:,} at risk in {pages} keyset pages")
+    print(f"  iter_at_risk_streaks + group by recipient: {seconds * 1000:.1f} ms (median) "
+          f"-> {len(grouped):,} messages")
+    print(f"  page query plan: {' | '.join(plan)}")
+    uses_index = any('USING INDEX friendship_streaks_live_last_id_idx (last_interaction>' in step for step in plan)
+    if not uses_index:
+        print("  FAILED: the page query does not range-scan friendship_streaks_live_last_id_idx")
+    if seconds > budget_seconds:
+        print(f"  FAILED: over the {budget_seconds:g} s budget")
+    return uses_index and seconds <= budget_seconds
+
+
+def bench_streak_bitmap(pairs: int = 2000, days: int = 365):
+    """Day bitmap vs streak_interactions row log: storage, update, 90-day count"""
+    import json
+    import sqlite3
+    from datetime import date, timedelta
+    from streak_bitmap import EMPTY_BITMAP, active_days, encode_bitmap, longest_run
+
+    rng = random.Random(3)
+    today = date(2026, 1, 1) + timedelta(days=days - 1)
+    start = today - timedelta(days=days - 1)
+
+    bitmaps, logs = [], []
+    for p in range(pairs):
+        bitmap, log = EMPTY_BITMAP, []
+        for d in range(days):
+            if rng.random() < 0.6:
+                day = start + timedelta(days=d)
+                bitmap = bitmap.with_day(day)
+                for _ in range(rng.randint(1, 3)):
+                    log.append({
+                        'streak_id': p, 'user_id': '100200300', 'friend_id': '400500600',
+                        'interaction_type': 'daily_question', 'interaction_data': {},
+                        'created_at': f'{day.isoformat()}T12:00:00+00:00'
+                    })
+        bitmaps.append(bitmap)
+        logs.append(log)
+
+    bitmap_bytes = sum(len(encode_bitmap(b)['day_bitmap']) // 2 - 1 + 4 for b in bitmaps)  # bytea + date
+    log_rows = sum(len(log) for log in logs)
+    log_bytes = sum(len(json.dumps(row)) for log in logs for row in log)
+
+    since = (today - timedelta(days=89)).isoformat()
+
+    def count_from_log():
+        return [len({row['created_at'][:10] for row in log if row['created_at'] >= since}) for log in logs]
+
+    def count_from_bitmap():
+        return [active_days(b, today, 90) for b in bitmaps]
+
+    def longest_from_log():
+        result = []
+        for log in logs:
+            active = sorted({date.fromisoformat(row['created_at'][:10]) for row in log})
+            best = run = 0
+            for i, day in enumerate(active):
+                run = run + 1 if i and (day - active[i - 1]).days == 1 else 1
+                best = max(best, run)
+            result.append(best)
+        return result
+
+    def longest_from_bitmap():
+        return [longest_run(b) for b in bitmaps]
+
+    # Tomorrow's write, both ways, against SQLite: rewrite the pair's bitmap vs append a log row
+    db = sqlite3.connect(':memory:')
+    db.execute("CREATE TABLE friendship_streaks (id INTEGER PRIMARY KEY, day_bitmap TEXT, bitmap_start TEXT)")
+    db.execute("CREATE TABLE streak_interactions (id INTEGER PRIMARY KEY, streak_id INTEGER, user_id TEXT, "
+               "friend_id TEXT, interaction_type TEXT, interaction_data TEXT, created_at TEXT)")
+    db.executemany("INSERT INTO friendship_streaks VALUES (?, ?, ?)",
+                   [(p, *encode_bitmap(b).values()) for p, b in enumerate(bitmaps)])
+    tomorrow = today + timedelta(days=1)
+    tomorrow_at = f'{tomorrow.isoformat()}T12:00:00+00:00'
+
+    def update_bitmap():
+        with db:
+            for p, b in enumerate(bitmaps):
+                row = encode_bitmap(b.with_day(tomorrow))
+                db.execute("UPDATE friendship_streaks SET day_bitmap = ?, bitmap_start = ? WHERE id = ?",
+                           (row['day_bitmap'], row['bitmap_start'], p))
+
+    def insert_row():
+        with db:
+            for p in range(pairs):
+                db.execute("INSERT INTO streak_interactions (streak_id, user_id, friend_id, interaction_type, "
+                           "interaction_data, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                           (p, '100200300', '400500600', 'daily_question', '{}', tomorrow_at))
+
+    log_count, counts_log = timeit(count_from_log, repeat=3)
+    bitmap_count, counts_bitmap = timeit(count_from_bitmap, repeat=3)
+    log_longest, longest_log = timeit(longest_from_log, repeat=3)
+    bitmap_longest, longest_bitmap = timeit(longest_from_bitmap, repeat=3)
+    update_seconds, _ = timeit(update_bitmap, repeat=3)
+    insert_seconds, _ = timeit(insert_row, repeat=3)
+    assert counts_log == counts_bitmap and longest_log == longest_bitmap
+
+    print(f"streak_bitmap: {pairs} pairs x {days} days, {log_rows:,} logged interactions")
+    print(f"  storage:  bitmap {bitmap_bytes / pairs:7.1f} B/pair | row log ~{log_bytes / pairs:9.1f} B/pair (payload only)")
+    print(f"  90-day active count:  bitmap {bitmap_count * 1e6 / pairs:6.2f} us/pair | row scan {log_count * 1e6 / pairs:8.2f} us/pair")
+    print(f"  longest-ever run:     bitmap {bitmap_longest * 1e6 / pairs:6.2f} us/pair | row scan {log_longest * 1e6 / pairs:8.2f} us/pair")
+    print(f"  daily write (SQLite):  bitmap {update_seconds * 1e6 / pairs:6.2f} us/pair | row insert {insert_seconds * 1e6 / pairs:6.2f} us/pair")
+
+
+def bench_activity(sizes=(100, 10_000, 100_000, 1_000_000)):
+    """HyperLogLog accuracy vs exact distinct counts, plus a 7-day merge"""
+    from activity import HyperLogLog, ExactSet, encode_sketch, estimate_union
+
+    print("activity: HyperLogLog vs exact distinct users")
+    worst = 0.0
+    for n in sizes:
+        hll, exact = HyperLogLog(), ExactSet()
+        for user_id in range(5_000_000_000, 5_000_000_000 + n):
+            hll.add(user_id)
+            hll.add(user_id)  # repeat visits must not count twice
+            exact.add(user_id)
+        error = abs(hll.count() - exact.count()) / exact.count()
+        worst = max(worst, error)
+        print(f"  {n:>9,} users -> estimate {hll.count():>9,} | error {error * 100:5.2f}% | "
+              f"stored {len(encode_sketch(hll)):>6,} B vs exact {len(encode_sketch(exact)):>9,} B")
+
+    # WAU from seven daily sketches with heavy overlap between days
+    rng = random.Random(11)
+    population = list(range(200_000))
+    days, exact_week = [], set()
+    for _ in range(7):
+        sketch = HyperLogLog()
+        for user_id in rng.sample(population, 30_000):
+            sketch.add(user_id)
+            exact_week.add(user_id)
+        days.append(sketch)
+    week = estimate_union(days)
+    error = abs(week - len(exact_week)) / len(exact_week)
+    worst = max(worst, error)
+    print(f"  7 merged days: estimate {week:,} vs exact {len(exact_week):,} | error {error * 100:.2f}%")
+
+    # 4 standard errors at p=14 (~0.81%) is a generous bound for a fixed seed
+    assert worst < 0.035, f"HyperLogLog error {worst:.2%} exceeds bound"
+
+
+def bench_router(updates: int = 50_000):
+    """Callback dispatch cost: one router lookup vs scanning CallbackQueryHandlers in order"""
+    from telegram import Bot, Update
+    from telegram.ext import CallbackQueryHandler
+    import main
+    from router import Router
+
+    router = Router()
+    for module in main.ROUTE_MODULES:
+        module.register_routes(router)
+    main.register_routes(router)
+    routes = router.routes()
+
+    # The old layout: one regex CallbackQueryHandler per route, tried in order
+    handlers = [CallbackQueryHandler(r.callback, pattern=f"^{r.action}$" if not r.arg_types else f"^{r.action}_")
+                for r in routes]
+    routed = router.callback_handler()
+
+    def scan(update):
+        for handler in handlers:
+            result = handler.check_update(update)
+            if result:
+                return result
+        return None
+
+    bot = Bot('123:abc')
+    rng = random.Random(42)
+    samples = [Update.de_json({
+        'update_id': i,
+        'callback_query': {'id': str(i), 'chat_instance': 'c', 'data': r.sample(),
+                           'from': {'id': 1, 'is_bot': False, 'first_name': 'A'}}
+    }, bot) for i, r in enumerate(routes)]
+    workload = [rng.choice(samples) for _ in range(updates)]
+
+    for name, fn in (('router', routed.check_update), ('handler scan', scan)):
+        seconds, _ = timeit(lambda: [fn(update) for update in workload], repeat=5)
+        print(f"router: {name:<12} {len(routes)} routes -> {seconds / updates * 1e9:6.0f} ns/update (median)")
+
+
+def bench_metrics(calls: int = 200_000):
+    """Per-call overhead of the metrics wrapper around a no-op handler"""
+    import asyncio
+    from metrics import instrument, Histogram
+
+    async def handler(update, context):
+        return None
+
+    timed = instrument('bench_noop', handler)
+
+    async def run(fn):
+        start = time.perf_counter()
+        for _ in range(calls):
+            await fn(None, None)
+        return time.perf_counter() - start
+
+    bare = asyncio.run(run(handler))
+    wrapped = asyncio.run(run(timed))
+    print(f"metrics: handler wrapper adds {(wrapped - bare) / calls * 1e9:.0f} ns/call "
+          f"({bare / calls * 1e9:.0f} -> {wrapped / calls * 1e9:.0f} ns)")
+
+    histogram = Histogram()
+    seconds, _ = timeit(lambda: [histogram.observe(0.042) for _ in range(calls)], repeat=5)
+    print(f"  Histogram.observe: {seconds / calls * 1e9:.0f} ns")
+
+
+def bench_e2e():
+    """Full journeys through the real Application (see e2e_bench.py for options)"""
+    from e2e_bench import run_cli
+    run_cli(['--creators', '10'])
+
+
+def bench_viral():
+    """Many takers of one shared test at once (see viral_load.py for options)"""
+    from viral_load import run_cli
+    run_cli(['--levels', '25,50,100'])
+
+
+def bench_logging(calls: int = 100_000, slow_calls: int = 200):
+    """Caller-side cost of a per-tap log line: blocking f-string StreamHandler vs the queued pipeline.
+
+    The listener is started after the timed calls, so "after" numbers are
+    what the event loop pays; formatting and writing happen on its thread.
+    """
+    import logging
+    import logging.handlers
+    import queue
+    from log_pipeline import DeferredQueueHandler, JsonFormatter, SamplingFilter, skip_unused_record_fields
+
+    class SlowPipe:
+        """A stderr pipe whose reader is behind: every write waits 1 ms"""
+        def write(self, text):
+            time.sleep(0.001)
+
+        def flush(self):
+            pass
+
+    answers = {q: q % 4 for q in range(15)}
+    text_format = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    def make_logger(name, handler):
+        log = logging.getLogger(f'bench.{name}')
+        log.handlers[:] = [handler]
+        log.propagate = False
+        log.setLevel(logging.INFO)
+        return log
+
+    def run(label, sink, n):
+        label += ' (lean records)' if logging._srcfile is None else ''
+        blocking = logging.StreamHandler(sink)
+        blocking.setFormatter(text_format)
+        before = make_logger('before', blocking)
+
+        records = queue.SimpleQueue()
+        output = logging.StreamHandler(sink)
+        output.setFormatter(JsonFormatter())
+        queued = DeferredQueueHandler(records)
+        queued.addFilter(SamplingFilter({'TAKING_ANSWER': 0.1}))
+        after = make_logger('after', queued)
+
+        cases = (
+            ('before: per-tap f-string', lambda: before.info(
+                f"Taking test - Question 3 answered with option 2 by user 123. Total answers: {len(answers)}")),
+            ('before: answer dict f-string', lambda: before.info(f"User answers: {answers}")),
+            ('after: lazy, queued', lambda: after.info(
+                "TEST_COMPLETED: User %s | Test %s | Score: %s%%", 123, 'abc', 80)),
+            ('after: per-tap, sampled at 10%', lambda: after.info(
+                "TAKING_ANSWER: User %s | Question %s | Option %s | Answers so far: %s", 123, 3, 2, len(answers))),
+            ('after: answer dict at DEBUG (off)', lambda: after.debug("TEST_ANSWER_SHEETS: User %s", answers)),
+        )
+        for name, log_call in cases:
+            seconds, _ = timeit(lambda: [log_call() for _ in range(n)], repeat=3)
+            print(f"logging: {label:<26} {name:<34} {seconds / n * 1e9:9.0f} ns/call")
+        if not label.startswith('slow pipe'):  # the slow sink would take seconds to drain
+            listener = logging.handlers.QueueListener(records, output)
+            listener.start()
+            listener.stop()
+
+    # setup_logging (run by any earlier benchmark that imported config) makes
+    # records lean process-wide; set each mode explicitly and put it back after
+    switches = ('_srcfile', 'logThreads', 'logProcesses', 'logMultiprocessing')
+    saved = {name: getattr(logging, name) for name in switches}
+    stock = {'_srcfile': os.path.normcase(logging.addLevelName.__code__.co_filename),
+             'logThreads': True, 'logProcesses': True, 'logMultiprocessing': True}
+    try:
+        with open(os.devnull, 'w') as devnull:
+            for name, value in stock.items():
+                setattr(logging, name, value)
+            run('/dev/null', devnull, calls)
+            run('slow pipe', SlowPipe(), slow_calls)
+            skip_unused_record_fields()  # what setup_logging does; "before" gets it too, to be fair
+            run('/dev/null', devnull, calls)
+    finally:
+        for name, value in saved.items():
+            setattr(logging, name, value)
+
+
+def bench_user_data(weeks: int = 4, new_per_day: int = 2000, returning_per_day: int = 3000):
+    """user_data memory over simulated weeks of uptime, with and without idle eviction"""
+    import asyncio
+    import tracemalloc
+    from telegram.ext import Application
+    from config import USER_DATA_IDLE_SECONDS, USER_DATA_MAX_USERS
+    from idle_users import IdleUserEvictor
+
+    def visit(user_data, rng):
+        """What a typical visit leaves behind: language, sometimes a half-done flow"""
+        user_data['language'] = rng.choice(('uz', 'ru', 'en'))
+        if rng.random() < 0.2:
+            user_data['current_question'] = rng.randrange(15)
+            user_data['test_answers'] = {q: rng.randrange(4) for q in range(user_data['current_question'])}
+        if rng.random() < 0.1:
+            user_data['daily_q_friend_id'] = rng.randrange(10 ** 9)
+            user_data['daily_q_question'] = "What is my favourite season?"
+
+    async def simulate(evict: bool):
+        rng = random.Random(5)
+        clock = [0.0]
+        evictor = IdleUserEvictor(USER_DATA_IDLE_SECONDS, USER_DATA_MAX_USERS, clock=lambda: clock[0])
+        application = Application.builder().token('123456:user-data-bench').build()
+        next_user, weekly = 1, []
+        tracemalloc.start()
+        for day in range(weeks * 7):
+            for hour in range(24):
+                clock[0] = (day * 24 + hour) * 3600.0
+                visitors = list(range(next_user, next_user + new_per_day // 24))
+                next_user += len(visitors)
+                visitors += [rng.randrange(1, next_user) for _ in range(returning_per_day // 24)]
+                for user_id in visitors:
+                    evictor.touch(user_id)
+                    visit(application.user_data[user_id], rng)
+                if evict:
+                    await evictor.sweep(application)
+            if day % 7 == 6:
+                weekly.append((len(application.user_data), tracemalloc.get_traced_memory()[0]))
+        tracemalloc.stop()
+        return weekly, evictor
+
+    print(f"user_data: {new_per_day:,} new + {returning_per_day:,} returning users/day, "
+          f"idle after {USER_DATA_IDLE_SECONDS / 3600:g} h, cap {USER_DATA_MAX_USERS:,}")
+    print(f"  {'week':>4} {'kept users':>11} {'traced MB':>10} {'no eviction':>12} {'traced MB':>10}")
+    kept, evictor = asyncio.run(simulate(True))
+    unbounded, _ = asyncio.run(simulate(False))
+    for week, ((users, traced), (all_users, all_traced)) in enumerate(zip(kept, unbounded), 1):
+        print(f"  {week:>4} {users:>11,} {traced / 1e6:>10.1f} {all_users:>12,} {all_traced / 1e6:>10.1f}")
+    print(f"  evicted {evictor.evicted:,} | last footprint estimate {evictor.footprint_bytes / 1e6:.1f} MB")
+    # Flat: the last week holds no more than the first (plus sampling noise)
+    return kept[-1][1] <= kept[0][1] * 1.25
+
+
+def _python(*args, env=None) -> subprocess.CompletedProcess:
+    here = os.path.dirname(os.path.abspath(__file__))
+    return subprocess.run([sys.executable, '-W', 'ignore', *args], capture_output=True, text=True, cwd=here,
+                          env={**os.environ, **STARTUP_ENV, **(env or {})}, timeout=120)
+
+
+def import_costs(top: int = 12):
+    """(first-party modules, heaviest third-party packages) by cumulative import time, via -X importtime"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    first_party = {os.path.basename(path)[:-3] for path in glob.glob(os.path.join(here, '*.py'))}
+    stderr = _python('-X', 'importtime', '-c', 'import main').stderr
+    ours, theirs = {}, {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line.split('|')
+        try:
+            micros = int(cumulative)
+        except ValueError:
+            continue  # the header line
+        name = name.strip()
+        if name in first_party:
+            ours[name] = micros
+        elif '.' not in name:
+            theirs[name] = max(theirs.get(name, 0), micros)
+    by_cost = lambda costs: sorted(costs.items(), key=lambda item: -item[1])[:top]
+    return by_cost(ours), by_cost(theirs)
+
+
+def bench_startup():
+    """Cold start against STARTUP_BUDGET_SECONDS, plus where the import time goes"""
+    runs = []
+    for _ in range(STARTUP_RUNS):
+        probe = _python('-c', _STARTUP_PROBE)
+        if probe.returncode:
+            print(probe.stderr[-2000:])
+            return False
+        runs.append(json.loads(probe.stdout.strip().splitlines()[-1]))
+
+    imported = median(run['import'] for run in runs)
+    built = median(run['build'] for run in runs)
+    print(f"startup: import main {imported * 1000:.0f} ms + build_application {built * 1000:.0f} ms "
+          f"(median of {STARTUP_RUNS}) | budget {STARTUP_BUDGET_SECONDS * 1000:.0f} ms")
+
+    ours, theirs = import_costs()
+    print("  first-party modules (cumulative, includes what they pull in first):")
+    for name, micros in ours:
+        print(f"    {micros / 1000:8.1f} ms  {name}")
+    print("  third-party packages:")
+    for name, micros in theirs:
+        print(f"    {micros / 1000:8.1f} ms  {name}")
+
+    ok = True
+    if imported + built > STARTUP_BUDGET_SECONDS:
+        print(f"  FAIL: cold start {(imported + built) * 1000:.0f} ms is over budget")
+        ok = False
+    if runs[-1]['eager_clients']:
+        print(f"  FAIL: clients created at startup instead of on first use: {', '.join(runs[-1]['eager_clients'])}")
+        ok = False
+    return ok
+
+
+BENCHMARKS = {
+    'friend_match': bench_friend_match,
+    'single_flight': bench_single_flight,
+    'streak_risk': bench_streak_risk,
+    'streak_bitmap': bench_streak_bitmap,
+    'activity': bench_activity,
+    'router': bench_router,
+    'metrics': bench_metrics,
+    'e2e': bench_e2e,
+    'viral': bench_viral,
+    'logging': bench_logging,
+    'user_data': bench_user_data,
+    'startup': bench_startup,
+}
+
+
+if __name__ == '__main__':
+    names = sys.argv[1:]
+    if not names:
+        print("Available benchmarks: " + ", ".join(BENCHMARKS))
+        sys.exit(0)
+    if names == ['all']:
+        names = list(BENCHMARKS)
+    failed = False
+    for name in names:
+        if name not in BENCHMARKS:
+            print(f"Unknown benchmark: {name}")
+            sys.exit(1)
+        failed |= BENCHMARKS[name]() is False
+    sys.exit(1 if failed else 0)
@@ -4,7 +4,7 @@ from datetime import datetime, timezone, timedelta
 import asyncio
 import json
 import uuid
-from typing import Dict, List, Optional
+from typing import TYPE_CHECKING, Dict, List, Optional
 
 from telegram import (
     Update, InlineKeyboardButton, InlineKeyboardMarkup
@@ -14,14 +14,13 @@ from telegram.ext import (
     CallbackQueryHandler, filters, ContextTypes
 )
 
-import google.generativeai as genai
-from supabase import create_client, Client
+from lazy import Lazy
+from log_pipeline import setup_logging
+from metrics import instrument_model, instrument_supabase
+
+if TYPE_CHECKING:
+    from supabase import Client
 
-# Logging setup
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", 
-    level=logging.INFO
-)
 logger = logging.getLogger(__name__)
 
 from dotenv import load_dotenv
@@ -35,12 +34,22 @@ SUPABASE_URL = os.environ.get("ACTIVITY_SUPABASE_URL")
 SUPABASE_KEY = os.environ.get("ACTIVITY_SUPABASE_KEY")
 GOOGLE_API_KEY = os.environ.get("GOOGLE_API_KEY")
 
-# Configure Gemini
-genai.configure(api_key=GOOGLE_API_KEY)
-model = genai.GenerativeModel("gemini-2.5-flash")
 
-# Supabase client
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+def _create_model():
+    import google.generativeai as genai
+    genai.configure(api_key=GOOGLE_API_KEY)
+    return genai.GenerativeModel("gemini-2.5-flash")
+
+
+def _create_supabase() -> 'Client':
+    from supabase import create_client
+    return create_client(SUPABASE_URL, SUPABASE_KEY)
+
+
+# Both SDKs are slow to import, so they load on first use rather than at
+# startup; every query/call is still counted per handler (see metrics.py)
+model = instrument_model(Lazy(_create_model, 'gemini'))
+supabase: 'Client' = instrument_supabase(Lazy(_create_supabase, 'supabase'))
 
 
 ADMIN_USERNAME="@Simplelearn_main_admin"
@@ -78,6 +87,21 @@ REMINDER_ADVANCE_DAYS = 0  # Days before birthday to send reminder (0 = on the d
 # Test settings
 TOTAL_TEST_QUESTIONS = 15
 TEST_OPTIONS_PER_QUESTION = 4
+ARCHIVED_TEST_RETENTION_DAYS = 30  # Keep per-taker results of recreated tests this long
+TEST_COMPACTION_BATCH_SIZE = 200  # Archived tests compacted per batch
+TEST_COMPACTION_MAX_BATCHES = 100  # Per run; the next run resumes where this one stopped
+
+# Streak settings
+STREAK_EXPIRY_BATCH_SIZE = 1000  # Stale streaks reset per sweep statement
+STREAK_RISK_REMINDER_TIME_UTC = "15:00"  # Evening in Tashkent (UTC+5)
+STREAK_RISK_PAGE_SIZE = 1000  # At-risk pairs fetched per keyset page
+STREAK_RISK_MAX_BUTTONS = 5  # Ping buttons per reminder message
+STREAK_RESTORE_MAX_GAP_DAYS = 2  # Longest run of missed days a restore can fill (premium)
+STREAK_RESTORE_WINDOW_DAYS = 7  # Only breaks this recent can be restored
+INTERACTION_RAW_RETENTION_DAYS = 30  # Raw streak_interactions kept this long, then rolled up
+INTERACTION_ROLLUP_BATCH_SIZE = 500  # Raw events archived + rolled up per statement
+INTERACTION_ROLLUP_MAX_BATCHES = 200  # Per run; the next run resumes where this one stopped
+INTERACTION_ARCHIVE_DIR = os.environ.get("INTERACTION_ARCHIVE_DIR", "archive/streak_interactions")
 
 # AI settings
 GEMINI_MODEL = "gemini-2.5-flash"
@@ -103,11 +127,42 @@ DB_POOL_SIZE = 10
 # Cache settings (for future optimization)
 CACHE_TTL_SECONDS = 300  # 5 minutes
 ENABLE_CACHING = False
-
-# Logging
-LOG_LEVEL = "INFO"
-LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-LOG_FILE = "bot.log"
+TEST_CACHE_MAX_ENTRIES = 2048  # Test definitions kept in memory (LRU)
+LEADERBOARD_REFRESH_SECONDS = 300  # Rebuild the leaderboard snapshot at least this often
+LEADERBOARD_DEBOUNCE_SECONDS = 30  # Coalesce refreshes triggered by new results/streaks
+ADMIN_STATS_REFRESH_SECONDS = 600  # Admin dashboard snapshot age before a background rebuild
+
+# Activity tracking (DAU/WAU/MAU)
+ACTIVITY_MODE = os.environ.get("ACTIVITY_MODE", "hll")  # "hll" (fixed 16 KB per period) or "exact" (small deployments)
+ACTIVITY_HLL_PRECISION = 14  # 2**14 registers, ~0.8% standard error
+ACTIVITY_FLUSH_SECONDS = 300  # Persist sketches this often
+
+# Metrics (Prometheus text format on http://METRICS_HOST:METRICS_PORT/metrics; port 0 disables)
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "9108"))
+QUERY_TRACE_MINUTES = 10  # /trace on switches tracing off again after this long
+QUERY_TRACE_REPEAT_THRESHOLD = 3  # Same query shape this often in one update = probable N+1
+QUERY_TRACE_FILE = os.environ.get("QUERY_TRACE_FILE")  # JSON lines per traced update; logs only when unset
+LOOP_MONITOR_INTERVAL = float(os.environ.get("LOOP_MONITOR_INTERVAL", "0.5"))  # seconds between lag samples; 0 disables
+LOOP_STALL_THRESHOLD = float(os.environ.get("LOOP_STALL_THRESHOLD", "0.25"))  # lag that logs a stall with its stack
+PROFILE_SECONDS = 30  # /profile without an argument
+PROFILE_MAX_SECONDS = 300
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")  # collapsed stacks are kept here too
+
+# Logging (queued, written by a background thread; see log_pipeline.py)
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"  # when LOG_JSON=0
+LOG_FILE = os.environ.get("LOG_FILE", "bot.log")  # empty = stderr only
+LOG_JSON = os.environ.get("LOG_JSON", "1") == "1"
+# Fraction of these per-tap events that get logged
+LOG_SAMPLE_RATES = {
+    'TEST_ANSWER': 0.1,
+    'TAKING_ANSWER': 0.1,
+    'ACTION': 0.25,
+    'SUCCESS': 0.25,
+}
+
+setup_logging(LOG_LEVEL, LOG_FILE, LOG_JSON, LOG_FORMAT, LOG_SAMPLE_RATES)
 
 # Feature flags
 ENABLE_ANALYTICS = True
@@ -123,9 +178,21 @@ TIMEZONE_DETECTION_ENABLED = False  # Auto-detect user timezone (future)
 WISH_LENGTH_MIN = 50  # Minimum characters in generated wish
 WISH_LENGTH_MAX = 200  # Maximum characters in generated wish
 
+# In-progress tests, daily answers and conversation states survive restarts (see persistence.py)
+PERSISTENCE_FILE = os.environ.get("PERSISTENCE_FILE", "bot_state.sqlite3")  # empty = memory only
+PERSISTENCE_UPDATE_SECONDS = 5  # Changes are written in one batch this often (and at shutdown)
+PERSISTENCE_RETENTION_DAYS = 30  # Unfinished flows untouched this long are dropped
+USER_DATA_IDLE_SECONDS = 6 * 3600  # user_data of users idle this long leaves memory (see idle_users.py)
+USER_DATA_MAX_USERS = 50_000  # Least recently seen users beyond this are evicted too
+USER_DATA_SWEEP_SECONDS = 600
+
+# Pause between an intro message and the first question (seconds; benchmarks set 0)
+UX_PAUSE_SECONDS = float(os.environ.get("UX_PAUSE_SECONDS", "1"))
+
 # Notification settings
 NOTIFY_ON_TEST_COMPLETION = True
 NOTIFY_TEST_CREATOR = True
+NOTIFICATION_SEND_RATE = 25  # Messages per second for bulk notifications (Telegram allows ~30)
 
 
 import traceback
@@ -140,11 +207,11 @@ def log_user_action(action_name: str):
             user_id = user.id if user else "Unknown"
             username = user.username if user else "Unknown"
             
-            logger.info(f"ACTION: {action_name} | User: {user_id} (@{username})")
+            logger.info("ACTION: %s | User: %s (@%s)", action_name, user_id, username)
             
             try:
                 result = await func(update, context, *args, **kwargs)
-                logger.info(f"SUCCESS: {action_name} | User: {user_id}")
+                logger.info("SUCCESS: %s | User: %s", action_name, user_id)
                 return result
             except Exception as e:
                 logger.error(f"ERROR: {action_name} | User: {user_id} | Error: {str(e)}")
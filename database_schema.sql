@@ -0,0 +1,402 @@
+-- Schema additions used by the bot on top of the base Supabase tables
+-- (friends_users, birthdays, tests, test_results, friendship_streaks,
+-- streak_interactions, friend_info). Every statement is idempotent so the
+-- whole file can be re-run in the Supabase SQL editor after each deploy.
+
+
+-- ============================================================
+-- Per-test score aggregates (My Tests view)
+-- ============================================================
+
+create unique index if not exists test_results_test_user_key
+    on test_results (test_id, user_id);
+
+create index if not exists test_results_test_score_idx
+    on test_results (test_id, score desc, created_at);
+
+-- Taker's own answers, 3 bits per question (see test_cache.pack_answers)
+alter table test_results add column if not exists answers_packed bigint;
+
+create index if not exists test_results_user_idx
+    on test_results (user_id);
+
+create table if not exists test_score_aggregates (
+    test_id uuid primary key references tests (id) on delete cascade,
+    participants integer not null default 0,
+    score_sum bigint not null default 0,
+    min_score integer,
+    max_score integer,
+    -- histogram[s + 1] = number of takers with score s (0-100)
+    histogram integer[] not null default array_fill(0, array[101]),
+    updated_at timestamptz not null default now()
+);
+
+-- Upserts a taker's result and keeps the aggregate row in sync in one
+-- transaction. Returns the previous score when the taker already had a
+-- result (retake), otherwise null.
+drop function if exists record_test_result(uuid, text, integer);
+create or replace function record_test_result(
+    p_test_id uuid,
+    p_user_id text,
+    p_score integer,
+    p_answers_packed bigint default null
+)
+returns integer
+language plpgsql
+as $$
+declare
+    v_old integer;
+    v_hist integer[];
+begin
+    insert into test_score_aggregates (test_id) values (p_test_id)
+    on conflict (test_id) do nothing;
+
+    -- Row lock serializes concurrent takers of the same test
+    select histogram into v_hist
+    from test_score_aggregates
+    where test_id = p_test_id
+    for update;
+
+    select score into v_old
+    from test_results
+    where test_id = p_test_id and user_id = p_user_id;
+
+    insert into test_results (test_id, user_id, score, answers_packed, created_at)
+    values (p_test_id, p_user_id, p_score, p_answers_packed, now())
+    on conflict (test_id, user_id)
+    do update set
+        score = excluded.score,
+        answers_packed = excluded.answers_packed,
+        created_at = excluded.created_at;
+
+    if v_old is not null then
+        v_hist[v_old + 1] := v_hist[v_old + 1] - 1;
+    end if;
+    v_hist[p_score + 1] := v_hist[p_score + 1] + 1;
+
+    update test_score_aggregates set
+        participants = participants + (case when v_old is null then 1 else 0 end),
+        score_sum = score_sum - coalesce(v_old, 0) + p_score,
+        histogram = v_hist,
+        min_score = (select min(i) - 1 from generate_subscripts(v_hist, 1) as i where v_hist[i] > 0),
+        max_score = (select max(i) - 1 from generate_subscripts(v_hist, 1) as i where v_hist[i] > 0),
+        updated_at = now()
+    where test_id = p_test_id;
+
+    return v_old;
+end;
+$$;
+
+-- One-off backfill for tests that already have results
+insert into test_score_aggregates (test_id, participants, score_sum, min_score, max_score, histogram)
+select
+    r.test_id,
+    count(*),
+    sum(r.score),
+    min(r.score),
+    max(r.score),
+    array(
+        select count(r2.*)::integer
+        from generate_series(0, 100) as s
+        left join test_results r2 on r2.test_id = r.test_id and r2.score = s
+        group by s
+        order by s
+    )
+from test_results r
+group by r.test_id
+on conflict (test_id) do nothing;
+
+
+-- ============================================================
+-- Soft-versioned tests (recreate archives instead of deleting)
+-- ============================================================
+
+alter table tests add column if not exists version integer not null default 1;
+alter table tests add column if not exists archived_at timestamptz;
+alter table tests add column if not exists compacted_at timestamptz;
+
+-- Active-version lookups: "the user's current test"
+create index if not exists tests_active_user_idx
+    on tests (user_id, created_at desc)
+    where archived_at is null;
+
+-- Compaction job scans archived, not yet compacted tests
+create index if not exists tests_archived_pending_idx
+    on tests (archived_at)
+    where archived_at is not null and compacted_at is null;
+
+-- New tests get the next version number for their owner
+create or replace function set_test_version()
+returns trigger
+language plpgsql
+as $$
+begin
+    select coalesce(max(version), 0) + 1 into new.version
+    from tests
+    where user_id = new.user_id;
+    return new;
+end;
+$$;
+
+drop trigger if exists tests_set_version on tests;
+create trigger tests_set_version
+    before insert on tests
+    for each row execute function set_test_version();
+
+
+-- ============================================================
+-- Background job bookkeeping
+-- ============================================================
+
+create table if not exists job_runs (
+    id            bigserial primary key,
+    job_name      text not null,
+    started_at    timestamptz not null,
+    finished_at   timestamptz not null default now(),
+    rows_affected integer not null default 0,
+    details       jsonb
+);
+
+create index if not exists job_runs_name_idx
+    on job_runs (job_name, started_at desc);
+
+
+-- ============================================================
+-- Streak expiry (nightly sweep of abandoned pairs)
+-- ============================================================
+
+-- Only live streaks are indexed, so leaderboard/admin reads and the sweep
+-- touch rows that can actually change and the indexes shrink as pairs expire
+create index if not exists friendship_streaks_live_rank_idx
+    on friendship_streaks (current_streak desc)
+    where current_streak > 0;
+
+create index if not exists friendship_streaks_live_last_idx
+    on friendship_streaks (last_interaction)
+    where current_streak > 0;
+
+-- Reset up to p_batch_size live streaks last touched before p_cutoff
+create or replace function expire_stale_streaks(p_cutoff timestamptz, p_batch_size integer)
+returns integer
+language plpgsql
+as $$
+declare
+    v_count integer;
+begin
+    with stale as (
+        select id
+        from friendship_streaks
+        where current_streak > 0
+          and (last_interaction is null or last_interaction < p_cutoff)
+        limit p_batch_size
+        for update skip locked
+    )
+    update friendship_streaks s
+    set current_streak = 0
+    from stale
+    where s.id = stale.id;
+
+    get diagnostics v_count = row_count;
+    return v_count;
+end;
+$$;
+
+
+-- ============================================================
+-- Streak-at-risk reminders
+-- ============================================================
+
+-- Keyset pagination over (last_interaction, id) for pairs that talked
+-- yesterday but not yet today; also serves the expiry sweep
+drop index if exists friendship_streaks_live_last_idx;
+create index if not exists friendship_streaks_live_last_id_idx
+    on friendship_streaks (last_interaction, id)
+    where current_streak > 0;
+
+
+-- ============================================================
+-- Streak day bitmaps and premium restores
+-- ============================================================
+
+-- Bit i of day_bitmap (get_bit/set_bit numbering) = the pair interacted on
+-- bitmap_start + i days. One year of history is 46 bytes per pair.
+alter table friendship_streaks add column if not exists day_bitmap bytea;
+alter table friendship_streaks add column if not exists bitmap_start date;
+
+create or replace function streak_bitmap_ones(p_days integer)
+returns bytea
+language plpgsql
+immutable
+as $$
+declare
+    v_bits bytea := decode(repeat('00', greatest((p_days + 7) / 8, 1)), 'hex');
+begin
+    for i in 0 .. p_days - 1 loop
+        v_bits := set_bit(v_bits, i, 1);
+    end loop;
+    return v_bits;
+end;
+$$;
+
+-- One-off backfill: the current run is the only history we can reconstruct
+update friendship_streaks
+set bitmap_start = (last_interaction at time zone 'utc')::date - (current_streak - 1),
+    day_bitmap = streak_bitmap_ones(current_streak)
+where day_bitmap is null
+  and current_streak > 0
+  and last_interaction is not null;
+
+-- One restore token per user per period (calendar month)
+create table if not exists streak_restores (
+    id             bigserial primary key,
+    user_id        text not null,
+    streak_id      bigint not null references friendship_streaks (id) on delete cascade,
+    period         text not null,
+    restored_days  integer not null,
+    restored_streak integer not null,
+    created_at     timestamptz not null default now(),
+    unique (user_id, period)
+);
+
+-- Advance a streak for today's interaction in one locked statement:
+-- same-day / next-day / missed-days logic plus setting today's bitmap bit
+create or replace function record_streak_interaction(p_streak_id bigint, p_now timestamptz default now())
+returns table (out_streak integer, out_previous integer, out_outcome text)
+language plpgsql
+as $$
+declare
+    v_row     friendship_streaks%rowtype;
+    v_today   date := (p_now at time zone 'utc')::date;
+    v_last    date;
+    v_streak  integer;
+    v_outcome text;
+    v_start   date;
+    v_bits    bytea;
+    v_index   integer;
+begin
+    select * into v_row
+    from friendship_streaks
+    where id = p_streak_id
+    for update;
+
+    if not found then
+        return;
+    end if;
+
+    v_last := (v_row.last_interaction at time zone 'utc')::date;
+
+    if v_row.last_interaction is null then
+        v_streak := 1;
+        v_outcome := 'first';
+    elsif v_today <= v_last then
+        return query select v_row.current_streak, v_row.current_streak, 'same_day'::text;
+        return;
+    elsif v_today - v_last = 1 then
+        v_streak := coalesce(v_row.current_streak, 0) + 1;
+        v_outcome := 'increment';
+    else
+        v_streak := 1;
+        v_outcome := 'reset';
+    end if;
+
+    v_start := coalesce(v_row.bitmap_start, v_today);
+    v_bits := coalesce(v_row.day_bitmap, '\x00'::bytea);
+    v_index := v_today - v_start;
+    if v_index >= length(v_bits) * 8 then
+        v_bits := v_bits || decode(repeat('00', v_index / 8 + 1 - length(v_bits)), 'hex');
+    end if;
+    v_bits := set_bit(v_bits, v_index, 1);
+
+    update friendship_streaks
+    set current_streak = v_streak,
+        longest_streak = greatest(coalesce(longest_streak, 0), v_streak),
+        last_interaction = p_now,
+        day_bitmap = v_bits,
+        bitmap_start = v_start
+    where id = p_streak_id;
+
+    return query select v_streak, v_row.current_streak, v_outcome;
+end;
+$$;
+
+
+-- ============================================================
+-- streak_interactions rollup and retention
+-- ============================================================
+
+-- Daily per-pair counts that replace raw events past retention
+create table if not exists streak_interaction_daily (
+    streak_id        bigint not null,
+    day              date not null,
+    interaction_type text not null,
+    count            integer not null default 0,
+    primary key (streak_id, day, interaction_type)
+);
+
+create index if not exists streak_interactions_created_idx
+    on streak_interactions (created_at, id);
+
+-- Fold the given raw rows into daily counts and delete them, atomically,
+-- so a crashed run can never count the same event twice
+create or replace function rollup_streak_interactions(p_ids bigint[])
+returns integer
+language plpgsql
+as $$
+declare
+    v_count integer;
+begin
+    insert into streak_interaction_daily (streak_id, day, interaction_type, count)
+    select streak_id, (created_at at time zone 'utc')::date, interaction_type, count(*)
+    from streak_interactions
+    where id = any (p_ids)
+    group by 1, 2, 3
+    on conflict (streak_id, day, interaction_type)
+    do update set count = streak_interaction_daily.count + excluded.count;
+
+    delete from streak_interactions where id = any (p_ids);
+    get diagnostics v_count = row_count;
+    return v_count;
+end;
+$$;
+
+
+-- ============================================================
+-- Admin dashboard counters (one round trip, no row downloads)
+-- ============================================================
+
+-- test_results(created_at) also serves the weekly leaderboard range
+create index if not exists birthdays_created_idx on birthdays (created_at);
+create index if not exists tests_created_idx on tests (created_at);
+create index if not exists test_results_created_idx on test_results (created_at);
+
+create or replace function admin_dashboard_stats()
+returns jsonb
+language sql
+stable
+as $$
+    select jsonb_build_object(
+        'total_users',     (select count(*) from friends_users),
+        'premium_users',   (select count(*) from friends_users where is_premium),
+        'total_birthdays', (select count(*) from birthdays),
+        'total_tests',     (select count(*) from tests),
+        'total_results',   (select count(*) from test_results),
+        'total_streaks',   (select count(*) from friendship_streaks where current_streak > 0),
+        'longest_streak',  (select coalesce(max(current_streak), 0) from friendship_streaks where current_streak > 0),
+        'average_streak',  (select coalesce(avg(current_streak), 0) from friendship_streaks where current_streak > 0)
+    );
+$$;
+
+
+-- ============================================================
+-- Activity sketches (DAU/WAU/MAU)
+-- ============================================================
+
+-- One row per period ('day:2026-10-19', 'week:2026-W43', 'month:2026-10');
+-- sketch is base64(zlib(HyperLogLog registers or exact id list))
+create table if not exists activity_sketches (
+    period       text primary key,
+    kind         text not null,
+    sketch       text not null,
+    approx_count integer not null default 0,
+    updated_at   timestamptz not null default now()
+);
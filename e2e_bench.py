@@ -0,0 +1,436 @@
+"""
+End-to-end benchmark: the real Application against a fake Bot API and an in-memory Supabase
+
+Scripted user journeys (start, create a test, share, friends take it, streak
+ping, leaderboard, add a birthday) are fed through Application.process_update;
+every step is timed and its DB/Bot API/Gemini calls counted.
+
+Usage:
+    python e2e_bench.py                                  # defaults, table output
+    python e2e_bench.py --creators 50 --friends 5 --json run.json
+    python e2e_bench.py --json new.json --compare base.json   # exit 1 on regression
+    python e2e_bench.py --db supabase                    # use ACTIVITY_SUPABASE_URL (e.g. a local stack)
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import re
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+# The bot reads these at import time; the harness never talks to real services
+for name, value in (
+    ('BOT_TOKEN', '123456:e2e-bench'), ('GOOGLE_API_KEY', 'e2e-bench'),
+    ('ACTIVITY_SUPABASE_URL', 'http://127.0.0.1:54321'), ('ACTIVITY_SUPABASE_KEY', 'e2e.bench.key'),
+    ('UX_PAUSE_SECONDS', '0'), ('METRICS_PORT', '0'), ('PERSISTENCE_FILE', ''),
+):
+    os.environ.setdefault(name, value)
+
+from aiohttp import web
+from telegram import Update
+
+import config
+from fake_supabase import FakeSupabase
+import metrics
+from metrics import InstrumentedRequest
+
+logger = logging.getLogger(__name__)
+
+BOT_USER = {'id': 123456, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot',
+            'can_join_groups': True, 'can_read_all_group_messages': False, 'supports_inline_queries': False}
+BIRTHDAY_TEXT = 'Aziza 12.03'
+TEST_LINK = re.compile(r'start=s_([0-9a-f-]{36})')
+REGRESSION_PERCENT = 20.0
+DB_BACKENDS = ('memory', 'supabase')  # in-memory stand-in, or the configured client
+CHAT_BURST = 3  # messages a chat may take at once before chat_limit applies
+RATE_LIMITED = ('sendMessage', 'sendPhoto', 'sendDocument', 'editMessageText', 'editMessageCaption')
+
+
+class StepCalls:
+    __slots__ = ('db', 'api', 'gemini')
+
+    def __init__(self):
+        self.db = 0
+        self.api = 0
+        self.gemini = 0
+
+
+# Calls made while processing one update; asyncio.to_thread copies the
+# context, so queries from worker threads are counted too
+_step: ContextVar[Optional[StepCalls]] = ContextVar('e2e_step', default=None)
+
+
+def _count(attr: str):
+    calls = _step.get()
+    if calls is not None:
+        setattr(calls, attr, getattr(calls, attr) + 1)
+
+
+# Counted where the bot's queries are timed, so the real client is counted too
+metrics.db_call_hooks.append(lambda: _count('db'))
+
+
+class HarnessRequest(InstrumentedRequest):
+    async def do_request(self, *args, **kwargs):
+        _count('api')
+        return await super().do_request(*args, **kwargs)
+
+
+class FakeGemini:
+    """Answers every prompt with one parsed birthday after `latency` seconds"""
+
+    class Response:
+        text = json.dumps([{'name': 'Aziza', 'day': 12, 'month': 3, 'year': None}])
+
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def generate_content(self, *args, **kwargs):
+        _count('gemini')
+        time.sleep(self.latency)
+        return self.Response()
+
+
+# ==================== FAKE BOT API ====================
+
+class FakeBotAPI:
+    """Just enough of the Bot API for the bot's replies; remembers what each chat was sent.
+
+    With chat_limit, each chat gets a token bucket (chat_limit messages per
+    second, bursts of CHAT_BURST); past it the API answers 429 with
+    retry_after, like Telegram's per-chat flood control.
+    """
+
+    def __init__(self, latency: float, chat_limit: int = 0):
+        self.latency = latency
+        self.chat_limit = chat_limit
+        self.calls: Dict[str, int] = defaultdict(int)
+        self.sent: Dict[int, List[str]] = defaultdict(list)
+        self.sent_at: Dict[int, List[float]] = defaultdict(list)  # time.monotonic() per delivered message
+        self.rejected: Dict[int, int] = defaultdict(int)
+        self._buckets: Dict[int, List[float]] = {}  # chat -> [tokens, refilled at]
+        self.last_message_id: Dict[int, int] = {}
+        self._message_ids = itertools.count(1)
+        self.url = ''
+        self._runner: Optional[web.AppRunner] = None
+
+    async def start(self, host: str = '127.0.0.1'):
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f'http://{host}:{port}/bot'
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+    def _flooded(self, chat_id: int) -> bool:
+        now = time.monotonic()
+        bucket = self._buckets.setdefault(chat_id, [CHAT_BURST, now])
+        bucket[0] = min(CHAT_BURST, bucket[0] + (now - bucket[1]) * self.chat_limit)
+        bucket[1] = now
+        if bucket[0] < 1:
+            return True
+        bucket[0] -= 1
+        return False
+
+    def _message(self, params: Dict) -> Dict:
+        chat_id = int(params.get('chat_id', 0))
+        text = params.get('text') or params.get('caption') or ''
+        message_id = int(params['message_id']) if 'message_id' in params else next(self._message_ids)
+        self.sent[chat_id].append(text)
+        self.sent_at[chat_id].append(time.monotonic())
+        self.last_message_id[chat_id] = message_id
+        return {'message_id': message_id, 'date': int(time.time()), 'text': text,
+                'chat': {'id': chat_id, 'type': 'private'}, 'from': BOT_USER}
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        params = dict(await request.post())
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if self.chat_limit and method in RATE_LIMITED and self._flooded(int(params.get('chat_id', 0))):
+            self.rejected[int(params.get('chat_id', 0))] += 1
+            return web.json_response({'ok': False, 'error_code': 429, 'description': 'Too Many Requests: retry after 1',
+                                      'parameters': {'retry_after': 1}}, status=429)
+
+        if method == 'getMe':
+            result = BOT_USER
+        elif method in ('sendMessage', 'sendPhoto', 'editMessageText', 'editMessageCaption',
+                        'editMessageReplyMarkup', 'sendDocument'):
+            result = self._message(params)
+        else:
+            result = True  # answerCallbackQuery, sendChatAction, deleteMessage, ...
+        return web.json_response({'ok': True, 'result': result})
+
+
+# ==================== JOURNEYS ====================
+
+class Harness:
+    def __init__(self, application, api: FakeBotAPI):
+        self.application = application
+        self.api = api
+        self.timings: Dict[str, List[float]] = defaultdict(list)
+        self.calls: Dict[str, List[StepCalls]] = defaultdict(list)
+        self.errors = 0
+        self._update_ids = itertools.count(1)
+
+    def _user(self, user_id: int) -> Dict:
+        return {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}', 'username': f'user{user_id}'}
+
+    def _message(self, user_id: int, text: str) -> Dict:
+        message = {
+            'message_id': next(self.api._message_ids), 'date': int(time.time()), 'text': text,
+            'chat': {'id': user_id, 'type': 'private'}, 'from': self._user(user_id),
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return message
+
+    async def step(self, name: str, user_id: int, text: str = None, data: str = None):
+        """Process one update as `name`; exactly one of text/data"""
+        update_id = next(self._update_ids)
+        if data is not None:
+            payload = {'update_id': update_id, 'callback_query': {
+                'id': str(update_id), 'chat_instance': str(user_id), 'data': data, 'from': self._user(user_id),
+                'message': {'message_id': self.api.last_message_id.get(user_id, 1), 'date': int(time.time()),
+                            'text': '', 'chat': {'id': user_id, 'type': 'private'}, 'from': BOT_USER},
+            }}
+        else:
+            payload = {'update_id': update_id, 'message': self._message(user_id, text)}
+        update = Update.de_json(payload, self.application.bot)
+
+        calls = StepCalls()
+        token = _step.set(calls)
+        start = time.perf_counter()
+        try:
+            await self.application.process_update(update)
+        finally:
+            self.timings[name].append(time.perf_counter() - start)
+            self.calls[name].append(calls)
+            _step.reset(token)
+
+    def test_link(self, user_id: int) -> Optional[str]:
+        for text in reversed(self.api.sent[user_id]):
+            match = TEST_LINK.search(text)
+            if match:
+                return match.group(1)
+        return None
+
+    async def friend_takes_test(self, friend_id: int, test_id: str, answers):
+        await self.step('friend_open_test', friend_id, text=f'/start s_{test_id}')
+        await self.step('friend_choose_language', friend_id, data='lang_en')
+        for question, answer in enumerate(answers):
+            await self.step('submit_test' if question == 14 else 'take_question', friend_id, data=f'taking_answer_{answer}')
+
+    async def journey(self, creator_id: int, friends: int):
+        await self.step('start', creator_id, text='/start')
+        await self.step('choose_language', creator_id, data='lang_en')
+        await self.step('create_test', creator_id, data='create_test')
+        for question in range(15):
+            await self.step('save_test' if question == 14 else 'answer_question', creator_id,
+                            data=f'test_answer_{question % 4}')
+        test_id = self.test_link(creator_id)
+        if test_id is None:
+            raise RuntimeError(f"creator {creator_id} got no test link")
+        await self.step('share', creator_id, data='share_bot')
+
+        friend_ids = [creator_id + n for n in range(1, friends + 1)]
+        await asyncio.gather(*(
+            self.friend_takes_test(friend_id, test_id, [(q + n) % 4 for q in range(15)])
+            for n, friend_id in enumerate(friend_ids)
+        ))
+
+        await self.step('streak_ping', creator_id, data='streak_ping')
+        if friend_ids:
+            await self.step('open_streak_link', friend_ids[0], text=f'/start streak_{creator_id}')
+        await self.step('leaderboard', creator_id, text='/leaderboard')
+        await self.step('add_birthday', creator_id, data='add_birthday')
+        await self.step('save_birthday', creator_id, text=BIRTHDAY_TEXT)
+
+
+# ==================== REPORT ====================
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def build_report(harness: Harness, wall: float, params: Dict) -> Dict:
+    steps = {}
+    for name, timings in harness.timings.items():
+        ordered = sorted(timings)
+        calls = harness.calls[name]
+        steps[name] = {
+            'count': len(ordered),
+            'p50_ms': round(percentile(ordered, 0.50) * 1000, 2),
+            'p95_ms': round(percentile(ordered, 0.95) * 1000, 2),
+            'p99_ms': round(percentile(ordered, 0.99) * 1000, 2),
+            'db_calls': round(sum(c.db for c in calls) / len(calls), 2),
+            'api_calls': round(sum(c.api for c in calls) / len(calls), 2),
+            'gemini_calls': round(sum(c.gemini for c in calls) / len(calls), 2),
+        }
+    updates = sum(step['count'] for step in steps.values())
+    return {
+        'commit': git_commit(),
+        'params': params,
+        'wall_seconds': round(wall, 3),
+        'updates': updates,
+        'updates_per_second': round(updates / wall, 1) if wall else 0.0,
+        'errors': harness.errors,
+        'steps': steps,
+    }
+
+
+def print_report(report: Dict):
+    print(f"e2e: {report['updates']} updates in {report['wall_seconds']} s -> "
+          f"{report['updates_per_second']} updates/s | errors: {report['errors']} | commit {report['commit']}")
+    print(f"  {'step':<24}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'db':>7}{'api':>7}{'ai':>5}")
+    for name, step in report['steps'].items():
+        print(f"  {name:<24}{step['count']:>6}{step['p50_ms']:>10}{step['p95_ms']:>10}{step['p99_ms']:>10}"
+              f"{step['db_calls']:>7}{step['api_calls']:>7}{step['gemini_calls']:>5}")
+
+
+def compare(report: Dict, baseline: Dict, threshold: float = REGRESSION_PERCENT) -> List[str]:
+    """Print per-step deltas against a baseline; return the regressions"""
+    regressions = []
+    print(f"\ncompared with {baseline.get('commit')} (regression = p50 +{threshold:.0f}% or more calls):")
+    for name, step in report['steps'].items():
+        base = baseline.get('steps', {}).get(name)
+        if not base:
+            print(f"  {name:<24} new step")
+            continue
+        # p50 is stable enough to gate on; p95/p99 are shown for reading
+        change = (step['p50_ms'] - base['p50_ms']) / base['p50_ms'] * 100 if base['p50_ms'] else 0.0
+        flags = []
+        if change >= threshold:
+            flags.append(f"p50 +{change:.0f}%")
+        for calls in ('db_calls', 'api_calls', 'gemini_calls'):
+            if step[calls] > base[calls]:
+                flags.append(f"{calls} {base[calls]} -> {step[calls]}")
+        print(f"  {name:<24} p50 {base['p50_ms']:>8} -> {step['p50_ms']:>8} ms ({change:+.0f}%) | "
+              f"p95 {base['p95_ms']} -> {step['p95_ms']}"
+              + (f"  REGRESSION: {', '.join(flags)}" if flags else ''))
+        if flags:
+            regressions.append(f"{name}: {', '.join(flags)}")
+    return regressions
+
+
+# ==================== RUN ====================
+
+async def start_harness(api_latency: float, db_backend: str, db_latency: float,
+                        gemini_latency: float) -> Tuple[Harness, Optional[FakeSupabase]]:
+    """Fake Bot API up, fakes swapped into config, the real Application initialized"""
+    api = FakeBotAPI(api_latency)
+    await api.start()
+
+    db = None
+    if db_backend == 'memory':
+        db = FakeSupabase(db_latency)
+        config.supabase._target = db
+    config.model._model = FakeGemini(gemini_latency)
+
+    from main import build_application
+    application = build_application(base_url=api.url, request=HarnessRequest(connection_pool_size=256))
+    harness = Harness(application, api)
+
+    async def count_error(update, context):
+        harness.errors += 1
+        logger.error(f"E2E_HANDLER_ERROR: {context.error!r}")
+
+    application.add_error_handler(count_error)
+    await application.initialize()
+    return harness, db
+
+
+async def stop_harness(harness: Harness):
+    await harness.application.shutdown()
+    await harness.api.stop()
+
+
+async def run(args) -> Dict:
+    harness, db = await start_harness(args.api_latency_ms / 1000, args.db, args.db_latency_ms / 1000,
+                                      args.gemini_latency_ms / 1000)
+    api = harness.api
+
+    limit = asyncio.Semaphore(args.concurrency)
+    stride = args.friends + 1
+
+    async def bounded(creator_id: int):
+        async with limit:
+            await harness.journey(creator_id, args.friends)
+
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*(bounded(args.first_user_id + n * stride) for n in range(args.creators)))
+    finally:
+        wall = time.perf_counter() - start
+        await stop_harness(harness)
+
+    params = {k: v for k, v in vars(args).items() if k not in ('json', 'compare')}
+    report = build_report(harness, wall, params)
+    if db is not None:
+        report['rows'] = {table: len(rows) for table, rows in sorted(db.tables.items())}
+    report['api_methods'] = dict(sorted(api.calls.items()))
+    return report
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--creators', type=int, default=20, help='journeys (one test creator each)')
+    parser.add_argument('--friends', type=int, default=3, help='friends taking each test')
+    parser.add_argument('--concurrency', type=int, default=10, help='journeys in flight at once')
+    parser.add_argument('--api-latency-ms', type=float, default=20.0)
+    parser.add_argument('--db-latency-ms', type=float, default=2.0)
+    parser.add_argument('--gemini-latency-ms', type=float, default=200.0)
+    parser.add_argument('--first-user-id', type=int, default=10_000_000)
+    parser.add_argument('--db', choices=DB_BACKENDS, default='memory',
+                        help='memory: in-memory stand-in; supabase: the configured client (e.g. a local stack)')
+    parser.add_argument('--json', help='write the report here')
+    parser.add_argument('--compare', help='baseline report to compare against')
+    parser.add_argument('--log-level', default='ERROR')
+    return parser.parse_args(argv)
+
+
+def run_cli(argv: List[str]) -> int:
+    args = parse_args(argv)
+    logging.getLogger().setLevel(args.log_level.upper())  # config already set up the handler
+
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as report_file:
+            json.dump(report, report_file, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as baseline_file:
+            regressions = compare(report, json.load(baseline_file))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(run_cli(sys.argv[1:]))
@@ -0,0 +1,395 @@
+"""
+In-memory stand-in for the supabase client: the PostgREST builder subset the bot uses, plus its RPCs
+
+Used by e2e_bench.py. Queries run against Python lists under one lock and
+block the calling thread for `latency` seconds, like the real sync client.
+"""
+import copy
+import itertools
+import re
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+from streak_bitmap import bitmap_from_row, encode_bitmap, utc_day
+
+# on_conflict targets for upsert() (PostgREST uses the primary key by default)
+CONFLICT_KEYS = {
+    'friends_users': ('telegram_id',),
+    'activity_sketches': ('period',),
+    'test_results': ('test_id', 'user_id'),
+    'test_score_aggregates': ('test_id',),
+}
+# Unique constraints insert() enforces
+UNIQUE_KEYS = {**CONFLICT_KEYS, 'streak_restores': ('user_id', 'period')}
+
+
+class FakeAPIError(Exception):
+    """Raised where PostgREST would answer 409 (unique violation)"""
+
+
+class FakeResponse:
+    def __init__(self, data, count: Optional[int] = None):
+        self.data = data
+        self.count = count
+
+
+def _norm(value) -> Optional[str]:
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return None if value is None else str(value)
+
+
+def _order_key(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return (0, value, '')
+    try:
+        return (0, float(value), '')
+    except (TypeError, ValueError):
+        return (1, 0, str(value))
+
+
+def _compare(op: str, column: str, value) -> Callable[[Dict], bool]:
+    if op == 'eq':
+        return lambda row: _norm(row.get(column)) == _norm(value)
+    if op == 'neq':
+        return lambda row: _norm(row.get(column)) != _norm(value)
+    if op == 'in':
+        values = {_norm(v) for v in value}
+        return lambda row: _norm(row.get(column)) in values
+    if op == 'is':
+        target = {'null': None, 'true': True, 'false': False}.get(_norm(value), None)
+        return lambda row: row.get(column) is target if target is None else row.get(column) == target
+    ops = {
+        'gt': lambda a, b: a > b, 'gte': lambda a, b: a >= b,
+        'lt': lambda a, b: a < b, 'lte': lambda a, b: a <= b,
+    }
+    check = ops[op]
+    return lambda row: row.get(column) is not None and check(_order_key(row.get(column)), _order_key(value))
+
+
+def _split_top_level(expr: str) -> List[str]:
+    parts, depth, current = [], 0, ''
+    for char in expr:
+        if char == ',' and depth == 0:
+            parts.append(current)
+            current = ''
+            continue
+        depth += char == '('
+        depth -= char == ')'
+        current += char
+    if current:
+        parts.append(current)
+    return parts
+
+
+def parse_logic(expr: str, combine=any) -> Callable[[Dict], bool]:
+    """PostgREST or=(...)/and(...) filter text -> predicate"""
+    terms = []
+    for part in _split_top_level(expr):
+        nested = re.fullmatch(r'(and|or)\((.*)\)', part)
+        if nested:
+            terms.append(parse_logic(nested.group(2), all if nested.group(1) == 'and' else any))
+            continue
+        column, op, value = part.split('.', 2)
+        if op == 'in':
+            value = value.strip('()').split(',')
+        terms.append(_compare(op, column, value))
+    return lambda row: combine(term(row) for term in terms)
+
+
+class FakeQuery:
+    def __init__(self, db: 'FakeSupabase', table: str):
+        self.db = db
+        self.table = table
+        self.action = 'select'
+        self.columns = '*'
+        self.count = None
+        self.payload = None
+        self.on_conflict = None
+        self.filters: List[Callable[[Dict], bool]] = []
+        self.orders = []
+        self.offset = 0
+        self.limit_n = None
+        self._negate = False
+
+    # ---- actions ----
+    def select(self, columns: str = '*', count: str = None):
+        self.columns, self.count = columns, count
+        return self
+
+    def insert(self, rows):
+        self.action, self.payload = 'insert', rows
+        return self
+
+    def upsert(self, rows, on_conflict: str = None, **kwargs):
+        self.action, self.payload = 'upsert', rows
+        self.on_conflict = tuple(c.strip() for c in on_conflict.split(',')) if on_conflict else None
+        return self
+
+    def update(self, values: Dict):
+        self.action, self.payload = 'update', values
+        return self
+
+    def delete(self):
+        self.action = 'delete'
+        return self
+
+    # ---- filters ----
+    def _filter(self, predicate):
+        if self._negate:
+            self._negate = False
+            self.filters.append(lambda row: not predicate(row))
+        else:
+            self.filters.append(predicate)
+        return self
+
+    @property
+    def not_(self):
+        self._negate = True
+        return self
+
+    def eq(self, column, value):
+        return self._filter(_compare('eq', column, value))
+
+    def neq(self, column, value):
+        return self._filter(_compare('neq', column, value))
+
+    def gt(self, column, value):
+        return self._filter(_compare('gt', column, value))
+
+    def gte(self, column, value):
+        return self._filter(_compare('gte', column, value))
+
+    def lt(self, column, value):
+        return self._filter(_compare('lt', column, value))
+
+    def lte(self, column, value):
+        return self._filter(_compare('lte', column, value))
+
+    def in_(self, column, values):
+        return self._filter(_compare('in', column, list(values)))
+
+    def is_(self, column, value):
+        return self._filter(_compare('is', column, value))
+
+    def or_(self, expr: str):
+        return self._filter(parse_logic(expr))
+
+    def order(self, column: str, desc: bool = False, **kwargs):
+        self.orders.append((column, desc))
+        return self
+
+    def limit(self, n: int):
+        self.limit_n = n
+        return self
+
+    def range(self, start: int, end: int):
+        self.offset, self.limit_n = start, end - start + 1
+        return self
+
+    def execute(self) -> FakeResponse:
+        return self.db.run(self)
+
+
+class FakeRpc:
+    def __init__(self, db: 'FakeSupabase', name: str, params: Dict):
+        self.db, self.name, self.params = db, name, params or {}
+
+    def execute(self) -> FakeResponse:
+        return self.db.run_rpc(self.name, self.params)
+
+
+class FakeSupabase:
+    """Tables are lists of dicts; ids are assigned like bigserial columns"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.tables: Dict[str, List[Dict]] = defaultdict(list)
+        self._ids = defaultdict(lambda: itertools.count(1))
+        self._lock = threading.Lock()
+        self.queries = 0
+
+    def table(self, name: str) -> FakeQuery:
+        return FakeQuery(self, name)
+
+    def rpc(self, name: str, params: Dict = None) -> FakeRpc:
+        return FakeRpc(self, name, params)
+
+    def _round_trip(self):
+        self.queries += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    # ==================== TABLES ====================
+
+    def _matching(self, query: FakeQuery) -> List[Dict]:
+        return [row for row in self.tables[query.table] if all(f(row) for f in query.filters)]
+
+    def _project(self, row: Dict, columns: str) -> Dict:
+        if columns.strip() == '*':
+            return copy.deepcopy(row)
+        return {c.strip(): copy.deepcopy(row.get(c.strip())) for c in columns.split(',')}
+
+    def _with_defaults(self, table: str, row: Dict) -> Dict:
+        row = dict(row)
+        row.setdefault('id', next(self._ids[table]))
+        row.setdefault('created_at', datetime.now(timezone.utc).isoformat())
+        if table == 'tests':  # set_test_version trigger
+            versions = [t.get('version', 1) for t in self.tables['tests'] if t['user_id'] == row['user_id']]
+            row['version'] = max(versions, default=0) + 1
+            row.setdefault('archived_at', None)
+        return row
+
+    def _find(self, table: str, keys, row: Dict) -> Optional[Dict]:
+        for existing in self.tables[table]:
+            if all(_norm(existing.get(k)) == _norm(row.get(k)) for k in keys):
+                return existing
+        return None
+
+    def _insert(self, table: str, row: Dict) -> Dict:
+        keys = UNIQUE_KEYS.get(table)
+        if keys and self._find(table, keys, row):
+            raise FakeAPIError(f"duplicate key value violates unique constraint on {table} {keys}")
+        row = self._with_defaults(table, row)
+        self.tables[table].append(row)
+        return row
+
+    def run(self, query: FakeQuery) -> FakeResponse:
+        self._round_trip()
+        with self._lock:
+            table = query.table
+            if query.action == 'insert':
+                rows = query.payload if isinstance(query.payload, list) else [query.payload]
+                return FakeResponse([copy.deepcopy(self._insert(table, r)) for r in rows])
+
+            if query.action == 'upsert':
+                rows = query.payload if isinstance(query.payload, list) else [query.payload]
+                keys = query.on_conflict or CONFLICT_KEYS.get(table, ('id',))
+                written = []
+                for row in rows:
+                    existing = self._find(table, keys, row)
+                    if existing is not None:
+                        existing.update(row)
+                        written.append(copy.deepcopy(existing))
+                    else:
+                        written.append(copy.deepcopy(self._insert(table, row)))
+                return FakeResponse(written)
+
+            matched = self._matching(query)
+            if query.action == 'update':
+                for row in matched:
+                    row.update(query.payload)
+                return FakeResponse(copy.deepcopy(matched))
+
+            if query.action == 'delete':
+                doomed = {id(row) for row in matched}
+                self.tables[table] = [row for row in self.tables[table] if id(row) not in doomed]
+                return FakeResponse(copy.deepcopy(matched))
+
+            for column, desc in reversed(query.orders):
+                matched.sort(key=lambda row: (row.get(column) is None, _order_key(row.get(column))), reverse=desc)
+            total = len(matched)
+            end = None if query.limit_n is None else query.offset + query.limit_n
+            page = matched[query.offset:end]
+            return FakeResponse([self._project(row, query.columns) for row in page],
+                                total if query.count else None)
+
+    # ==================== RPCs (database_schema.sql) ====================
+
+    def run_rpc(self, name: str, params: Dict) -> FakeResponse:
+        self._round_trip()
+        handler = getattr(self, f'_rpc_{name}', None)
+        if handler is None:
+            raise FakeAPIError(f"Could not find the function public.{name}")
+        with self._lock:
+            return FakeResponse(handler(**params))
+
+    def _rpc_record_test_result(self, p_test_id, p_user_id, p_score, p_answers_packed=None):
+        aggregate = self._find('test_score_aggregates', ('test_id',), {'test_id': p_test_id})
+        if aggregate is None:
+            aggregate = self._insert('test_score_aggregates', {
+                'test_id': p_test_id, 'participants': 0, 'score_sum': 0,
+                'min_score': None, 'max_score': None, 'histogram': [0] * 101
+            })
+
+        result = self._find('test_results', ('test_id', 'user_id'), {'test_id': p_test_id, 'user_id': p_user_id})
+        old = result['score'] if result else None
+        now = datetime.now(timezone.utc).isoformat()
+        if result:
+            result.update({'score': p_score, 'answers_packed': p_answers_packed, 'created_at': now})
+        else:
+            self._insert('test_results', {'test_id': p_test_id, 'user_id': p_user_id, 'score': p_score,
+                                          'answers_packed': p_answers_packed, 'created_at': now})
+
+        histogram = aggregate['histogram']
+        if old is not None:
+            histogram[old] -= 1
+        histogram[p_score] += 1
+        scores = [s for s, n in enumerate(histogram) if n > 0]
+        aggregate.update({
+            'participants': aggregate['participants'] + (old is None),
+            'score_sum': aggregate['score_sum'] - (old or 0) + p_score,
+            'min_score': min(scores), 'max_score': max(scores),
+        })
+        return old
+
+    def _rpc_record_streak_interaction(self, p_streak_id, p_now=None):
+        row = self._find('friendship_streaks', ('id',), {'id': p_streak_id})
+        if row is None:
+            return []
+        p_now = p_now or datetime.now(timezone.utc).isoformat()
+        today = utc_day(p_now)
+        previous = row.get('current_streak') or 0
+
+        if not row.get('last_interaction'):
+            streak, outcome = 1, 'first'
+        else:
+            gap = (today - utc_day(row['last_interaction'])).days
+            if gap <= 0:
+                return [{'out_streak': previous, 'out_previous': previous, 'out_outcome': 'same_day'}]
+            streak, outcome = (previous + 1, 'increment') if gap == 1 else (1, 'reset')
+
+        row.update({
+            'current_streak': streak,
+            'longest_streak': max(row.get('longest_streak') or 0, streak),
+            'last_interaction': p_now,
+            **encode_bitmap(bitmap_from_row(row).with_day(today))
+        })
+        return [{'out_streak': streak, 'out_previous': previous, 'out_outcome': outcome}]
+
+    def _rpc_expire_stale_streaks(self, p_cutoff, p_batch_size):
+        stale = [row for row in self.tables['friendship_streaks']
+                 if (row.get('current_streak') or 0) > 0
+                 and (not row.get('last_interaction') or row['last_interaction'] < p_cutoff)][:p_batch_size]
+        for row in stale:
+            row['current_streak'] = 0
+        return len(stale)
+
+    def _rpc_rollup_streak_interactions(self, p_ids):
+        ids = {str(i) for i in p_ids}
+        rolled = [row for row in self.tables['streak_interactions'] if str(row['id']) in ids]
+        for row in rolled:
+            key = {'streak_id': row['streak_id'], 'day': row['created_at'][:10], 'interaction_type': row['interaction_type']}
+            daily = self._find('streak_interaction_daily', tuple(key), key)
+            if daily:
+                daily['count'] += 1
+            else:
+                self.tables['streak_interaction_daily'].append({**key, 'count': 1})
+        self.tables['streak_interactions'] = [row for row in self.tables['streak_interactions'] if str(row['id']) not in ids]
+        return len(rolled)
+
+    def _rpc_admin_dashboard_stats(self):
+        live = [row['current_streak'] for row in self.tables['friendship_streaks'] if (row.get('current_streak') or 0) > 0]
+        return {
+            'total_users': len(self.tables['friends_users']),
+            'premium_users': sum(1 for u in self.tables['friends_users'] if u.get('is_premium')),
+            'total_birthdays': len(self.tables['birthdays']),
+            'total_tests': len(self.tables['tests']),
+            'total_results': len(self.tables['test_results']),
+            'total_streaks': len(live),
+            'longest_streak': max(live, default=0),
+            'average_streak': sum(live) / len(live) if live else 0,
+        }
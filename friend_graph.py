@@ -0,0 +1,224 @@
+"""
+Materialized friend graph: undirected edges from test results and streaks
+"""
+import asyncio
+import logging
+import threading
+import time
+from array import array
+from bisect import bisect_left, insort
+from typing import Dict, Iterable, List, Tuple
+
+from telegram.ext import ContextTypes
+
+from config import supabase
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 1000
+LOAD_RETRY_SECONDS = 60  # after a failed load, callers fall back to per-pair lookups this long
+
+
+class FriendGraph:
+    """Adjacency index over dense integer node ids.
+
+    Telegram ids are mapped to dense ints; each node keeps a sorted int32
+    array of neighbor indexes, so neighbor listing is O(degree), membership
+    is O(log degree) and mutual counts are a linear merge.
+    """
+
+    def __init__(self):
+        self._index: Dict[int, int] = {}
+        self._telegram_ids = array('q')
+        self._adjacency: List[array] = []
+        self._lock = threading.Lock()
+        self.edges = 0
+
+    def _node(self, telegram_id: int) -> int:
+        node = self._index.get(telegram_id)
+        if node is None:
+            node = len(self._telegram_ids)
+            self._index[telegram_id] = node
+            self._telegram_ids.append(telegram_id)
+            self._adjacency.append(array('i'))
+        return node
+
+    def add_edge(self, user_a, user_b) -> bool:
+        """Add an undirected edge. Returns False if it already existed."""
+        user_a, user_b = int(user_a), int(user_b)
+        if user_a == user_b:
+            return False
+
+        with self._lock:
+            a, b = self._node(user_a), self._node(user_b)
+            neighbors = self._adjacency[a]
+            pos = bisect_left(neighbors, b)
+            if pos < len(neighbors) and neighbors[pos] == b:
+                return False
+            neighbors.insert(pos, b)
+            insort(self._adjacency[b], a)
+            self.edges += 1
+            return True
+
+    def add_edges(self, edges: Iterable[Tuple]) -> int:
+        return sum(1 for a, b in edges if self.add_edge(a, b))
+
+    def neighbors(self, user_id) -> List[int]:
+        """Telegram ids of everyone connected to user_id"""
+        node = self._index.get(int(user_id))
+        if node is None:
+            return []
+        telegram_ids = self._telegram_ids
+        return [telegram_ids[n] for n in self._adjacency[node]]
+
+    def degree(self, user_id) -> int:
+        node = self._index.get(int(user_id))
+        return len(self._adjacency[node]) if node is not None else 0
+
+    def are_friends(self, user_a, user_b) -> bool:
+        a = self._index.get(int(user_a))
+        b = self._index.get(int(user_b))
+        if a is None or b is None:
+            return False
+        neighbors = self._adjacency[a]
+        pos = bisect_left(neighbors, b)
+        return pos < len(neighbors) and neighbors[pos] == b
+
+    def mutual_friend_count(self, user_a, user_b) -> int:
+        a = self._index.get(int(user_a))
+        b = self._index.get(int(user_b))
+        if a is None or b is None:
+            return 0
+
+        left, right = self._adjacency[a], self._adjacency[b]
+        i = j = count = 0
+        while i < len(left) and j < len(right):
+            if left[i] == right[j]:
+                count += 1
+                i += 1
+                j += 1
+            elif left[i] < right[j]:
+                i += 1
+            else:
+                j += 1
+        return count
+
+    def stats(self) -> Dict:
+        return {
+            'nodes': len(self._telegram_ids),
+            'edges': self.edges,
+            'bytes': self._telegram_ids.itemsize * len(self._telegram_ids)
+                     + sum(adj.itemsize * len(adj) for adj in self._adjacency),
+        }
+
+
+friend_graph = FriendGraph()
+_loaded = False
+_load_lock = None
+_failed_at = None  # time.monotonic() of the last failed load
+
+
+def _fetch_all(table: str, columns: str) -> List[Dict]:
+    rows = []
+    start = 0
+    while True:
+        page = supabase.table(table)\
+            .select(columns)\
+            .order('id')\
+            .range(start, start + PAGE_SIZE - 1)\
+            .execute().data or []
+        rows.extend(page)
+        if len(page) < PAGE_SIZE:
+            return rows
+        start += PAGE_SIZE
+
+
+def load_friend_graph() -> FriendGraph:
+    """Build the graph from test results (taker <-> owner) and streak pairs"""
+    owners = {t['id']: t['user_id'] for t in _fetch_all('tests', 'id, user_id')}
+    results = _fetch_all('test_results', 'id, test_id, user_id')
+    streaks = _fetch_all('friendship_streaks', 'id, user_id, friend_id')
+
+    added = friend_graph.add_edges(
+        (r['user_id'], owners[r['test_id']]) for r in results if r['test_id'] in owners
+    )
+    added += friend_graph.add_edges((s['user_id'], s['friend_id']) for s in streaks)
+
+    logger.info(f"FRIEND_GRAPH_LOADED: {added} edges from {len(results)} results and {len(streaks)} streaks | {friend_graph.stats()}")
+    return friend_graph
+
+
+def _check_cooldown():
+    if _failed_at is not None and time.monotonic() - _failed_at < LOAD_RETRY_SECONDS:
+        raise RuntimeError("friend graph unavailable (last load failed)")
+
+
+async def ensure_friend_graph() -> FriendGraph:
+    """Return the graph, loading it from the DB on first use.
+
+    A failed load raises, and for LOAD_RETRY_SECONDS afterwards callers get
+    the error straight away instead of another full-table load.
+    """
+    global _loaded, _load_lock, _failed_at
+    if _loaded:
+        return friend_graph
+    _check_cooldown()
+
+    if _load_lock is None:
+        _load_lock = asyncio.Lock()
+
+    async with _load_lock:
+        if not _loaded:
+            _check_cooldown()
+            try:
+                await asyncio.to_thread(load_friend_graph)
+            except Exception:
+                _failed_at = time.monotonic()
+                raise
+            _loaded = True
+            _failed_at = None
+    return friend_graph
+
+
+def _pair_connected(user_a, user_b) -> bool:
+    """The graph's edge test for one pair, straight from the DB: a streak, or either took the other's test"""
+    a, b = str(user_a), str(user_b)
+    streak = supabase.table('friendship_streaks')\
+        .select('id')\
+        .or_(f'and(user_id.eq.{a},friend_id.eq.{b}),and(user_id.eq.{b},friend_id.eq.{a})')\
+        .limit(1)\
+        .execute()
+    if streak.data:
+        return True
+    for owner, taker in ((a, b), (b, a)):
+        test_ids = [t['id'] for t in supabase.table('tests').select('id').eq('user_id', owner).execute().data or []]
+        if test_ids and supabase.table('test_results').select('id')\
+                .in_('test_id', test_ids).eq('user_id', taker).limit(1).execute().data:
+            return True
+    return False
+
+
+async def are_friends(user_a, user_b) -> bool:
+    """Friendship check for buttons that act on a pair.
+
+    Uses the graph; while it can't be loaded, asks the DB about this one
+    pair, and if that fails too, lets the action through.
+    """
+    try:
+        graph = await ensure_friend_graph()
+        return graph.are_friends(user_a, user_b)
+    except Exception as e:
+        logger.warning(f"FRIEND_GRAPH_UNAVAILABLE: {e} | checking {user_a} <-> {user_b} in the DB")
+    try:
+        return await asyncio.to_thread(_pair_connected, user_a, user_b)
+    except Exception as e:
+        logger.error(f"Error checking friendship {user_a} <-> {user_b}: {e}")
+        return True
+
+
+async def warm_friend_graph(context: ContextTypes.DEFAULT_TYPE):
+    """Startup job: load the graph before the first friend query arrives"""
+    try:
+        await ensure_friend_graph()
+    except Exception as e:
+        logger.error(f"Error loading friend graph: {e}")
@@ -0,0 +1,296 @@
+"""
+"Who knows me best" - answer-similarity ranking across a user's friends
+"""
+import asyncio
+import json
+import logging
+from typing import Dict, Iterable, List
+
+import numpy as np
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import ContextTypes
+from telegram.constants import ParseMode
+
+from config import supabase, TOTAL_TEST_QUESTIONS
+from router import Router
+from test_cache import ANSWER_BITS, ANSWER_MASK, pack_answers
+
+logger = logging.getLogger(__name__)
+
+FRIEND_MATCH_TRANSLATIONS = {
+    'uz': {
+        'title': '🧠 <b>Sizni kim eng yaxshi biladi?</b>',
+        'subtitle': '<i>Testlardagi javoblar asosida</i>',
+        'no_data': "😔 Hali ma'lumot yetarli emas.\n\n💡 Testingizni do'stlaringizga yuboring va ularning testlarini yeching!",
+        'knows_me': 'sizni biladi',
+        'i_know': 'siz bilasiz',
+        'alike': "o'xshashlik",
+        'back': '◀️ Orqaga',
+    },
+    'ru': {
+        'title': '🧠 <b>Кто знает вас лучше всех?</b>',
+        'subtitle': '<i>По ответам в тестах</i>',
+        'no_data': '😔 Пока недостаточно данных.\n\n💡 Отправьте свой тест друзьям и пройдите их тесты!',
+        'knows_me': 'знает вас',
+        'i_know': 'вы знаете',
+        'alike': 'сходство',
+        'back': '◀️ Назад',
+    },
+    'en': {
+        'title': '🧠 <b>Who knows you best?</b>',
+        'subtitle': '<i>Based on your test answers</i>',
+        'no_data': '😔 Not enough data yet.\n\n💡 Share your test with friends and take theirs!',
+        'knows_me': 'knows you',
+        'i_know': 'you know',
+        'alike': 'alike',
+        'back': '◀️ Back',
+    }
+}
+
+# Similarity components (columns of the similarity matrix)
+KNOWS_ME = 0   # friend's guesses on my tests vs my answer key
+I_KNOW = 1     # my guesses on friend's tests vs their answer key
+ALIKE = 2      # my answer key vs friend's answer key
+SAME_VIEW = 3  # my guesses vs friend's guesses on the same third-party test
+COMPONENT_WEIGHTS = np.array([0.35, 0.35, 0.15, 0.15])
+
+IN_FILTER_CHUNK = 100  # keep PostgREST URLs short
+
+_SHIFTS = np.arange(TOTAL_TEST_QUESTIONS, dtype=np.int64) * ANSWER_BITS
+
+
+def get_match_text(lang: str, key: str) -> str:
+    """Get translated friend match text"""
+    return FRIEND_MATCH_TRANSLATIONS.get(lang, FRIEND_MATCH_TRANSLATIONS['en']).get(key, key)
+
+
+def match_fractions(left: np.ndarray, right: np.ndarray) -> np.ndarray:
+    """Vectorized fraction of agreeing answers for each (left[i], right[i]) pair"""
+    left_lanes = (left[:, None] >> _SHIFTS) & ANSWER_MASK
+    right_lanes = (right[:, None] >> _SHIFTS) & ANSWER_MASK
+    answered = (right_lanes > 0).sum(axis=1)
+    matches = ((left_lanes == right_lanes) & (right_lanes > 0)).sum(axis=1)
+    return np.divide(matches, answered, out=np.zeros(len(left)), where=answered > 0)
+
+
+def similarity_matrix(friend_idx: np.ndarray, component: np.ndarray, fractions: np.ndarray,
+                      n_friends: int):
+    """Average each (friend, component) cell over all its comparisons.
+
+    Returns (similarity, counts), both shaped (n_friends, 4).
+    """
+    cells = friend_idx * 4 + component
+    size = n_friends * 4
+    sums = np.bincount(cells, weights=fractions, minlength=size).reshape(n_friends, 4)
+    counts = np.bincount(cells, minlength=size).reshape(n_friends, 4)
+    similarity = np.divide(sums, counts, out=np.zeros_like(sums), where=counts > 0)
+    return similarity, counts
+
+
+def rank_friends(similarity: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """Weighted mean over the components each friend has data for (0-1)"""
+    weights = COMPONENT_WEIGHTS * (counts > 0)
+    total = weights.sum(axis=1)
+    return np.divide((similarity * weights).sum(axis=1), total,
+                     out=np.zeros(len(similarity)), where=total > 0)
+
+
+class ComparisonBuilder:
+    """Collects (friend, component, left, right) rows for one vectorized pass"""
+
+    def __init__(self):
+        self.friend_index: Dict[str, int] = {}
+        self.packed_rows = ([], [], [], [])  # friend_idx, component, left, right
+        self.score_rows = ([], [], [])       # friend_idx, component, fraction
+
+    def _index(self, friend_id: str) -> int:
+        return self.friend_index.setdefault(str(friend_id), len(self.friend_index))
+
+    def add_packed(self, friend_id: str, component: int, left: int, right: int):
+        idx = self._index(friend_id)
+        for column, value in zip(self.packed_rows, (idx, component, left, right)):
+            column.append(value)
+
+    def add_score(self, friend_id: str, component: int, score: int):
+        """Fallback for results stored before taker answers were kept"""
+        idx = self._index(friend_id)
+        for column, value in zip(self.score_rows, (idx, component, score / 100)):
+            column.append(value)
+
+    def compute(self):
+        friend_idx = np.array(self.packed_rows[0] + self.score_rows[0], dtype=np.int64)
+        component = np.array(self.packed_rows[1] + self.score_rows[1], dtype=np.int64)
+        fractions = np.concatenate([
+            match_fractions(np.array(self.packed_rows[2], dtype=np.int64),
+                            np.array(self.packed_rows[3], dtype=np.int64)),
+            np.array(self.score_rows[2], dtype=np.float64)
+        ])
+        similarity, counts = similarity_matrix(friend_idx, component, fractions, len(self.friend_index))
+        return similarity, counts, rank_friends(similarity, counts)
+
+
+def _chunks(values: List, size: int = IN_FILTER_CHUNK) -> Iterable[List]:
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def _answer_key(answers) -> int:
+    if isinstance(answers, str):
+        answers = json.loads(answers)
+    return pack_answers(answers or {})
+
+
+def load_comparisons(user_id: int) -> ComparisonBuilder:
+    """Bulk-load every answer vector linking the user with their friends"""
+    me = str(user_id)
+    builder = ComparisonBuilder()
+
+    # My tests (all versions) and what friends answered on them
+    my_tests = supabase.table('tests').select('id, answers, archived_at').eq('user_id', me).execute().data or []
+    my_keys = {t['id']: _answer_key(t['answers']) for t in my_tests}
+    my_current_key = next((_answer_key(t['answers']) for t in my_tests if not t.get('archived_at')), 0)
+
+    for test_ids in _chunks(list(my_keys)):
+        rows = supabase.table('test_results')\
+            .select('test_id, user_id, score, answers_packed')\
+            .in_('test_id', test_ids)\
+            .execute().data or []
+        for row in rows:
+            if row['user_id'] == me:
+                continue
+            if row.get('answers_packed') is not None:
+                builder.add_packed(row['user_id'], KNOWS_ME, row['answers_packed'], my_keys[row['test_id']])
+            else:
+                builder.add_score(row['user_id'], KNOWS_ME, row['score'])
+
+    # Tests I took, their owners' keys, and co-takers among my friends
+    my_results = supabase.table('test_results')\
+        .select('test_id, score, answers_packed')\
+        .eq('user_id', me)\
+        .execute().data or []
+    my_guesses = {r['test_id']: r for r in my_results}
+
+    owners = {}
+    for test_ids in _chunks(list(my_guesses)):
+        rows = supabase.table('tests').select('id, user_id, answers').in_('id', test_ids).execute().data or []
+        for test in rows:
+            owners[test['id']] = test['user_id']
+            guess = my_guesses[test['id']]
+            if guess.get('answers_packed') is not None:
+                builder.add_packed(test['user_id'], I_KNOW, guess['answers_packed'], _answer_key(test['answers']))
+            else:
+                builder.add_score(test['user_id'], I_KNOW, guess['score'])
+
+    friend_ids = list(builder.friend_index)
+    if not friend_ids:
+        return builder
+
+    for test_ids in _chunks([t for t in my_guesses if my_guesses[t].get('answers_packed') is not None]):
+        rows = supabase.table('test_results')\
+            .select('test_id, user_id, answers_packed')\
+            .in_('test_id', test_ids)\
+            .not_.is_('answers_packed', 'null')\
+            .execute().data or []
+        for row in rows:
+            friend = row['user_id']
+            if friend == me or friend == owners.get(row['test_id']) or friend not in builder.friend_index:
+                continue
+            builder.add_packed(friend, SAME_VIEW, row['answers_packed'], my_guesses[row['test_id']]['answers_packed'])
+
+    # Friends' current answer keys vs mine
+    if my_current_key:
+        for ids in _chunks(friend_ids):
+            rows = supabase.table('tests')\
+                .select('user_id, answers')\
+                .in_('user_id', ids)\
+                .is_('archived_at', 'null')\
+                .execute().data or []
+            for test in rows:
+                builder.add_packed(test['user_id'], ALIKE, _answer_key(test['answers']), my_current_key)
+
+    return builder
+
+
+def get_best_matches(user_id: int, limit: int = 10) -> List[Dict]:
+    """Ranked "you match best with" list for a user"""
+    builder = load_comparisons(user_id)
+    if not builder.friend_index:
+        return []
+
+    similarity, counts, overall = builder.compute()
+    friend_ids = list(builder.friend_index)
+    order = np.argsort(-overall, kind='stable')[:limit]
+
+    ranked = [{
+        'user_id': friend_ids[i],
+        'score': int(round(overall[i] * 100)),
+        'knows_me': int(round(similarity[i, KNOWS_ME] * 100)) if counts[i, KNOWS_ME] else None,
+        'i_know': int(round(similarity[i, I_KNOW] * 100)) if counts[i, I_KNOW] else None,
+        'alike': int(round(similarity[i, ALIKE] * 100)) if counts[i, ALIKE] else None,
+    } for i in order]
+
+    names = supabase.table('friends_users')\
+        .select('telegram_id, first_name, last_name, username')\
+        .in_('telegram_id', [r['user_id'] for r in ranked])\
+        .execute().data or []
+    names_by_id = {str(u['telegram_id']): u for u in names}
+
+    for entry in ranked:
+        user = names_by_id.get(entry['user_id'], {})
+        entry['name'] = f"{user.get('first_name') or ''} {user.get('last_name') or ''}".strip() \
+            or user.get('username') or 'Friend'
+
+    return ranked
+
+
+async def show_best_matches(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show the "who knows me best" ranking"""
+    query = update.callback_query
+    if query:
+        await query.answer()
+
+    user_id = update.effective_user.id
+    lang = context.user_data.get('language', 'en')
+
+    await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
+
+    try:
+        matches = await asyncio.to_thread(get_best_matches, user_id)
+
+        text = get_match_text(lang, 'title') + '\n' + get_match_text(lang, 'subtitle') + '\n\n'
+
+        if matches:
+            for rank, entry in enumerate(matches, start=1):
+                emoji = '🥇' if rank == 1 else '🥈' if rank == 2 else '🥉' if rank == 3 else '  '
+                text += f'{emoji} {rank}. <b>{entry["name"]}</b> — {entry["score"]}%\n'
+
+                details = []
+                for key in ('knows_me', 'i_know', 'alike'):
+                    if entry[key] is not None:
+                        details.append(f'{get_match_text(lang, key)} {entry[key]}%')
+                if details:
+                    text += f'      <i>{" · ".join(details)}</i>\n'
+        else:
+            text += get_match_text(lang, 'no_data')
+
+        keyboard = [[InlineKeyboardButton(get_match_text(lang, 'back'), callback_data='streaks_menu')]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+
+        if query:
+            await query.edit_message_text(text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+        else:
+            await update.message.reply_text(text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+
+        logger.info(f"BEST_MATCHES: User {user_id} | Friends ranked: {len(matches)}")
+
+    except Exception as e:
+        logger.error(f"Error showing best matches: {e}")
+        error_text = "❌ Error loading matches"
+        if query:
+            await query.edit_message_text(error_text)
+        else:
+            await update.message.reply_text(error_text)
+
+
+def register_routes(router: Router):
+    router.callback('streak_best_match', show_best_matches)
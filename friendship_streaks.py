@@ -5,12 +5,17 @@ from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from telegram.constants import ParseMode
 from config import supabase
+from friend_graph import friend_graph, ensure_friend_graph
+from leaderboard import mark_leaderboard_dirty
+from router import Router, callback_data
 import random
 import urllib.parse
 
 
 logger = logging.getLogger(__name__)
 
+FRIEND_INFO_CHUNK = 100  # friends_users ids per .in_() query; keeps PostgREST URLs short
+
 # Daily questions pool
 DAILY_QUESTIONS = {
     'uz': [
@@ -147,6 +152,12 @@ STREAK_TRANSLATIONS = {
         'streak_with': '🔥 <b>{name}</b> bilan: {days} kun ketma-ket',
         'ping_friend': '👋 Salom yo\'llang',
         'leaderboard': '🏆 Liderlar jadvali',
+        'best_match': '🧠 Kim meni yaxshi biladi?',
+        'restore_streak': '♻️ Muloqotni tiklash',
+        'calendar': '📅 Muloqot kalendari',
+        'calendar_title': '📅 <b>{name}</b> bilan muloqot kalendari',
+        'calendar_stats': '🔥 Hozirgi: {current} kun\n🏆 Eng uzun: {longest} kun\n\n📊 So\'nggi 7 kun: {week}/7\n📊 So\'nggi 30 kun: {month}/30\n✅ Barqarorlik (90 kun): {consistency}%',
+        'not_friends': "❌ Bu foydalanuvchi do'stlaringiz ro'yxatida yo'q",
         'back': '◀️ Orqaga',
         'streak_link_created': '✅ <b>Havola tayyor!</b>\n\n💡 <i>Havolani do\'stlaringizga ulashing. Ular uni bosganida har kunlik muloqot avtomatik boshlanadi!</i>\n\n🔗 <b>Havola:</b>\n<code>{link}</code>',
         'share_test': '📤 Ulashish',
@@ -216,6 +227,12 @@ STREAK_TRANSLATIONS = {
         'streak_with': '🔥 <b>{name}</b>: {days} дней подряд',
         'ping_friend': '👋 Отправить привет',
         'leaderboard': '🏆 Таблица лидеров',
+        'best_match': '🧠 Кто знает меня лучше?',
+        'restore_streak': '♻️ Восстановить серию',
+        'calendar': '📅 Календарь общения',
+        'calendar_title': '📅 Календарь общения с <b>{name}</b>',
+        'calendar_stats': '🔥 Сейчас: {current} дней\n🏆 Рекорд: {longest} дней\n\n📊 За 7 дней: {week}/7\n📊 За 30 дней: {month}/30\n✅ Постоянство (90 дней): {consistency}%',
+        'not_friends': '❌ Этого пользователя нет в списке ваших друзей',
         'back': '◀️ Назад',
         'streak_link_created': '✅ <b>Ссылка готова!</b>\n\n💡 <i>Поделитесь ссылкой с друзьями. Когда они нажмут её, ежедневное общение автоматически начнётся!</i>\n\n🔗 <b>Ссылка:</b>\n<code>{link}</code>',
         'share_test': '📤 Поделиться',
@@ -288,6 +305,12 @@ STREAK_TRANSLATIONS = {
         'streak_with': '🔥 <b>{name}</b>: {days} days in a row',
         'ping_friend': '👋 Send Hello',
         'leaderboard': '🏆 Leaderboard',
+        'best_match': '🧠 Who knows me best?',
+        'restore_streak': '♻️ Restore a streak',
+        'calendar': '📅 Streak calendar',
+        'calendar_title': '📅 Streak calendar with <b>{name}</b>',
+        'calendar_stats': '🔥 Current: {current} days\n🏆 Longest ever: {longest} days\n\n📊 Last 7 days: {week}/7\n📊 Last 30 days: {month}/30\n✅ Consistency (90 days): {consistency}%',
+        'not_friends': "❌ This user isn't in your friends list",
         'back': '◀️ Back',
         'streak_link_created': '✅ <b>Link ready!</b>\n\n💡 <i>Share the link with your friends. When they click it, daily communication will automatically start!</i>\n\n🔗 <b>Link:</b>\n<code>{link}</code>',
         'share_test': '📤 Share',
@@ -311,17 +334,21 @@ def get_streak_text(lang: str, key: str) -> str:
     return STREAK_TRANSLATIONS.get(lang, STREAK_TRANSLATIONS['en']).get(key, key)
 
 
+def find_streak(user_id: int, friend_id: int) -> Optional[Dict]:
+    """The pair's streak row in either direction, or None; read-only (errors propagate)"""
+    result = supabase.table('friendship_streaks')\
+        .select('*')\
+        .or_(f'and(user_id.eq.{user_id},friend_id.eq.{friend_id}),and(user_id.eq.{friend_id},friend_id.eq.{user_id})')\
+        .execute()
+    return result.data[0] if result.data else None
+
+
 def get_or_create_streak(user_id: int, friend_id: int) -> Dict:
     """Get existing streak or create new one"""
     try:
-        # Try to find existing streak (bidirectional)
-        result = supabase.table('friendship_streaks')\
-            .select('*')\
-            .or_(f'and(user_id.eq.{user_id},friend_id.eq.{friend_id}),and(user_id.eq.{friend_id},friend_id.eq.{user_id})')\
-            .execute()
-        
-        if result.data:
-            return result.data[0]
+        existing = find_streak(user_id, friend_id)
+        if existing:
+            return existing
         
         # Create new streak
         streak_data = {
@@ -334,6 +361,7 @@ def get_or_create_streak(user_id: int, friend_id: int) -> Dict:
         }
         
         new_streak = supabase.table('friendship_streaks').insert(streak_data).execute()
+        friend_graph.add_edge(user_id, friend_id)
         logger.info(f"STREAK_CREATED: User {user_id} with friend {friend_id}")
         return new_streak.data[0]
         
@@ -343,52 +371,36 @@ def get_or_create_streak(user_id: int, friend_id: int) -> Dict:
 
 
 def update_streak(streak_id: int, user_id: int, friend_id: int) -> int:
-    """Update streak after interaction, returns current streak days"""
+    """Update streak after interaction, returns current streak days.
+
+    The day comparison, counters and day-bitmap bit are applied in one
+    locked statement (record_streak_interaction), so two friends tapping at
+    the same moment can't both increment.
+    """
     try:
-        streak = supabase.table('friendship_streaks').select('*').eq('id', streak_id).execute()
+        result = supabase.rpc('record_streak_interaction', {
+            'p_streak_id': streak_id,
+            'p_now': datetime.now(timezone.utc).isoformat()
+        }).execute()
         
-        if not streak.data:
+        if not result.data:
             return 0
         
-        streak_data = streak.data[0]
-        last_interaction = streak_data.get('last_interaction')
-        current_streak = streak_data.get('current_streak', 0)
-        longest_streak = streak_data.get('longest_streak', 0)
-        
-        now = datetime.now(timezone.utc)
+        row = result.data[0]
+        current_streak = row['out_streak']
+        outcome = row['out_outcome']
         
-        # Check if interaction is today
-        if last_interaction:
-            last_date = datetime.fromisoformat(last_interaction.replace('Z', '+00:00'))
-            days_diff = (now.date() - last_date.date()).days
-            
-            if days_diff == 0:
-                # Same day - no change
-                logger.info(f"STREAK_SAME_DAY: User {user_id} with friend {friend_id} | Streak: {current_streak}")
-                return current_streak
-            elif days_diff == 1:
-                # Next day - increment
-                current_streak += 1
-                logger.info(f"STREAK_INCREMENT: User {user_id} with friend {friend_id} | Streak: {current_streak}")
-            else:
-                # Missed days - reset
-                current_streak = 1
-                logger.info(f"STREAK_RESET: User {user_id} with friend {friend_id} | Was {streak_data.get('current_streak')} days")
+        if outcome == 'same_day':
+            logger.info(f"STREAK_SAME_DAY: User {user_id} with friend {friend_id} | Streak: {current_streak}")
+            return current_streak
+        elif outcome == 'increment':
+            logger.info(f"STREAK_INCREMENT: User {user_id} with friend {friend_id} | Streak: {current_streak}")
+        elif outcome == 'reset':
+            logger.info(f"STREAK_RESET: User {user_id} with friend {friend_id} | Was {row['out_previous']} days")
         else:
-            # First interaction
-            current_streak = 1
             logger.info(f"STREAK_FIRST: User {user_id} with friend {friend_id}")
         
-        # Update longest streak if needed
-        if current_streak > longest_streak:
-            longest_streak = current_streak
-        
-        # Update database
-        supabase.table('friendship_streaks').update({
-            'current_streak': current_streak,
-            'longest_streak': longest_streak,
-            'last_interaction': now.isoformat()
-        }).eq('id', streak_id).execute()
+        mark_leaderboard_dirty()
         
         return current_streak
         
@@ -397,51 +409,64 @@ def update_streak(streak_id: int, user_id: int, friend_id: int) -> int:
         return 0
 
 
-async def get_user_friends(user_id: int) -> List[Dict]:
-    """Get list of friends (people who took user's test)"""
+async def get_user_friends(user_id: int, limit: int = None) -> List[Dict]:
+    """Get list of friends from the friend graph (test takers, tests taken, streak pairs)"""
     try:
-        # Get user's test
-        test_result = supabase.table('tests').select('id').eq('user_id', str(user_id)).execute()
-        
-        if not test_result.data:
+        graph = await ensure_friend_graph()
+        friend_ids = graph.neighbors(user_id)
+
+        if not friend_ids:
             return []
-        
-        test_id = test_result.data[0]['id']
-        
-        # Get people who took the test
-        results = supabase.table('test_results')\
-            .select('user_id, score')\
-            .eq('test_id', test_id)\
-            .order('score', desc=True)\
-            .execute()
-        
-        friends = []
-        for result in results.data:
-            friend_id = result['user_id']
-            
-            # Get friend info
+
+        # Scores on the user's current test, one query for all takers
+        scores = {}
+        test_result = supabase.table('tests').select('id').eq('user_id', str(user_id)).is_('archived_at', 'null').order('created_at', desc=True).limit(1).execute()
+        if test_result.data:
+            results = supabase.table('test_results')\
+                .select('user_id, score')\
+                .eq('test_id', test_result.data[0]['id'])\
+                .execute()
+            scores = {int(r['user_id']): r['score'] for r in results.data}
+
+        # Rank on scores alone; mutual counts (a merge of two adjacency lists
+        # each) are computed only for the friends returned, to order equal scores
+        ranked = sorted(friend_ids, key=lambda f: scores.get(f, -1), reverse=True)
+        if limit:
+            ranked = ranked[:limit]
+        mutual = {f: graph.mutual_friend_count(user_id, f) for f in ranked}
+        ranked.sort(key=lambda f: (scores.get(f, -1), mutual[f]), reverse=True)
+
+        # Names only for the friends actually returned, in URL-sized batches
+        info_by_id = {}
+        ids = [str(f) for f in ranked]
+        for i in range(0, len(ids), FRIEND_INFO_CHUNK):
             friend_info = supabase.table('friends_users')\
-                .select('first_name, last_name, username')\
-                .eq('telegram_id', friend_id)\
+                .select('telegram_id, first_name, last_name, username')\
+                .in_('telegram_id', ids[i:i + FRIEND_INFO_CHUNK])\
                 .execute()
-            
-            if friend_info.data:
-                friend = friend_info.data[0]
-                friends.append({
-                    'id': int(friend_id),
-                    'name': f"{friend.get('first_name', '')} {friend.get('last_name', '')}".strip() or friend.get('username', 'Friend'),
-                    'score': result['score']
-                })
-        
+            info_by_id.update((int(f['telegram_id']), f) for f in friend_info.data)
+
+        friends = []
+        for friend_id in ranked:
+            friend = info_by_id.get(friend_id)
+            if not friend:
+                continue
+            friends.append({
+                'id': friend_id,
+                'name': f"{friend.get('first_name') or ''} {friend.get('last_name') or ''}".strip() or friend.get('username') or 'Friend',
+                'score': scores.get(friend_id),
+                'mutual': mutual[friend_id]
+            })
+
         return friends
-        
+
     except Exception as e:
         logger.error(f"Error getting user friends: {e}")
         return []
 
 
 async def show_streaks_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Show simplified streaks menu with only 2 buttons"""
+    """Show simplified streaks menu"""
     query = update.callback_query
     if query:
         await query.answer()
@@ -493,7 +518,7 @@ async def show_streaks_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
         else:
             text += get_streak_text(lang, 'no_streaks')
         
-        # Simplified keyboard with only 2 buttons
+        # Simplified keyboard
         keyboard = [
             [
                 InlineKeyboardButton(
@@ -507,6 +532,24 @@ async def show_streaks_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     callback_data='streak_ping'
                 )
             ],
+            [
+                InlineKeyboardButton(
+                    get_streak_text(lang, 'best_match'),
+                    callback_data='streak_best_match'
+                )
+            ],
+            [
+                InlineKeyboardButton(
+                    get_streak_text(lang, 'calendar'),
+                    callback_data='streak_calendar'
+                )
+            ],
+            [
+                InlineKeyboardButton(
+                    get_streak_text(lang, 'restore_streak'),
+                    callback_data='streak_restore'
+                )
+            ],
             [
                 InlineKeyboardButton(
                     get_streak_text(lang, 'back'),
@@ -552,7 +595,7 @@ async def show_friend_selection(update: Update, context: ContextTypes.DEFAULT_TY
     
     await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
     
-    friends = await get_user_friends(user_id)
+    friends = await get_user_friends(user_id, limit=10)
     
     if not friends:
         # No friends yet - show appropriate message based on action
@@ -575,12 +618,24 @@ async def show_friend_selection(update: Update, context: ContextTypes.DEFAULT_TY
     text = get_streak_text(lang, 'select_friend')
     keyboard = []
     
-    for friend in friends[:10]:  # Limit to 10 friends
+    for friend in friends:
+        label = f"{friend['name']} ({friend['score']}%)" if friend['score'] is not None else friend['name']
         keyboard.append([InlineKeyboardButton(
-            f"{friend['name']} ({friend['score']}%)",
-            callback_data=f'streak_friend_{action}_{friend["id"]}'
+            label,
+            callback_data=callback_data(f'streak_friend_{action}', friend['id'])
         )])
     
     keyboard.append([InlineKeyboardButton(get_streak_text(lang, 'back'), callback_data='streaks_menu')])
     
-    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.HTML)
\ No newline at end of file
+    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.HTML)
+
+
+# Friend pickers: streak_<action> lists friends as streak_friend_<action>_<friend_id>
+FRIEND_SELECTION_ACTIONS = ('daily_q', 'remember', 'guess', 'quiz', 'weekly', 'calendar')
+
+
+def register_routes(router: Router):
+    router.command('streaks', show_streaks_menu)
+    router.callback('streaks_menu', show_streaks_menu)
+    for action in FRIEND_SELECTION_ACTIONS:
+        router.callback(f'streak_{action}', show_friend_selection, action=action)
@@ -0,0 +1,150 @@
+"""
+Idle-user eviction: context.user_data only holds users seen recently
+
+Every update stamps its user; a periodic sweep drops users idle longer than
+USER_DATA_IDLE_SECONDS, and the least recently seen ones beyond
+USER_DATA_MAX_USERS. With SQLitePersistence configured, their data is on
+disk before it leaves memory and is read back on their next update;
+without it, an evicted user's unfinished flow and conversation state are
+dropped together, as after a restart.
+"""
+import logging
+import random
+import sys
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Mapping, Set
+
+from telegram import Update
+from telegram.ext import Application, ContextTypes, ConversationHandler
+
+from config import USER_DATA_IDLE_SECONDS, USER_DATA_MAX_USERS
+from metrics import register_gauge
+from persistence import SQLitePersistence
+
+logger = logging.getLogger(__name__)
+
+FOOTPRINT_SAMPLE = 2000  # user_data entries measured per sweep; the total is extrapolated
+
+
+def deep_size(value) -> int:
+    """sys.getsizeof of value and everything it contains (dicts, lists, tuples, sets)"""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(deep_size(key) + deep_size(item) for key, item in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(deep_size(item) for item in value)
+    return size
+
+
+def estimate_footprint(user_data: Mapping[int, Dict], sample: int = FOOTPRINT_SAMPLE) -> int:
+    """Approximate bytes held by all user_data entries, from a random sample"""
+    count = len(user_data)
+    if not count:
+        return 0
+    user_ids = list(user_data)
+    if count > sample:
+        user_ids = random.sample(user_ids, sample)
+    measured = sum(deep_size(user_id) + deep_size(user_data[user_id]) for user_id in user_ids)
+    return sys.getsizeof(user_data) + measured * count // len(user_ids)
+
+
+def end_conversations(application: Application, user_ids: Set[int]) -> int:
+    """Drop these users' ConversationHandler states; returns how many were ended"""
+    ended = 0
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            if not isinstance(handler, ConversationHandler):
+                continue
+            # Keys are (chat_id, user_id); PTB has no public way to end someone else's conversation
+            conversations = handler._conversations
+            for key in [key for key in conversations if key[-1] in user_ids]:
+                del conversations[key]
+                ended += 1
+    return ended
+
+
+class IdleUserEvictor:
+    """Last-seen times in LRU order, and the sweep that evicts from the front"""
+
+    def __init__(self, idle_seconds: float, max_users: int, clock: Callable[[], float] = time.monotonic):
+        self.idle_seconds = idle_seconds
+        self.max_users = max_users
+        self.clock = clock
+        self.last_seen: 'OrderedDict[int, float]' = OrderedDict()
+        self.evicted = 0
+        self.conversations_ended = 0
+        self.footprint_bytes = 0
+
+    def touch(self, user_id: int):
+        self.last_seen[user_id] = self.clock()
+        self.last_seen.move_to_end(user_id)
+
+    def pick(self, user_ids: Iterable[int]) -> List[int]:
+        """Users to evict now, least recently seen first"""
+        now = self.clock()
+        for user_id in user_ids:
+            # user_data nobody has stamped yet (e.g. created by a job) starts idling now
+            if user_id not in self.last_seen:
+                self.last_seen[user_id] = now
+        cutoff = now - self.idle_seconds
+        over_cap = len(self.last_seen) - self.max_users
+        victims = []
+        for user_id, seen in self.last_seen.items():
+            if seen > cutoff and len(victims) >= over_cap:
+                break
+            victims.append(user_id)
+        return victims
+
+    async def sweep(self, application: Application) -> int:
+        """Evict idle users from application.user_data; returns how many"""
+        spill = isinstance(application.persistence, SQLitePersistence)
+        if spill and self.pick(application.user_data):
+            # Everything pending goes to disk first; pick again afterwards,
+            # since users may have come back while we were writing
+            await application.update_persistence()
+        victims = self.pick(application.user_data)
+        for user_id in victims:
+            del self.last_seen[user_id]
+            # Not Application.drop_user_data: that also queues deleting the
+            # stored copy, and without persistence keeps the id in a set forever
+            application._user_data.pop(user_id, None)
+            if spill:
+                application.persistence.forget_user(user_id)
+        if victims and not spill:
+            # Without their user_data a flow can't go on (test_answer needs
+            # current_question, ...), so they start over like after a restart.
+            # When spilling, states stay: they resume from the stored flow.
+            self.conversations_ended += end_conversations(application, set(victims))
+        self.evicted += len(victims)
+        self.footprint_bytes = estimate_footprint(application.user_data)
+        return len(victims)
+
+
+evictor = IdleUserEvictor(USER_DATA_IDLE_SECONDS, USER_DATA_MAX_USERS)
+
+
+async def track_user_data(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """TypeHandler (group -2): stamp the update's user as just seen"""
+    if update.effective_user:
+        evictor.touch(update.effective_user.id)
+
+
+async def sweep_user_data_job(context: ContextTypes.DEFAULT_TYPE):
+    """Periodic job: evict idle users' user_data and re-measure what is left"""
+    try:
+        start = time.perf_counter()
+        evicted = await evictor.sweep(context.application)
+        logger.info(f"USER_DATA_SWEEP: evicted {evicted} | {len(context.application.user_data)} users left | "
+                    f"~{evictor.footprint_bytes // 1024} KB | {(time.perf_counter() - start) * 1000:.0f} ms")
+    except Exception as e:
+        logger.error(f"Error sweeping user_data: {e}")
+
+
+def register_user_data_metrics(application: Application):
+    register_gauge('bot_user_data_users', 'Users with user_data in memory', lambda: len(application.user_data))
+    register_gauge('bot_user_data_bytes', 'Estimated user_data memory (as of the last sweep)',
+                   lambda: evictor.footprint_bytes)
+    register_gauge('bot_user_data_evicted_total', 'Idle users evicted from user_data', lambda: evictor.evicted)
+    register_gauge('bot_conversations_ended_total', 'Conversation states dropped with evicted user_data',
+                   lambda: evictor.conversations_ended)
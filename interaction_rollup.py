@@ -0,0 +1,97 @@
+"""
+Rollup and retention for streak_interactions: daily counts + cold archive
+"""
+import asyncio
+import gzip
+import json
+import logging
+import os
+from datetime import datetime, timezone, timedelta
+from typing import Dict, List
+
+from telegram.ext import ContextTypes
+
+from config import (
+    supabase, INTERACTION_RAW_RETENTION_DAYS, INTERACTION_ROLLUP_BATCH_SIZE,
+    INTERACTION_ROLLUP_MAX_BATCHES, INTERACTION_ARCHIVE_DIR
+)
+from job_runs import record_job_run
+
+logger = logging.getLogger(__name__)
+
+JOB_NAME = 'rollup_streak_interactions'
+
+
+def fetch_rollup_batch(cutoff: datetime) -> List[Dict]:
+    """Oldest raw events past retention; rolled-up rows are gone, so this resumes itself"""
+    result = supabase.table('streak_interactions')\
+        .select('id, streak_id, user_id, friend_id, interaction_type, interaction_data, created_at')\
+        .lt('created_at', cutoff.isoformat())\
+        .order('created_at')\
+        .order('id')\
+        .limit(INTERACTION_ROLLUP_BATCH_SIZE)\
+        .execute()
+    return result.data or []
+
+
+def archive_path(now: datetime) -> str:
+    return os.path.join(INTERACTION_ARCHIVE_DIR, f"streak_interactions-{now.strftime('%Y%m%d')}.ndjson.gz")
+
+
+def archive_rows(rows: List[Dict], path: str) -> int:
+    """Append rows carrying free-text payloads to a gzip NDJSON file.
+
+    Each batch is its own gzip member, which gzip readers concatenate. A run
+    that dies between archiving and rollup re-archives that batch next
+    time; records carry their id, so readers can drop duplicates.
+    """
+    payload_rows = [row for row in rows if row.get('interaction_data')]
+    if not payload_rows:
+        return 0
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with gzip.open(path, 'at', encoding='utf-8') as archive:
+        for row in payload_rows:
+            archive.write(json.dumps(row, ensure_ascii=False) + '\n')
+    return len(payload_rows)
+
+
+def rollup_rows(ids: List[int]) -> int:
+    """Fold rows into streak_interaction_daily and delete them in one transaction"""
+    result = supabase.rpc('rollup_streak_interactions', {'p_ids': ids}).execute()
+    return result.data or 0
+
+
+def run_rollup(now: datetime) -> Dict:
+    cutoff = now - timedelta(days=INTERACTION_RAW_RETENTION_DAYS)
+    path = archive_path(now)
+    stats = {'rolled_up': 0, 'archived': 0, 'batches': 0, 'archive': path, 'cutoff': cutoff.isoformat()}
+
+    for _ in range(INTERACTION_ROLLUP_MAX_BATCHES):
+        rows = fetch_rollup_batch(cutoff)
+        if not rows:
+            break
+
+        stats['archived'] += archive_rows(rows, path)
+        stats['rolled_up'] += rollup_rows([row['id'] for row in rows])
+        stats['batches'] += 1
+
+        if len(rows) < INTERACTION_ROLLUP_BATCH_SIZE:
+            break
+
+    return stats
+
+
+async def rollup_streak_interactions(context: ContextTypes.DEFAULT_TYPE):
+    """Daily job: roll raw events past retention into daily counts, archive payloads"""
+    started_at = datetime.now(timezone.utc)
+
+    try:
+        stats = await asyncio.to_thread(run_rollup, started_at)
+    except Exception as e:
+        logger.error(f"Error rolling up streak interactions: {e}")
+        return
+
+    await asyncio.to_thread(record_job_run, JOB_NAME, started_at, stats['rolled_up'], stats)
+    logger.info(f"INTERACTIONS_ROLLED_UP: {stats['rolled_up']} rows in {stats['batches']} batches | "
+                f"Archived: {stats['archived']} -> {stats['archive']}")
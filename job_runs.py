@@ -0,0 +1,35 @@
+"""
+Bookkeeping for scheduled maintenance jobs (job_runs table)
+"""
+import logging
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from config import supabase
+
+logger = logging.getLogger(__name__)
+
+
+def record_job_run(job_name: str, started_at: datetime, rows_affected: int, details: Optional[Dict] = None):
+    """Store one finished run; failures are logged, never raised into the job"""
+    try:
+        supabase.table('job_runs').insert({
+            'job_name': job_name,
+            'started_at': started_at.isoformat(),
+            'finished_at': datetime.now(timezone.utc).isoformat(),
+            'rows_affected': rows_affected,
+            'details': details
+        }).execute()
+    except Exception as e:
+        logger.error(f"Error recording job run {job_name}: {e}")
+
+
+def get_last_job_run(job_name: str) -> Optional[Dict]:
+    """Most recent run of a job, or None"""
+    result = supabase.table('job_runs')\
+        .select('*')\
+        .eq('job_name', job_name)\
+        .order('started_at', desc=True)\
+        .limit(1)\
+        .execute()
+    return result.data[0] if result.data else None
@@ -0,0 +1,44 @@
+"""
+Lazy clients: the heavy SDK import and client construction happen on first attribute access
+"""
+import logging
+import threading
+import time
+from typing import Any, Callable
+
+logger = logging.getLogger(__name__)
+
+_UNSET = object()
+
+
+class Lazy:
+    """Proxy that builds its target with factory() the first time it's used.
+
+    Thread-safe: handlers reach the clients both on the event loop and
+    from asyncio.to_thread workers.
+    """
+    __slots__ = ('_factory', '_name', '_value', '_lock')
+
+    def __init__(self, factory: Callable[[], Any], name: str):
+        self._factory = factory
+        self._name = name
+        self._value = _UNSET
+        self._lock = threading.Lock()
+
+    def _resolve(self):
+        value = self._value
+        if value is _UNSET:
+            with self._lock:
+                if self._value is _UNSET:
+                    start = time.perf_counter()
+                    self._value = self._factory()
+                    logger.info(f"LAZY_INIT: {self._name} in {(time.perf_counter() - start) * 1000:.0f} ms")
+                value = self._value
+        return value
+
+    @property
+    def initialized(self) -> bool:
+        return self._value is not _UNSET
+
+    def __getattr__(self, name):
+        return getattr(self._resolve(), name)
@@ -1,10 +1,13 @@
 import logging
+import time
 from datetime import datetime, timezone, timedelta
-from typing import List, Dict, Tuple
+from typing import List, Dict, NamedTuple, Optional, Tuple
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from telegram.constants import ParseMode
-from config import supabase
+from config import supabase, LEADERBOARD_REFRESH_SECONDS
+from single_flight import SingleFlight
+from router import Router
 import urllib.parse
 import asyncio
 
@@ -51,173 +54,222 @@ def get_leaderboard_text(lang: str, key: str) -> str:
     return LEADERBOARD_TRANSLATIONS.get(lang, LEADERBOARD_TRANSLATIONS['en']).get(key, key)
 
 
-def get_weekly_top_scores() -> List[Dict]:
-    """Get top 10 test scores from this week (OPTIMIZED)"""
-    try:
-        # Calculate start of week (Monday)
-        now = datetime.now(timezone.utc)
-        start_of_week = now - timedelta(days=now.weekday())
-        start_of_week = start_of_week.replace(hour=0, minute=0, second=0, microsecond=0)
-        
-        # Get test results from this week - LIMIT to 100 for speed
-        results = supabase.table('test_results')\
-            .select('user_id, score, created_at')\
-            .gte('created_at', start_of_week.isoformat())\
-            .order('score', desc=True)\
-            .order('created_at', desc=False)\
-            .limit(100)\
-            .execute()
-        
-        if not results.data:
-            return []
-        
-        # Group by user and get their best score
-        user_scores = {}
-        for result in results.data:
-            user_id = result['user_id']
-            score = result['score']
-            
-            if user_id not in user_scores or score > user_scores[user_id]:
-                user_scores[user_id] = score
-        
-        # Sort and take top 10
-        top_users = sorted(user_scores.items(), key=lambda x: x[1], reverse=True)[:10]
-        
-        # Batch fetch user info for all top users
-        user_ids = [str(user_id) for user_id, _ in top_users]
-        
-        user_info_result = supabase.table('friends_users')\
-            .select('telegram_id, first_name, last_name, username')\
-            .in_('telegram_id', user_ids)\
-            .execute()
-        
-        # Create a map of user_id to user info
-        user_info_map = {}
-        if user_info_result.data:
-            for user in user_info_result.data:
-                user_info_map[user['telegram_id']] = user
-        
-        # Build leaderboard
-        leaderboard = []
-        for user_id, score in top_users:
-            user = user_info_map.get(str(user_id))
-            if user:
-                name = f"{user.get('first_name', '')} {user.get('last_name', '')}".strip()
-                if not name:
-                    name = user.get('username', 'User')
-            else:
-                name = 'User'
-            
-            leaderboard.append({
-                'user_id': user_id,
-                'name': name,
-                'score': score
-            })
-        
-        logger.info(f"LEADERBOARD_WEEKLY: Generated with {len(leaderboard)} entries")
-        return leaderboard
-        
-    except Exception as e:
-        logger.error(f"Error getting weekly top scores: {e}")
-        return []
+def _display_name(user: Dict) -> str:
+    if not user:
+        return 'User'
+    name = f"{user.get('first_name') or ''} {user.get('last_name') or ''}".strip()
+    return name or user.get('username') or 'User'
+
+
+def _fetch_names(user_ids) -> Dict[str, str]:
+    """One batched friends_users lookup -> {telegram_id: display name}"""
+    user_ids = list({str(u) for u in user_ids})
+    if not user_ids:
+        return {}
+    result = supabase.table('friends_users')\
+        .select('telegram_id, first_name, last_name, username')\
+        .in_('telegram_id', user_ids)\
+        .execute()
+    return {str(u['telegram_id']): _display_name(u) for u in (result.data or [])}
+
+
+def _weekly_best_scores() -> List[Tuple[str, int]]:
+    """Best score per user this week, sorted best first"""
+    # Calculate start of week (Monday)
+    now = datetime.now(timezone.utc)
+    start_of_week = now - timedelta(days=now.weekday())
+    start_of_week = start_of_week.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    # Get test results from this week - LIMIT to 100 for speed
+    results = supabase.table('test_results')\
+        .select('user_id, score, created_at')\
+        .gte('created_at', start_of_week.isoformat())\
+        .order('score', desc=True)\
+        .order('created_at', desc=False)\
+        .limit(100)\
+        .execute()
+
+    # Group by user and get their best score
+    user_scores = {}
+    for result in results.data or []:
+        user_id = result['user_id']
+        if user_id not in user_scores or result['score'] > user_scores[user_id]:
+            user_scores[user_id] = result['score']
+
+    return sorted(user_scores.items(), key=lambda x: x[1], reverse=True)
+
+
+def _streak_pairs() -> List[Tuple[int, int, int]]:
+    """Distinct (user_id, friend_id, current_streak) pairs, longest first"""
+    streaks = supabase.table('friendship_streaks')\
+        .select('user_id, friend_id, current_streak')\
+        .gt('current_streak', 0)\
+        .order('current_streak', desc=True)\
+        .limit(30)\
+        .execute()
+
+    pairs = []
+    seen_pairs = set()
+    for streak in streaks.data or []:
+        user_id = int(streak['user_id'])
+        friend_id = int(streak['friend_id'])
+        pair = tuple(sorted([user_id, friend_id]))
+        if pair in seen_pairs:
+            continue
+        seen_pairs.add(pair)
+        pairs.append((user_id, friend_id, streak['current_streak']))
+    return pairs
+
+
+def _weekly_entries(scores: List[Tuple[str, int]], names: Dict[str, str]) -> List[Dict]:
+    return [
+        {'user_id': user_id, 'name': names.get(str(user_id), 'User'), 'score': score}
+        for user_id, score in scores[:10]
+    ]
+
+
+def _streak_entries(pairs: List[Tuple[int, int, int]], names: Dict[str, str]) -> List[Dict]:
+    return [
+        {
+            'user1_id': user_id,
+            'user2_id': friend_id,
+            'name1': names[str(user_id)],
+            'name2': names[str(friend_id)],
+            'streak': streak
+        }
+        for user_id, friend_id, streak in pairs[:10]
+        if str(user_id) in names and str(friend_id) in names
+    ]
+
+
+# ==================== SNAPSHOT SERVICE ====================
+
+class LeaderboardSnapshot(NamedTuple):
+    """Pre-rendered boards plus the rank lookups needed for the viewer line"""
+    weekly_text: Dict[str, str]        # lang -> rendered weekly section
+    streaks_text: Dict[str, str]       # lang -> rendered streaks section
+    weekly_ranks: Dict[int, Tuple[int, int]]   # user_id -> (rank, score)
+    streak_ranks: Dict[int, Tuple[int, int]]   # user_id -> (best rank, days)
+    built_at: float
+
+
+_snapshot: Optional[LeaderboardSnapshot] = None
+_refresh_flight = SingleFlight()
+_dirty = False
+_background_refresh: Optional[asyncio.Task] = None  # a read-triggered refresh, if one is running
+
+
+def render_weekly_section(lang: str, weekly_scores: List[Dict]) -> str:
+    text = get_leaderboard_text(lang, 'weekly_scores') + '\n'
+    if not weekly_scores:
+        return text + f'<i>{get_leaderboard_text(lang, "no_data")}</i>\n'
+    for rank, entry in enumerate(weekly_scores[:10], start=1):
+        emoji = '🥇' if rank == 1 else '🥈' if rank == 2 else '🥉' if rank == 3 else '  '
+        text += f'{emoji} {rank}. <b>{entry["name"]}</b> — {entry["score"]}%\n'
+    return text
+
+
+def render_streaks_section(lang: str, longest_streaks: List[Dict]) -> str:
+    text = get_leaderboard_text(lang, 'longest_streaks') + '\n'
+    if not longest_streaks:
+        return text + f'<i>{get_leaderboard_text(lang, "no_data")}</i>\n'
+    for rank, entry in enumerate(longest_streaks[:10], start=1):
+        emoji = '🥇' if rank == 1 else '🥈' if rank == 2 else '🥉' if rank == 3 else '  '
+        text += f'{emoji} {rank}. <b>{entry["name1"]}</b> & <b>{entry["name2"]}</b> — {entry["streak"]} {get_leaderboard_text(lang, "days")}\n'
+    return text
+
+
+def build_leaderboard_snapshot() -> LeaderboardSnapshot:
+    """Query both boards (one shared name lookup) and render every language"""
+    scores = _weekly_best_scores()
+    pairs = _streak_pairs()
+    names = _fetch_names(
+        [u for u, _ in scores[:10]] + [u for pair in pairs[:10] for u in pair[:2]]
+    )
+    weekly_scores = _weekly_entries(scores, names)
+    longest_streaks = _streak_entries(pairs, names)
+
+    weekly_ranks = {int(u): (rank, score) for rank, (u, score) in enumerate(scores, start=1)}
+    streak_ranks = {}
+    for rank, (user_id, friend_id, streak) in enumerate(pairs, start=1):
+        streak_ranks.setdefault(user_id, (rank, streak))
+        streak_ranks.setdefault(friend_id, (rank, streak))
+
+    return LeaderboardSnapshot(
+        weekly_text={lang: render_weekly_section(lang, weekly_scores) for lang in LEADERBOARD_TRANSLATIONS},
+        streaks_text={lang: render_streaks_section(lang, longest_streaks) for lang in LEADERBOARD_TRANSLATIONS},
+        weekly_ranks=weekly_ranks,
+        streak_ranks=streak_ranks,
+        built_at=time.monotonic()
+    )
+
+
+def mark_leaderboard_dirty():
+    """Called after writes that can move the boards; picked up by the debounce job"""
+    global _dirty
+    _dirty = True
+
+
+async def refresh_leaderboard() -> Optional[LeaderboardSnapshot]:
+    """Rebuild the snapshot; concurrent callers share one in-flight refresh"""
+    return await _refresh_flight.do('leaderboard', _refresh)
 
-def get_longest_streaks() -> List[Dict]:
-    """Get top 10 longest current streaks (OPTIMIZED)"""
+
+async def _refresh() -> Optional[LeaderboardSnapshot]:
+    global _snapshot, _dirty
+    _dirty = False
     try:
-        # Get top 30 streaks (faster than 40)
-        streaks = supabase.table('friendship_streaks')\
-            .select('user_id, friend_id, current_streak')\
-            .gt('current_streak', 0)\
-            .order('current_streak', desc=True)\
-            .limit(30)\
-            .execute()
-        
-        if not streaks.data:
-            return []
-        
-        leaderboard = []
-        seen_pairs = set()
-        
-        # Collect all user IDs to batch fetch
-        all_user_ids = set()
-        valid_streaks = []
-        
-        for streak in streaks.data:
-            user_id = int(streak['user_id'])
-            friend_id = int(streak['friend_id'])
-            current_streak = streak['current_streak']
-            
-            if current_streak == 0:
-                continue
-            
-            pair = tuple(sorted([user_id, friend_id]))
-            if pair in seen_pairs:
-                continue
-            
-            seen_pairs.add(pair)
-            valid_streaks.append((user_id, friend_id, current_streak))
-            all_user_ids.add(str(user_id))
-            all_user_ids.add(str(friend_id))
-            
-            if len(valid_streaks) >= 10:
-                break
-        
-        # Batch fetch all user info at once
-        user_info_result = supabase.table('friends_users')\
-            .select('telegram_id, first_name, last_name, username')\
-            .in_('telegram_id', list(all_user_ids))\
-            .execute()
-        
-        # Create user info map
-        user_info_map = {}
-        if user_info_result.data:
-            for user in user_info_result.data:
-                user_info_map[user['telegram_id']] = user
-        
-        # Build leaderboard
-        for user_id, friend_id, current_streak in valid_streaks:
-            user1 = user_info_map.get(str(user_id))
-            user2 = user_info_map.get(str(friend_id))
-            
-            if user1 and user2:
-                name1 = f"{user1.get('first_name', '')} {user1.get('last_name', '')}".strip()
-                if not name1:
-                    name1 = user1.get('username', 'User')
-                
-                name2 = f"{user2.get('first_name', '')} {user2.get('last_name', '')}".strip()
-                if not name2:
-                    name2 = user2.get('username', 'User')
-                
-                leaderboard.append({
-                    'user1_id': user_id,
-                    'user2_id': friend_id,
-                    'name1': name1,
-                    'name2': name2,
-                    'streak': current_streak
-                })
-        
-        logger.info(f"LEADERBOARD_STREAKS: Generated with {len(leaderboard)} entries")
-        return leaderboard
-        
+        _snapshot = await asyncio.to_thread(build_leaderboard_snapshot)
+        logger.info(f"LEADERBOARD_SNAPSHOT: Rebuilt | Weekly ranked: {len(_snapshot.weekly_ranks)} | Streak users: {len(_snapshot.streak_ranks)}")
     except Exception as e:
-        logger.error(f"Error getting longest streaks: {e}")
-        return []
+        _dirty = True
+        logger.error(f"Error refreshing leaderboard snapshot: {e}")
+    return _snapshot
+
+
+async def get_leaderboard_snapshot() -> Optional[LeaderboardSnapshot]:
+    """Stale-while-revalidate: serve the current snapshot, refresh in the background"""
+    if _snapshot is None:
+        # Only the very first request after startup (before the warm-up job) waits
+        return await refresh_leaderboard()
+
+    # Dirty marks are left to the debounce job; reads only catch a stale snapshot
+    if time.monotonic() - _snapshot.built_at > LEADERBOARD_REFRESH_SECONDS:
+        _refresh_in_background()
+    return _snapshot
+
+
+def _refresh_in_background():
+    global _background_refresh
+    if _background_refresh is None or _background_refresh.done():
+        # Keep a reference: the loop only holds tasks weakly
+        _background_refresh = asyncio.create_task(refresh_leaderboard())
+
+
+async def refresh_leaderboard_job(context: ContextTypes.DEFAULT_TYPE):
+    """Repeating job: rebuild when writes marked the board dirty or it got old"""
+    if _snapshot is None or _dirty or time.monotonic() - _snapshot.built_at > LEADERBOARD_REFRESH_SECONDS:
+        await refresh_leaderboard()
+
 
+def render_leaderboard(snapshot: LeaderboardSnapshot, lang: str, user_id: int) -> str:
+    """Pre-rendered sections plus the viewer's own rank lines"""
+    if lang not in LEADERBOARD_TRANSLATIONS:
+        lang = 'en'
 
-def get_user_rank_in_weekly(user_id: int, weekly_scores: List[Dict]) -> Tuple[int, int]:
-    """Get user's rank and score in weekly leaderboard. Returns (rank, score) or (0, 0)"""
-    for rank, entry in enumerate(weekly_scores, start=1):
-        if int(entry['user_id']) == user_id:
-            return rank, entry['score']
-    return 0, 0
+    text = get_leaderboard_text(lang, 'title') + '\n\n' + snapshot.weekly_text[lang]
 
+    user_rank, user_score = snapshot.weekly_ranks.get(user_id, (0, 0))
+    if user_rank > 10:
+        text += f'\n{get_leaderboard_text(lang, "your_rank")} #{user_rank} ({user_score}%)\n'
 
-def get_user_rank_in_streaks(user_id: int, longest_streaks: List[Dict]) -> Tuple[int, int]:
-    """Get user's best streak rank. Returns (rank, streak_days) or (0, 0)"""
-    for rank, entry in enumerate(longest_streaks, start=1):
-        if int(entry['user1_id']) == user_id or int(entry['user2_id']) == user_id:
-            return rank, entry['streak']
-    return 0, 0
+    text += '\n' + snapshot.streaks_text[lang]
+
+    streak_rank, streak_days = snapshot.streak_ranks.get(user_id, (0, 0))
+    if streak_rank > 10:
+        text += f'\n{get_leaderboard_text(lang, "your_rank")} #{streak_rank} ({streak_days} {get_leaderboard_text(lang, "days")})\n'
+
+    return text
 
 
 async def show_leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -225,90 +277,34 @@ async def show_leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     if query:
         await query.answer()
-    
-    user_id = update.effective_user.id
+
+    user = update.effective_user
+    user_id = user.id
     lang = context.user_data.get('language', 'en')
-    
-    # Show typing indicator
-    await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
-    
+
     try:
-        # Run both queries in parallel for speed
-        weekly_scores_task = asyncio.create_task(asyncio.to_thread(get_weekly_top_scores))
-        longest_streaks_task = asyncio.create_task(asyncio.to_thread(get_longest_streaks))
-        
-        weekly_scores, longest_streaks = await asyncio.gather(
-            weekly_scores_task,
-            longest_streaks_task,
-            return_exceptions=True
-        )
-        
-        # Handle exceptions
-        if isinstance(weekly_scores, Exception):
-            logger.error(f"Error getting weekly scores: {weekly_scores}")
-            weekly_scores = []
-        if isinstance(longest_streaks, Exception):
-            logger.error(f"Error getting longest streaks: {longest_streaks}")
-            longest_streaks = []
-        
-        # Build message
-        text = get_leaderboard_text(lang, 'title') + '\n\n'
-        
-        # Weekly scores section
-        text += get_leaderboard_text(lang, 'weekly_scores') + '\n'
-        
-        if weekly_scores:
-            for rank, entry in enumerate(weekly_scores[:10], start=1):
-                emoji = '🥇' if rank == 1 else '🥈' if rank == 2 else '🥉' if rank == 3 else '  '
-                text += f'{emoji} {rank}. <b>{entry["name"]}</b> — {entry["score"]}%\n'
-            
-            # Show user's rank if not in top 10
-            user_rank, user_score = get_user_rank_in_weekly(user_id, weekly_scores)
-            if user_rank > 10 and user_rank > 0:
-                text += f'\n{get_leaderboard_text(lang, "your_rank")} #{user_rank} ({user_score}%)\n'
-        else:
-            text += f'<i>{get_leaderboard_text(lang, "no_data")}</i>\n'
-        
-        text += '\n'
-        
-        # Longest streaks section
-        text += get_leaderboard_text(lang, 'longest_streaks') + '\n'
-        
-        if longest_streaks:
-            for rank, entry in enumerate(longest_streaks[:10], start=1):
-                emoji = '🥇' if rank == 1 else '🥈' if rank == 2 else '🥉' if rank == 3 else '  '
-                text += f'{emoji} {rank}. <b>{entry["name1"]}</b> & <b>{entry["name2"]}</b> — {entry["streak"]} {get_leaderboard_text(lang, "days")}\n'
-            
-            # Show user's best streak if not in top 10
-            streak_rank, streak_days = get_user_rank_in_streaks(user_id, longest_streaks)
-            if streak_rank > 10 and streak_rank > 0:
-                text += f'\n{get_leaderboard_text(lang, "your_rank")} #{streak_rank} ({streak_days} {get_leaderboard_text(lang, "days")})\n'
-        else:
-            text += f'<i>{get_leaderboard_text(lang, "no_data")}</i>\n'
-        
+        snapshot = await get_leaderboard_snapshot()
+        if snapshot is None:
+            raise RuntimeError("leaderboard snapshot unavailable")
+
+        text = render_leaderboard(snapshot, lang, user_id)
+
         # Create share link for streak
         bot_username = context.bot.username
         streak_link = f"https://t.me/{bot_username}?start=streak_{user_id}"
-        
-        # Get user name for share message
-        user_info = supabase.table('friends_users')\
-            .select('first_name, last_name')\
-            .eq('telegram_id', str(user_id))\
-            .execute()
-        
-        user_name = 'Friend'
-        if user_info.data:
-            user_name = f"{user_info.data[0].get('first_name', '')} {user_info.data[0].get('last_name', '')}".strip()
-        
+
+        # Name for the share message comes straight from the update
+        user_name = f"{user.first_name or ''} {user.last_name or ''}".strip() or 'Friend'
+
         # Share messages
         share_messages = {
             'uz': f"👋 Salom! Men {user_name} siz bilan har kunlik muloqotni boshlashni xohlayman!\n\n🔥 Boshlash uchun havolani bosing:\n{streak_link}",
             'ru': f"👋 Привет! {user_name} хочет начать ежедневное общение с вами!\n\n🔥 Нажмите ссылку, чтобы начать:\n{streak_link}",
             'en': f"👋 Hey! {user_name} wants to start daily communication with you!\n\n🔥 Click the link to start:\n{streak_link}"
         }
-        
+
         share_text_encoded = urllib.parse.quote(share_messages.get(lang, share_messages['en']))
-        
+
         # Button labels
         button_labels = {
             'uz': {
@@ -324,9 +320,9 @@ async def show_leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 'my_test': '📝 My test'
             }
         }
-        
+
         labels = button_labels.get(lang, button_labels['en'])
-        
+
         keyboard = [
             [InlineKeyboardButton(
                 labels['share'],
@@ -341,14 +337,14 @@ async def show_leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 callback_data='streaks_menu'
             )]
         ]
-        
+
         reply_markup = InlineKeyboardMarkup(keyboard)
-        
+
         if query:
             await query.edit_message_text(text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
         else:
             await update.message.reply_text(text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
-            
+
     except Exception as e:
         logger.error(f"Error showing leaderboard: {e}")
         import traceback
@@ -362,13 +358,19 @@ async def show_leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def leaderboard_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /leaderboard command"""
-    # Get user language
+    # Get user language (only when this session doesn't know it yet)
     user_id = update.effective_user.id
-    try:
-        result = supabase.table('friends_users').select('language').eq('telegram_id', str(user_id)).execute()
-        if result.data:
-            context.user_data['language'] = result.data[0]['language']
-    except Exception:
-        context.user_data['language'] = 'en'
+    if 'language' not in context.user_data:
+        try:
+            result = supabase.table('friends_users').select('language').eq('telegram_id', str(user_id)).execute()
+            if result.data:
+                context.user_data['language'] = result.data[0]['language']
+        except Exception:
+            context.user_data['language'] = 'en'
     
-    await show_leaderboard(update, context)
\ No newline at end of file
+    await show_leaderboard(update, context)
+
+
+def register_routes(router: Router):
+    router.command('leaderboard', leaderboard_command)
+    router.callback('streak_leaderboard', show_leaderboard)
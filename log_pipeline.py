@@ -0,0 +1,165 @@
+"""
+Non-blocking logging: handlers enqueue records, a listener thread formats and writes them
+
+Records keep their %-args until the listener formats them, so a logger call
+on the event loop costs a filter check and a queue put. Messages named like
+"EVENT_NAME: details" become structured events, and per-event sample rates
+thin out the high-volume ones before they are even queued.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import re
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+
+_EVENT = re.compile(r'([A-Z][A-Z0-9_]+):')
+# Attributes every LogRecord has; anything else came in through extra={...}
+_STANDARD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'sample_rate'}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_sinks: Dict[str, Tuple[logging.Logger, logging.handlers.QueueListener]] = {}
+
+
+def event_name(record: logging.LogRecord) -> Optional[str]:
+    """'TEST_COMPLETED' for "TEST_COMPLETED: User %s ...", or an explicit extra={'event': ...}"""
+    event = getattr(record, 'event', None)
+    if event is None and isinstance(record.msg, str):
+        match = _EVENT.match(record.msg)
+        if match:
+            event = match.group(1)
+    return event
+
+
+class SamplingFilter(logging.Filter):
+    """Keep roughly `rate` of each sampled event; unlisted events and warnings always pass"""
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        rate = self.rates.get(event_name(record))
+        if rate is None:
+            return True
+        record.sample_rate = rate
+        return random.random() < rate
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, event, message and any extra fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+        }
+        event = event_name(record)
+        if event:
+            entry['event'] = event
+        entry['message'] = record.getMessage()
+        if getattr(record, 'sample_rate', None) is not None:
+            entry['sample_rate'] = record.sample_rate
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRS and key != 'event':
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """The record's message is a dict; write it as one JSON line, nothing else"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        return json.dumps(record.msg, ensure_ascii=False, default=str)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Enqueue the record as is: formatting happens on the listener thread.
+
+    The stock prepare() formats on the caller's thread (it exists for
+    multiprocessing queues); in-process, the record can travel unformatted.
+    Args are formatted later, so don't log objects you are about to mutate.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def skip_unused_record_fields():
+    """The logging HOWTO's "Optimization" switches: no caller/thread/process info"""
+    # Neither format uses them, and findCaller's stack walk is most of a record's cost
+    logging._srcfile = None
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+
+
+def setup_logging(level: str, log_file: Optional[str], json_format: bool, text_format: str,
+                  sample_rates: Dict[str, float]):
+    """Route the root logger through a queue to stderr (and log_file, if set)"""
+    global _listener
+    if _listener is not None:
+        return
+
+    skip_unused_record_fields()
+    formatter = JsonFormatter() if json_format else logging.Formatter(text_format)
+    outputs = [logging.StreamHandler()]
+    if log_file:
+        outputs.append(logging.FileHandler(log_file, encoding='utf-8'))
+    for output in outputs:
+        output.setFormatter(formatter)
+
+    records = queue.SimpleQueue()
+    handler = DeferredQueueHandler(records)
+    handler.addFilter(SamplingFilter(sample_rates))
+
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level.upper())
+
+    _listener = logging.handlers.QueueListener(records, *outputs)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def json_lines_logger(path: str) -> logging.Logger:
+    """A logger whose dict messages are appended to path as JSON lines.
+
+    Like the root logger, callers only enqueue; a listener thread of the
+    sink's own opens the file, serializes and writes.
+    """
+    sink = _sinks.get(path)
+    if sink is None:
+        output = logging.FileHandler(path, encoding='utf-8', delay=True)
+        output.setFormatter(JsonLinesFormatter())
+        records = queue.SimpleQueue()
+        log = logging.getLogger(f'{__name__}.sink.{len(_sinks)}')
+        log.handlers[:] = [DeferredQueueHandler(records)]
+        log.propagate = False
+        log.setLevel(logging.INFO)
+        listener = logging.handlers.QueueListener(records, output)
+        listener.start()
+        sink = _sinks[path] = (log, listener)
+        atexit.register(stop_logging)
+    return sink[0]
+
+
+def stop_logging():
+    """Flush whatever is still queued (runs at exit)"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    while _sinks:
+        _, (_, listener) = _sinks.popitem()
+        listener.stop()
@@ -0,0 +1,110 @@
+"""
+Event-loop health: scheduling lag percentiles, and the stack that was running when the loop stalled
+"""
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from metrics import register_gauge
+
+logger = logging.getLogger(__name__)
+
+LAG_WINDOW = 1200  # samples kept for the percentiles (10 min at the default 0.5 s interval)
+STACK_DEPTH = 12
+_PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def format_stack(frame, depth: int = STACK_DEPTH) -> str:
+    """Innermost first, one line: 'func (file:line) <- caller (file:line) ...'"""
+    parts = []
+    while frame is not None and len(parts) < depth:
+        code = frame.f_code
+        path = code.co_filename
+        name = os.path.relpath(path, _PROJECT_DIR) if path.startswith(_PROJECT_DIR) else os.path.basename(path)
+        parts.append(f"{code.co_name} ({name}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ' <- '.join(parts)
+
+
+class LoopMonitor:
+    """A ticker task measures how late the loop wakes it; a watchdog thread
+    samples the loop thread's stack when the ticker is overdue.
+
+    Cost is one sleep per interval on the loop and one thread wake-up per
+    half threshold; stacks are only sampled while the loop is stalled.
+    """
+
+    def __init__(self, interval: float, threshold: float):
+        self.interval = interval
+        self.threshold = threshold
+        self.lags: Deque[float] = deque(maxlen=LAG_WINDOW)
+        self.max_lag = 0.0
+        self.stalls = 0
+        self.recent_stalls: Deque[Dict] = deque(maxlen=20)
+        self._heartbeat = time.monotonic()
+        self._stall_stack: Optional[str] = None
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+
+    def start(self):
+        """Call from the running loop (post_init)"""
+        self._loop_thread = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._task = asyncio.get_running_loop().create_task(self._tick())
+        threading.Thread(target=self._watch, name='loop-watchdog', daemon=True).start()
+        logger.info(f"LOOP_MONITOR_STARTED: every {self.interval} s | stall at {self.threshold} s")
+
+    def stop(self):
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+
+    async def _tick(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            scheduled = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - scheduled - self.interval)
+            self._heartbeat = time.monotonic()
+            self.lags.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+            if lag >= self.threshold:
+                self._report_stall(lag)
+            else:
+                self._stall_stack = None  # sampled just as the loop caught up
+
+    def _report_stall(self, lag: float):
+        stack, self._stall_stack = self._stall_stack, None
+        self.stalls += 1
+        self.recent_stalls.append({'at': time.time(), 'lag': round(lag, 3), 'stack': stack})
+        logger.warning(f"LOOP_STALL: {lag * 1000:.0f} ms | Stack: {stack or 'not sampled'}")
+
+    def _watch(self):
+        """Watchdog thread: grab the loop thread's stack once per stall"""
+        while not self._stop.wait(self.threshold / 2):
+            overdue = time.monotonic() - self._heartbeat - self.interval
+            if overdue < self.threshold or self._stall_stack is not None:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is not None:
+                self._stall_stack = format_stack(frame)
+
+    def percentiles(self) -> Tuple[float, float, float]:
+        ordered: List[float] = sorted(self.lags)
+        if not ordered:
+            return 0.0, 0.0, 0.0
+        pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+        return pick(0.50), pick(0.95), pick(0.99)
+
+    def register_metrics(self):
+        for index, name in enumerate(('p50', 'p95', 'p99')):
+            register_gauge(f'bot_loop_lag_{name}_seconds', f'Event loop scheduling lag {name} (recent window)',
+                           lambda index=index: self.percentiles()[index])
+        register_gauge('bot_loop_lag_max_seconds', 'Worst event loop lag since start', lambda: self.max_lag)
+        register_gauge('bot_loop_stalls_total', 'Ticks late by more than the stall threshold', lambda: self.stalls)
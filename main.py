@@ -11,23 +11,33 @@ from telegram import (
 )
 from telegram.ext import (
     Application, CommandHandler, MessageHandler, ConversationHandler,
-    CallbackQueryHandler, filters, ContextTypes
+    CallbackQueryHandler, TypeHandler, filters, ContextTypes
 )
 from telegram.constants import ParseMode
-from config import supabase, model, TELEGRAM_BOT_TOKEN, FREE_BIRTHDAY_LIMIT, FREE_TEST_LIMIT
-from share import share_main
-from balance import premium_info_handler, subscribe_callback, approve_premium_payment, decline_premium_payment
+from config import supabase, model, TELEGRAM_BOT_TOKEN, FREE_BIRTHDAY_LIMIT, FREE_TEST_LIMIT, LEADERBOARD_DEBOUNCE_SECONDS, STREAK_RISK_REMINDER_TIME_UTC, ADMIN_STATS_REFRESH_SECONDS, ACTIVITY_FLUSH_SECONDS, METRICS_HOST, METRICS_PORT, UX_PAUSE_SECONDS, LOOP_MONITOR_INTERVAL, LOOP_STALL_THRESHOLD, PERSISTENCE_FILE, PERSISTENCE_UPDATE_SECONDS, PERSISTENCE_RETENTION_DAYS, USER_DATA_SWEEP_SECONDS
+from balance import subscribe_callback, approve_premium_payment, decline_premium_payment, is_user_premium
 import urllib.parse
 from admin import *
 from start_handler import *
-from friendship_streaks import show_streaks_menu, show_friend_selection
-from leaderboard import show_leaderboard, leaderboard_command
+from leaderboard import mark_leaderboard_dirty, refresh_leaderboard_job
+from friend_graph import friend_graph, warm_friend_graph
+from streak_expiry import expire_stale_streaks
+from streak_reminders import send_streak_risk_reminders
+from interaction_rollup import rollup_streak_interactions
+from admin import bump_stat, refresh_dashboard_stats_job
+from activity import track_activity, flush_activity_job, load_activity_job
 from streak_actions import *
+import admin, balance, friend_match, friendship_streaks, leaderboard, share, start_handler, streak_actions, \
+    streak_reminders, streak_restore
+from router import Router, callback_data
+from idle_users import track_user_data, sweep_user_data_job, register_user_data_metrics
+from loop_monitor import LoopMonitor
+from persistence import SQLitePersistence
+from metrics import InstrumentedRequest, instrument_application, instrument_job, start_metrics_server, register_gauge, process_rss_bytes
+from test_cache import get_test_definition, pack_answers, unpack_answers, count_matching_answers
+from test_stats import record_test_result, get_test_aggregate, get_top_results
+from test_versions import archive_active_tests, compact_archived_tests
 
-# Logging setup
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
-)
 logger = logging.getLogger(__name__)
 
 logging.getLogger("httpx").setLevel(logging.WARNING)
@@ -164,25 +174,14 @@ def get_user_birthday_count(user_id: int) -> int:
         return 0
 
 def get_user_test_count(user_id: int) -> int:
-    """Get count of tests created by user"""
+    """Get count of active (non-archived) tests created by user"""
     try:
-        result = supabase.table('tests').select('id', count='exact').eq('user_id', str(user_id)).execute()
+        result = supabase.table('tests').select('id', count='exact').eq('user_id', str(user_id)).is_('archived_at', 'null').execute()
         return result.count if result.count else 0
     except Exception as e:
         logger.error(f"Error getting test count: {e}")
         return 0
 
-def is_user_premium(user_id: int) -> bool:
-    """Check if user is premium"""
-    try:
-        result = supabase.table('friends_users').select('is_premium').eq('telegram_id', str(user_id)).execute()
-        if result.data:
-            return result.data[0].get('is_premium', False)
-    except Exception as e:
-        logger.error(f"Error checking premium status: {e}")
-    return False
-
-
 def format_display_name(row: dict) -> str:
     """Build: 'First Last (@username)' with fallbacks"""
     first = row.get('first_name') or ''
@@ -273,6 +272,7 @@ async def process_birthday(update: Update, context: ContextTypes.DEFAULT_TYPE):
             
             supabase.table('birthdays').insert(birthday_data).execute()
             saved_count += 1
+            bump_stat('total_birthdays')
         
         if saved_count == 1:
             success_text = get_text(lang, 'birthday_saved').format(
@@ -355,7 +355,7 @@ async def create_test_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     if not is_premium and test_count >= FREE_TEST_LIMIT:
         # Still show existing test link so user can share it
-        existing_test = supabase.table('tests').select('id').eq('user_id', str(user_id)).order('created_at', desc=True).limit(1).execute()
+        existing_test = supabase.table('tests').select('id').eq('user_id', str(user_id)).is_('archived_at', 'null').order('created_at', desc=True).limit(1).execute()
 
         limit_text = get_text(lang, 'test_limit_reached')
 
@@ -399,7 +399,7 @@ async def create_test_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.edit_message_text(intro_text, parse_mode=ParseMode.HTML)
     
     # Wait a bit, then show first question
-    await asyncio.sleep(1)
+    await asyncio.sleep(UX_PAUSE_SECONDS)
     
     # Show first question
     await show_test_question(update, context, lang)
@@ -407,7 +407,7 @@ async def create_test_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return CREATING_TEST
 
 async def recreate_test(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Delete old test and start creating new one"""
+    """Archive old test and start creating new one"""
     query = update.callback_query
     await query.answer()
     
@@ -415,15 +415,9 @@ async def recreate_test(update: Update, context: ContextTypes.DEFAULT_TYPE):
     lang = get_user_language(user_id)
     
     try:
-        # Delete old test and its results
-        old_test = supabase.table('tests').select('id').eq('user_id', str(user_id)).execute()
-        if old_test.data:
-            test_id = old_test.data[0]['id']
-            # Delete test results first
-            supabase.table('test_results').delete().eq('test_id', test_id).execute()
-            # Delete test
-            supabase.table('tests').delete().eq('id', test_id).execute()
-        
+        # Archive current version(s); results are kept for leaderboards/history
+        archive_active_tests(user_id)
+
         # Clear any existing test creation data
         context.user_data.pop('test_answers', None)
         context.user_data.pop('current_question', None)
@@ -440,7 +434,7 @@ async def recreate_test(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.edit_message_text(intro_text, parse_mode=ParseMode.HTML)
         
         # Wait a bit, then show first question
-        await asyncio.sleep(1)
+        await asyncio.sleep(UX_PAUSE_SECONDS)
         
         # Show first question
         await show_test_question(update, context, lang)
@@ -476,9 +470,9 @@ async def show_test_question(update: Update, context: ContextTypes.DEFAULT_TYPE,
     keyboard = []
     for i in range(0, len(question['options']), 2):
         row = []
-        row.append(InlineKeyboardButton(question['options'][i], callback_data=f'test_answer_{i}'))
+        row.append(InlineKeyboardButton(question['options'][i], callback_data=callback_data('test_answer', i)))
         if i + 1 < len(question['options']):
-            row.append(InlineKeyboardButton(question['options'][i + 1], callback_data=f'test_answer_{i + 1}'))
+            row.append(InlineKeyboardButton(question['options'][i + 1], callback_data=callback_data('test_answer', i + 1)))
         keyboard.append(row)
     
     reply_markup = InlineKeyboardMarkup(keyboard)
@@ -524,13 +518,14 @@ async def test_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     user_id = update.effective_user.id
     lang = get_user_language(update.effective_user.id)
-    answer_index = int(query.data.split('_')[2])
+    answer_index = context.args[0]
     
     # Save answer
     question_index = context.user_data['current_question']
     context.user_data['test_answers'][question_index] = answer_index
     
-    logger.info(f"Creating test - Question {question_index} answered with option {answer_index} by user {user_id}. Total answers so far: {len(context.user_data['test_answers'])}")
+    logger.info("TEST_ANSWER: User %s | Question %s | Option %s | Answers so far: %s",
+                user_id, question_index, answer_index, len(context.user_data['test_answers']))
     
     # Move to next question
     context.user_data['current_question'] += 1
@@ -591,8 +586,9 @@ async def save_test(update: Update, context: ContextTypes.DEFAULT_TYPE, lang: st
             'created_at': datetime.now(timezone.utc).isoformat()
         }
         
-        logger.info(f"Saving test {test_id} with answers: {answers_jsonb}")
+        logger.debug("TEST_SAVING: %s | Answers: %s", test_id, answers_jsonb)
         supabase.table('tests').insert(test_data).execute()
+        bump_stat('total_tests')
         
         # Generate share link
         bot_username = context.bot.username
@@ -666,9 +662,9 @@ async def show_taking_test_question(update: Update, context: ContextTypes.DEFAUL
     keyboard = []
     for i in range(0, len(question['options']), 2):
         row = []
-        row.append(InlineKeyboardButton(question['options'][i], callback_data=f'taking_answer_{i}'))
+        row.append(InlineKeyboardButton(question['options'][i], callback_data=callback_data('taking_answer', i)))
         if i + 1 < len(question['options']):
-            row.append(InlineKeyboardButton(question['options'][i + 1], callback_data=f'taking_answer_{i + 1}'))
+            row.append(InlineKeyboardButton(question['options'][i + 1], callback_data=callback_data('taking_answer', i + 1)))
         keyboard.append(row)
     
     reply_markup = InlineKeyboardMarkup(keyboard)
@@ -723,14 +719,15 @@ async def taking_test_answer(update: Update, context: ContextTypes.DEFAULT_TYPE)
     await query.answer()
     
     lang = get_user_language(update.effective_user.id)
-    answer_index = int(query.data.split('_')[2])
+    answer_index = context.args[0]
     user_id = update.effective_user.id
     
     # Save answer
     question_index = context.user_data['taking_test_question']
     context.user_data['taking_test_answers'][question_index] = answer_index
     
-    logger.info(f"Taking test - Question {question_index} answered with option {answer_index} by user {user_id}. Total answers: {len(context.user_data['taking_test_answers'])}")
+    logger.info("TAKING_ANSWER: User %s | Question %s | Option %s | Answers so far: %s",
+                user_id, question_index, answer_index, len(context.user_data['taking_test_answers']))
     
     # Move to next question
     context.user_data['taking_test_question'] += 1
@@ -759,10 +756,10 @@ async def calculate_test_score(update: Update, context: ContextTypes.DEFAULT_TYP
             )
             return
         
-        # Get owner's answers from JSONB column
-        result = supabase.table('tests').select('answers, user_id').eq('id', test_id).execute()
-        
-        if not result.data or not result.data[0].get('answers'):
+        # Get owner's answer key (cached per test)
+        definition = get_test_definition(test_id)
+
+        if not definition:
             logger.error("No answers found in test")
             await context.bot.send_message(
                 chat_id=update.effective_chat.id,
@@ -770,39 +767,44 @@ async def calculate_test_score(update: Update, context: ContextTypes.DEFAULT_TYP
                 parse_mode=ParseMode.HTML
             )
             return
-        
-        # Parse JSONB answers
-        owner_answers_json = result.data[0]['answers']
-        test_owner_id = result.data[0]['user_id']
-        
-        if isinstance(owner_answers_json, str):
-            owner_answers_dict = json.loads(owner_answers_json)
-        else:
-            owner_answers_dict = owner_answers_json
-        
-        # Convert string keys to int for comparison
-        owner_answers = {int(k): v for k, v in owner_answers_dict.items()}
-        
-        logger.info(f"Owner answers: {owner_answers}")
-        logger.info(f"User answers: {user_answers}")
-        
+
+        # Recreated while this user was answering: the old version takes no new results
+        if definition.archived:
+            logger.info(f"TEST_REPLACED_MID_TAKE: User {user_id} | Test {test_id}")
+            context.user_data.pop('taking_test_id', None)
+            context.user_data.pop('taking_test_answers', None)
+            context.user_data.pop('taking_test_question', None)
+            await context.bot.send_message(
+                chat_id=update.effective_chat.id,
+                text=get_text(lang, 'test_replaced'),
+                parse_mode=ParseMode.HTML
+            )
+            return
+
+        test_owner_id = definition.owner_id
+        user_answers_packed = pack_answers(user_answers)
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("TEST_ANSWER_SHEETS: Owner %s | User %s", unpack_answers(definition.answer_key), dict(user_answers))
+
         # Calculate score - only use questions 0-14
-        correct = sum(1 for q in range(15) if owner_answers.get(q) == user_answers.get(q))
+        correct = count_matching_answers(definition.answer_key, user_answers_packed)
         total = 15
         percentage = int((correct / total) * 100)
-        
-        logger.info(f"Score: {correct}/{total} = {percentage}%")
+
         logger.info(f"TEST_COMPLETED: User {user_id} | Test {test_id} | Score: {percentage}% ({correct}/{total})")
         
-        # FIXED: Save result with upsert to prevent duplicate key error
-        result_data = {
-            'test_id': test_id,
-            'user_id': str(user_id),
-            'score': percentage,
-            'created_at': datetime.now(timezone.utc).isoformat()
-        }
-        supabase.table('test_results').upsert(result_data).execute()
-        
+        # Upsert result and update the test's score aggregate in one call
+        previous_score = record_test_result(test_id, user_id, percentage, user_answers_packed)
+        if previous_score is not None:
+            logger.info(f"TEST_RETAKEN: User {user_id} | Test {test_id} | Previous: {previous_score}%")
+        else:
+            bump_stat('total_results')
+
+
+        friend_graph.add_edge(user_id, test_owner_id)
+        mark_leaderboard_dirty()
+
         # NEW: Create or update streak between test taker and test owner
         from friendship_streaks import get_or_create_streak, update_streak
         from streak_actions import log_interaction
@@ -903,7 +905,7 @@ async def my_tests(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     try:
         # Get user's tests (limit to 1)
-        tests_result = supabase.table('tests').select('*').eq('user_id', str(user_id)).order('created_at', desc=True).limit(1).execute()
+        tests_result = supabase.table('tests').select('*').eq('user_id', str(user_id)).is_('archived_at', 'null').order('created_at', desc=True).limit(1).execute()
         
         if not tests_result.data:
             keyboard = [
@@ -938,44 +940,34 @@ async def my_tests(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         text = get_text(lang, 'test_list') + "\n\n"
         
-        # Get results ordered by score descending, then created_at ascending
-        results = supabase.table('test_results').select('score, user_id, created_at').eq('test_id', test['id']).order('score', desc=True).order('created_at', desc=False).execute()
+        # Aggregate stats come precomputed; only the top slice is fetched
+        display_limit = 30
+        aggregate = get_test_aggregate(test['id'])
 
         # Format test date
         test_date = datetime.fromisoformat(test['created_at'].replace('Z', '+00:00'))
         date_str = test_date.strftime('%d.%m.%Y')
 
         # Build test info
-        total_participants = len(results.data)
+        total_participants = aggregate['participants']
         text += f"📝 <b>{get_text(lang, 'your_test')}</b> ({date_str})\n"
         text += f"🔗 <b>{get_text(lang, 'link')}:</b> <code>{share_link}</code>\n"
         text += f"👥 <b>{get_text(lang, 'participants')}:</b> {total_participants}\n\n"
 
-        if results.data:
-            scores = [r['score'] for r in results.data]
-            avg_score = sum(scores) / len(scores)
-            max_score = max(scores)
-            min_score = min(scores)
+        if total_participants:
+            text += f"📊 <b>{get_text(lang, 'avg_score')}:</b> {aggregate['avg_score']:.0f}%\n"
+            text += f"🏆 <b>{get_text(lang, 'highest_score')}:</b> {aggregate['max_score']}%\n"
+            text += f"📉 <b>{get_text(lang, 'lowest_score')}:</b> {aggregate['min_score']}%\n\n"
 
-            text += f"📊 <b>{get_text(lang, 'avg_score')}:</b> {avg_score:.0f}%\n"
-            text += f"🏆 <b>{get_text(lang, 'highest_score')}:</b> {max_score}%\n"
-            text += f"📉 <b>{get_text(lang, 'lowest_score')}:</b> {min_score}%\n\n"
+            displayed_results = get_top_results(test['id'], display_limit)
 
-            # Limit to top 30 participants
-            display_limit = 30
-            displayed_results = results.data[:display_limit]
-            
             text += f"<b>👤 {get_text(lang, 'participants')}"
             if total_participants > display_limit:
                 text += f" (Top {display_limit})"
             text += ":</b>\n"
-            
+
             for rank, r in enumerate(displayed_results, start=1):
-                try:
-                    user_row = supabase.table('friends_users').select('first_name, last_name, username, telegram_id').eq('telegram_id', r['user_id']).execute()
-                    display_name = format_display_name(user_row.data[0]) if user_row.data else f"User {r['user_id']}"
-                except Exception:
-                    display_name = f"User {r['user_id']}"
+                display_name = format_display_name(r['user']) if r['user'] else f"User {r['user_id']}"
                 text += f"  {rank}. <b>{display_name}</b> — {r['score']}%\n"
             
             if total_participants > display_limit:
@@ -1083,7 +1075,7 @@ async def check_birthdays(context: ContextTypes.DEFAULT_TYPE):
             reminder_text = get_text(lang, 'birthday_reminder').format(name=birthday['name'])
             
             # Add wish generation option
-            keyboard = [[InlineKeyboardButton(get_text(lang, 'generate_wish'), callback_data=f"wish_{birthday['id']}")]]
+            keyboard = [[InlineKeyboardButton(get_text(lang, 'generate_wish'), callback_data=callback_data('wish', birthday['id']))]]
             reply_markup = InlineKeyboardMarkup(keyboard)
             
             await context.bot.send_message(
@@ -1102,7 +1094,7 @@ async def generate_wish_handler(update: Update, context: ContextTypes.DEFAULT_TY
     
     user_id = update.effective_user.id
     lang = get_user_language(user_id)
-    birthday_id = query.data.split('_')[1]
+    birthday_id = context.args[0]
     
     # Get birthday info
     try:
@@ -1193,119 +1185,152 @@ async def premium_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 
-def main():
-    """Start the bot"""
-    # Create application
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
-    
-    # Add handlers
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("my_test", my_test_command))
-    application.add_handler(CommandHandler("premium", premium_command))
-   # Commands
-    application.add_handler(CommandHandler("streaks", lambda u, c: show_streaks_menu(u, c)))
-    application.add_handler(CommandHandler("leaderboard", leaderboard_command))
+# Modules that register their own commands and callbacks
+ROUTE_MODULES = (
+    start_handler, balance, share, admin, friendship_streaks, leaderboard, friend_match,
+    streak_actions, streak_reminders, streak_restore
+)
 
 
+def register_routes(router: Router):
+    router.command('my_test', my_test_command)
+    router.command('premium', premium_command)
+    router.callback('my_birthdays', my_birthdays)
+    router.callback('my_tests', my_tests)
+    router.callback('settings', settings)
+    router.callback('back_to_menu', back_to_menu)
+    router.callback('wish', generate_wish_handler, str)
+    router.callback('taking_answer', taking_test_answer, int)
+    router.callback('recreate_test', recreate_test)
+
+
+async def start_metrics(application: Application):
+    """post_init: serve /metrics on the bot's event loop and start watching its lag"""
+    if LOOP_MONITOR_INTERVAL:
+        monitor = LoopMonitor(LOOP_MONITOR_INTERVAL, LOOP_STALL_THRESHOLD)
+        monitor.register_metrics()
+        monitor.start()
+    register_gauge('bot_test_cache_entries', 'Test definitions cached in memory',
+                   lambda: get_cache_stats()['size'])
+    register_gauge('bot_test_cache_hit_rate', 'Test definition cache hit rate',
+                   lambda: get_cache_stats()['hit_rate'])
+    register_gauge('bot_process_rss_bytes', 'Resident memory of the bot process', process_rss_bytes)
+    register_user_data_metrics(application)
+    await start_metrics_server(METRICS_HOST, METRICS_PORT)
+
+
+def build_application(token: str = TELEGRAM_BOT_TOKEN, base_url: str = None, request=None) -> Application:
+    """The fully wired bot: handlers, routes, metrics and jobs.
+
+    base_url/request point the Bot API elsewhere (the e2e benchmark's fake server).
+    """
+    # Bot API calls go through a counting transport
+    builder = Application.builder()\
+        .token(token)\
+        .request(request or InstrumentedRequest(connection_pool_size=256))\
+        .post_init(start_metrics)
+    if base_url:
+        builder = builder.base_url(base_url)
+    if PERSISTENCE_FILE:
+        builder = builder.persistence(SQLitePersistence(PERSISTENCE_FILE, PERSISTENCE_UPDATE_SECONDS,
+                                                        PERSISTENCE_RETENTION_DAYS))
+    application = builder.build()
+
+    # Count every update's user towards DAU/WAU/MAU before any handler runs
+    application.add_handler(TypeHandler(Update, track_activity), group=-1)
+    # ...and stamp it as recently seen, so idle users' user_data can be evicted
+    application.add_handler(TypeHandler(Update, track_user_data), group=-2)
+    
+    # Commands and callback queries go through one router; conversations
+    # sit between the two, in the same order the handlers always ran
+    router = Router()
+    for module in ROUTE_MODULES:
+        module.register_routes(router)
+    register_routes(router)
+
+    application.add_handler(router.command_handler())
+
     # Daily question conversation
     daily_q_conv = ConversationHandler(
-        entry_points=[CallbackQueryHandler(handle_daily_question_answer_prompt, pattern='^daily_q_answer_')],
+        entry_points=[router.conversation_callback('daily_q_answer', handle_daily_question_answer_prompt, int)],
         states={
             ANSWERING_DAILY_Q: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_daily_question_answer_text)]
         },
         fallbacks=[CommandHandler('cancel', cancel), CommandHandler('start', start)],
         allow_reentry=True,
-        per_message=False
+        per_message=False,
+        name='daily_question',
+        persistent=bool(PERSISTENCE_FILE)
     )
     application.add_handler(daily_q_conv)
     
     # Remember friend conversation
     remember_conv = ConversationHandler(
-        entry_points=[CallbackQueryHandler(handle_remember_friend_start, pattern='^streak_friend_remember_')],
+        entry_points=[router.conversation_callback('streak_friend_remember', handle_remember_friend_start, int)],
         states={
             REMEMBERING_FRIEND: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_remember_friend_answer)]
         },
         fallbacks=[CommandHandler('cancel', cancel), CommandHandler('start', start)],
         allow_reentry=True,
-        per_message=False
+        per_message=False,
+        name='remember_friend',
+        persistent=bool(PERSISTENCE_FILE)
     )
     application.add_handler(remember_conv)
 
-    # Conversation handlers
-    application.add_handler(daily_q_conv)
-    application.add_handler(remember_conv)
-
-
     # Birthday conversation handler
     birthday_conv = ConversationHandler(
-        entry_points=[CallbackQueryHandler(add_birthday_start, pattern='^add_birthday$')],
+        entry_points=[router.conversation_callback('add_birthday', add_birthday_start)],
         states={
             ADDING_BIRTHDAY: [MessageHandler(filters.TEXT & ~filters.COMMAND, process_birthday)]
         },
         fallbacks=[CommandHandler('cancel', cancel), CommandHandler('start', start)],
         allow_reentry=True,
-        per_message=False
+        per_message=False,
+        name='add_birthday',
+        persistent=bool(PERSISTENCE_FILE)
     )
     application.add_handler(birthday_conv)
     
     # Test creation conversation handler
     test_conv = ConversationHandler(
-        entry_points=[CallbackQueryHandler(create_test_start, pattern='^create_test$')],
+        entry_points=[router.conversation_callback('create_test', create_test_start)],
         states={
-            CREATING_TEST: [CallbackQueryHandler(test_answer, pattern='^test_answer_')]
+            CREATING_TEST: [router.conversation_callback('test_answer', test_answer, int)]
         },
         fallbacks=[CommandHandler('cancel', cancel), CommandHandler('start', start)],
         allow_reentry=True,
-        per_message=False
+        per_message=False,
+        name='create_test',
+        persistent=bool(PERSISTENCE_FILE)
     )
     application.add_handler(test_conv)
     
-    # Callback query handlers
-    application.add_handler(CallbackQueryHandler(language_selected, pattern='^lang_'))
-    application.add_handler(CallbackQueryHandler(my_birthdays, pattern='^my_birthdays$'))
-    application.add_handler(CallbackQueryHandler(my_tests, pattern='^my_tests$'))
-    application.add_handler(CallbackQueryHandler(settings, pattern='^settings$'))
-    application.add_handler(CallbackQueryHandler(premium_info_handler, pattern='^premium$'))
-    application.add_handler(CallbackQueryHandler(back_to_menu, pattern='^back_to_menu$'))
-    application.add_handler(CallbackQueryHandler(show_language_selection, pattern='^change_language$'))
-    application.add_handler(CallbackQueryHandler(generate_wish_handler, pattern='^wish_'))
-    application.add_handler(CallbackQueryHandler(taking_test_answer, pattern='^taking_answer_'))
-    application.add_handler(CallbackQueryHandler(approve_premium_payment, pattern='^approve_premium_'))
-    application.add_handler(CallbackQueryHandler(decline_premium_payment, pattern='^decline_premium_'))
-    # NEW: Share and Premium handlers
-    application.add_handler(CallbackQueryHandler(share_main, pattern='^share_bot$'))
-    application.add_handler(CallbackQueryHandler(subscribe_callback, pattern='^subscribe_'))
-    application.add_handler(CallbackQueryHandler(recreate_test, pattern='^recreate_test$'))
-    # Streaks menu and actions
-    application.add_handler(CallbackQueryHandler(show_streaks_menu, pattern='^streaks_menu$'))
-    application.add_handler(CallbackQueryHandler(show_leaderboard, pattern='^streak_leaderboard$'))
-    
-    # Friend selection for different actions
-    application.add_handler(CallbackQueryHandler(handle_ping_friend, pattern='^streak_ping$'))
-    application.add_handler(CallbackQueryHandler(lambda u, c: show_friend_selection(u, c, 'daily_q'), pattern='^streak_daily_q$'))
-    application.add_handler(CallbackQueryHandler(lambda u, c: show_friend_selection(u, c, 'remember'), pattern='^streak_remember$'))
-    application.add_handler(CallbackQueryHandler(lambda u, c: show_friend_selection(u, c, 'guess'), pattern='^streak_guess$'))
-    application.add_handler(CallbackQueryHandler(lambda u, c: show_friend_selection(u, c, 'quiz'), pattern='^streak_quiz$'))
-    application.add_handler(CallbackQueryHandler(lambda u, c: show_friend_selection(u, c, 'weekly'), pattern='^streak_weekly$'))
-    
-    # Specific streak actions
-
-    application.add_handler(CallbackQueryHandler(handle_ping_friend, pattern='^streak_friend_ping_'))
-    application.add_handler(CallbackQueryHandler(handle_daily_question_start, pattern='^streak_friend_daily_q_'))
-    application.add_handler(CallbackQueryHandler(handle_daily_question_send, pattern='^daily_q_send_'))
-    application.add_handler(CallbackQueryHandler(handle_guess_game, pattern='^streak_friend_guess_'))
-    application.add_handler(CallbackQueryHandler(handle_guess_answer, pattern='^guess_answer_'))
-    application.add_handler(CallbackQueryHandler(handle_weekly_checkin, pattern='^streak_friend_weekly_'))
-    application.add_handler(CallbackQueryHandler(handle_weekly_yes, pattern='^weekly_yes_'))
-    application.add_handler(CallbackQueryHandler(handle_weekly_no, pattern='^weekly_no_'))
-    application.add_handler(CallbackQueryHandler(handle_quiz_retake, pattern='^streak_friend_quiz_'))
-
-    # Set up daily birthday check (runs at 9 AM UTC)
+    # Every other callback query
+    application.add_handler(router.callback_handler())
+    router.validate(application)
+    instrument_application(application, router)
+
+    # Scheduled jobs (each one timed and query-traced like a handler)
     job_queue = application.job_queue
-    job_queue.run_daily(check_birthdays, time=datetime.strptime("09:00", "%H:%M").time())
-    
-    # Start bot
-    application.run_polling()
+    job_queue.run_once(instrument_job(warm_friend_graph), when=0)
+    job_queue.run_repeating(instrument_job(refresh_leaderboard_job), interval=LEADERBOARD_DEBOUNCE_SECONDS, first=0)
+    job_queue.run_repeating(instrument_job(refresh_dashboard_stats_job), interval=ADMIN_STATS_REFRESH_SECONDS, first=0)
+    job_queue.run_once(instrument_job(load_activity_job), when=0)
+    job_queue.run_repeating(instrument_job(flush_activity_job), interval=ACTIVITY_FLUSH_SECONDS, first=ACTIVITY_FLUSH_SECONDS)
+    job_queue.run_repeating(instrument_job(sweep_user_data_job), interval=USER_DATA_SWEEP_SECONDS, first=USER_DATA_SWEEP_SECONDS)
+    job_queue.run_daily(instrument_job(check_birthdays), time=datetime.strptime("09:00", "%H:%M").time())
+    job_queue.run_daily(instrument_job(compact_archived_tests), time=datetime.strptime("03:00", "%H:%M").time())
+    job_queue.run_daily(instrument_job(rollup_streak_interactions), time=datetime.strptime("03:30", "%H:%M").time())
+    job_queue.run_daily(instrument_job(expire_stale_streaks), time=datetime.strptime("00:05", "%H:%M").time())
+    job_queue.run_daily(instrument_job(send_streak_risk_reminders), time=datetime.strptime(STREAK_RISK_REMINDER_TIME_UTC, "%H:%M").time())
+
+    return application
+
+
+def main():
+    """Start the bot"""
+    build_application().run_polling()
 
 if __name__ == '__main__':
     main()
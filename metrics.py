@@ -0,0 +1,352 @@
+"""
+Per-handler latency histograms and call counters, served in Prometheus text format
+"""
+import asyncio
+import functools
+import logging
+import os
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Tuple
+
+from telegram.ext import ConversationHandler
+from telegram.request import HTTPXRequest
+
+import query_trace
+from query_trace import active_trace, count_rows, describe_call
+
+logger = logging.getLogger(__name__)
+
+# Seconds; upper bounds of the histogram buckets (+Inf is implicit)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+BACKGROUND = '(background)'  # jobs and anything running outside a handler
+
+
+class Histogram:
+    """Fixed buckets, preallocated; observe() is a bisect and three adds.
+
+    Counters are plain ints without a lock: handlers run on the event loop,
+    and the rare increment from a worker thread racing another can at worst
+    lose one count, which is fine for monitoring.
+    """
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket holding the q-quantile (None = above the last bucket)"""
+        if not self.count:
+            return 0.0
+        rank, seen = q * self.count, 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return None
+
+    def render(self, name: str, labels: str) -> List[str]:
+        sep = ',' if labels else ''
+        lines, cumulative = [], 0
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels}{sep}le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels}{sep}le="+Inf"}} {self.count}')
+        lines.append(f'{name}_sum{{{labels}}} {self.sum:.6f}')
+        lines.append(f'{name}_count{{{labels}}} {self.count}')
+        return lines
+
+
+class HandlerStats:
+    __slots__ = ('latency', 'errors', 'db_calls', 'gemini_calls', 'telegram_calls')
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.errors = 0
+        self.db_calls = 0
+        self.gemini_calls = 0
+        self.telegram_calls = 0
+
+
+handler_stats: Dict[str, HandlerStats] = {BACKGROUND: HandlerStats()}
+db_latency = Histogram()
+gemini_latency = Histogram()
+telegram_latency: Dict[str, Histogram] = {}
+_gauges: List[Tuple[str, str, Callable[[], float]]] = []
+# Called after every query, whichever client is behind config.supabase (e2e_bench counts per step)
+db_call_hooks: List[Callable[[], None]] = []
+
+# The handler an update is being processed by; asyncio.to_thread copies it,
+# so DB calls made from worker threads are charged to the right handler
+_current: ContextVar[HandlerStats] = ContextVar('metrics_handler', default=handler_stats[BACKGROUND])
+
+
+def current_handler_stats() -> HandlerStats:
+    return _current.get()
+
+
+def register_gauge(name: str, help_text: str, read: Callable[[], float]):
+    """Export read() as a gauge on every scrape"""
+    _gauges.append((name, help_text, read))
+
+
+def process_rss_bytes() -> int:
+    """Current resident set size (peak RSS where /proc is unavailable)"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+# ==================== HANDLERS ====================
+
+def instrument(label: str, callback: Callable) -> Callable:
+    """Wrap a handler callback: latency, errors and every call it makes"""
+    stats = handler_stats.setdefault(label, HandlerStats())
+
+    @functools.wraps(callback)
+    async def timed(*args, **kwargs):
+        token = _current.set(stats)
+        trace = query_trace.begin(label, args[0] if args else None)
+        start = time.perf_counter()
+        try:
+            return await callback(*args, **kwargs)
+        except Exception:
+            stats.errors += 1
+            raise
+        finally:
+            stats.latency.observe(time.perf_counter() - start)
+            query_trace.end(trace)
+            _current.reset(token)
+
+    return timed
+
+
+def instrument_job(callback: Callable) -> Callable:
+    """Jobs get the same latency/call metrics, labelled job:<name>"""
+    return instrument(f'job:{callback.__name__}', callback)
+
+
+def _handler_label(handler) -> str:
+    callback = handler.callback
+    return getattr(callback, '__name__', None) or type(handler).__name__
+
+
+def _instrument_handler(handler):
+    from router import RouteHandler, CommandRouteHandler
+
+    if isinstance(handler, ConversationHandler):
+        for inner in handler.entry_points + handler.fallbacks + [h for hs in handler.states.values() for h in hs]:
+            _instrument_handler(inner)
+    elif isinstance(handler, (RouteHandler, CommandRouteHandler)):
+        return  # routes are wrapped through Router.wrap
+    elif handler.callback is not None:
+        handler.callback = instrument(_handler_label(handler), handler.callback)
+
+
+def instrument_application(application, router):
+    """Wrap every route and every handler registered on the application"""
+    router.wrap(instrument)
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            _instrument_handler(handler)
+    register_gauge('bot_router_misses_total', 'Callback queries no route matched', lambda: router.misses)
+    logger.info(f"METRICS_INSTRUMENTED: {len(handler_stats) - 1} handlers")
+
+
+# ==================== OUTBOUND CALLS ====================
+
+class _TracedClient:
+    """Proxy over the supabase client / postgrest builders: times every execute().
+
+    While query tracing is on, it also builds up the query's shape (table,
+    columns, filter columns) for query_trace.
+    """
+    __slots__ = ('_target', '_shape')
+
+    def __init__(self, target, shape: str = ''):
+        self._target = target
+        self._shape = shape
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if name == 'execute':
+            return functools.partial(_timed_execute, attr, self._shape)
+        if callable(attr):
+            return functools.partial(_call_and_trace, attr, name, self._shape)
+        if active_trace() is not None:
+            return _trace(attr, self._shape + describe_call(name, ()))
+        return _trace(attr, self._shape)
+
+
+_PLAIN = (str, bytes, int, float, bool, dict, list, tuple, type(None))
+
+
+def _trace(value, shape: str):
+    """Keep proxying query builders; plain values pass through"""
+    if isinstance(value, _PLAIN):
+        return value
+    return _TracedClient(value, shape)
+
+
+def _call_and_trace(method, name: str, shape: str, *args, **kwargs):
+    if active_trace() is not None:
+        shape += describe_call(name, args)
+    return _trace(method(*args, **kwargs), shape)
+
+
+def _timed_execute(execute, shape: str, *args, **kwargs):
+    stats = _current.get()
+    trace = active_trace()
+    start = time.perf_counter()
+    response = None
+    try:
+        response = execute(*args, **kwargs)
+        return response
+    finally:
+        elapsed = time.perf_counter() - start
+        db_latency.observe(elapsed)
+        stats.db_calls += 1
+        for hook in db_call_hooks:
+            hook()
+        if trace is not None:
+            trace.add(shape or '?', count_rows(response), elapsed)
+
+
+def instrument_supabase(client):
+    """Count and time every query made through the shared supabase client"""
+    return _TracedClient(client)
+
+
+class _TracedModel:
+    """Counts Gemini generate_content calls per handler"""
+
+    def __init__(self, model):
+        self._model = model
+
+    def __getattr__(self, name):
+        return getattr(self._model, name)
+
+    def generate_content(self, *args, **kwargs):
+        stats = _current.get()
+        start = time.perf_counter()
+        try:
+            return self._model.generate_content(*args, **kwargs)
+        finally:
+            gemini_latency.observe(time.perf_counter() - start)
+            stats.gemini_calls += 1
+
+
+def instrument_model(model):
+    return _TracedModel(model)
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """Bot API transport that counts calls per handler and times them per method"""
+
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        stats = _current.get()
+        api_method = url.rsplit('/', 1)[-1]
+        start = time.perf_counter()
+        try:
+            return await super().do_request(url, method, *args, **kwargs)
+        finally:
+            histogram = telegram_latency.get(api_method)
+            if histogram is None:
+                histogram = telegram_latency[api_method] = Histogram()
+            histogram.observe(time.perf_counter() - start)
+            stats.telegram_calls += 1
+
+
+# ==================== EXPORT ====================
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"')
+
+
+def render_metrics() -> str:
+    """Everything in Prometheus text exposition format (0.0.4)"""
+    lines = [
+        '# HELP bot_handler_seconds Handler latency', '# TYPE bot_handler_seconds histogram'
+    ]
+    for label, stats in handler_stats.items():
+        lines.extend(stats.latency.render('bot_handler_seconds', f'handler="{_escape(label)}"'))
+
+    for metric, attr, help_text in (
+        ('bot_handler_errors_total', 'errors', 'Exceptions raised by the handler'),
+        ('bot_handler_db_calls_total', 'db_calls', 'Supabase queries made by the handler'),
+        ('bot_handler_gemini_calls_total', 'gemini_calls', 'Gemini calls made by the handler'),
+        ('bot_handler_telegram_calls_total', 'telegram_calls', 'Bot API calls made by the handler'),
+    ):
+        lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} counter']
+        lines += [f'{metric}{{handler="{_escape(label)}"}} {getattr(stats, attr)}'
+                  for label, stats in handler_stats.items()]
+
+    lines += ['# HELP bot_db_seconds Supabase query latency', '# TYPE bot_db_seconds histogram']
+    lines += db_latency.render('bot_db_seconds', '')
+    lines += ['# HELP bot_gemini_seconds Gemini call latency', '# TYPE bot_gemini_seconds histogram']
+    lines += gemini_latency.render('bot_gemini_seconds', '')
+    lines += ['# HELP bot_telegram_seconds Bot API call latency', '# TYPE bot_telegram_seconds histogram']
+    for api_method, histogram in list(telegram_latency.items()):
+        lines += histogram.render('bot_telegram_seconds', f'method="{_escape(api_method)}"')
+
+    for name, help_text, read in _gauges:
+        try:
+            value = read()
+        except Exception as e:
+            logger.error(f"Error reading gauge {name}: {e}")
+            continue
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge', f'{name} {value}']
+
+    return '\n'.join(lines) + '\n'
+
+
+async def _serve(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        while (await asyncio.wait_for(reader.readline(), timeout=5)).strip():
+            pass  # headers
+
+        parts = request_line.decode('latin-1').split()
+        if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] in ('/metrics', '/'):
+            status, body = '200 OK', render_metrics().encode()
+        else:
+            status, body = '404 Not Found', b'not found\n'
+
+        writer.write(
+            f'HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+            f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode() + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(host: str, port: int) -> Optional[asyncio.AbstractServer]:
+    """Serve /metrics on the bot's own event loop (port 0 disables it).
+
+    A port that can't be bound is logged, not raised: the bot runs on without /metrics.
+    """
+    if not port:
+        return None
+    try:
+        server = await asyncio.start_server(_serve, host, port)
+    except OSError as e:
+        logger.error(f"METRICS_SERVER_FAILED: {host}:{port} | {e} | continuing without /metrics")
+        return None
+    logger.info(f"METRICS_SERVER_STARTED: http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,296 @@
+"""
+SQLite persistence for in-progress flows, so a restart doesn't throw away half-finished tests
+
+Only user_data and conversation states are stored, one small row per flow
+(answers packed into one int, see test_cache.pack_answers) instead of
+pickled dicts. A user's rows are read the first time they send an update
+after a restart, not at startup. PTB hands over everything that changed
+every update_interval seconds; those writes go to the file as one
+transaction.
+"""
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from test_cache import pack_answers, unpack_answers
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS user_prefs (
+    user_id INTEGER PRIMARY KEY,
+    language TEXT,
+    pending_test_id TEXT,
+    updated_at INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS test_creation (
+    user_id INTEGER PRIMARY KEY,
+    current_question INTEGER NOT NULL,
+    answers INTEGER NOT NULL,
+    updated_at INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS test_taking (
+    user_id INTEGER PRIMARY KEY,
+    test_id TEXT NOT NULL,
+    question INTEGER NOT NULL,
+    answers INTEGER NOT NULL,
+    is_retake INTEGER NOT NULL,
+    updated_at INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS daily_question (
+    user_id INTEGER PRIMARY KEY,
+    friend_id INTEGER NOT NULL,
+    question TEXT,
+    answer TEXT,
+    updated_at INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS remember_friend (
+    user_id INTEGER PRIMARY KEY,
+    friend_id INTEGER NOT NULL,
+    question TEXT,
+    updated_at INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS conversations (
+    name TEXT NOT NULL,
+    key TEXT NOT NULL,
+    state INTEGER NOT NULL,
+    updated_at INTEGER NOT NULL,
+    PRIMARY KEY (name, key)
+);
+'''
+
+
+class Flow:
+    """One table: which user_data keys it holds and how they map to columns"""
+
+    def __init__(self, table: str, markers: Tuple[str, ...], fields: Dict[str, str],
+                 packed: Iterable[str] = (), flags: Iterable[str] = ()):
+        self.table = table
+        self.markers = markers  # a row exists while any of these keys is set
+        self.fields = fields  # user_data key -> column
+        self.packed = set(packed)  # {question: option} dicts stored as one int
+        self.flags = set(flags)  # booleans stored as 0/1
+        columns = list(fields.values())
+        self.upsert = (f"INSERT OR REPLACE INTO {table} (user_id, {', '.join(columns)}, updated_at) "
+                       f"VALUES (?, {', '.join('?' * len(columns))}, ?)")
+        self.select = f"SELECT {', '.join(columns)} FROM {table} WHERE user_id = ?"
+        self.delete = f"DELETE FROM {table} WHERE user_id = ?"
+
+    def to_row(self, user_data: Dict) -> Optional[Tuple]:
+        if all(user_data.get(marker) is None for marker in self.markers):
+            return None
+        values = []
+        for key in self.fields:
+            value = user_data.get(key)
+            if key in self.packed:
+                value = pack_answers(value or {})
+            elif key in self.flags:
+                value = int(bool(value))
+            values.append(value)
+        return tuple(values)
+
+    def load(self, row: Tuple, user_data: Dict):
+        for key, value in zip(self.fields, row):
+            if value is None:
+                continue
+            if key in self.packed:
+                value = unpack_answers(value)
+            elif key in self.flags:
+                if not value:
+                    continue  # unset and False read the same
+                value = True
+            user_data[key] = value
+
+
+FLOWS = [
+    Flow('user_prefs', ('language', 'pending_test_id'),
+         {'language': 'language', 'pending_test_id': 'pending_test_id'}),
+    Flow('test_creation', ('current_question',),
+         {'current_question': 'current_question', 'test_answers': 'answers'}, packed=['test_answers']),
+    Flow('test_taking', ('taking_test_id',),
+         {'taking_test_id': 'test_id', 'taking_test_question': 'question',
+          'taking_test_answers': 'answers', 'is_retake': 'is_retake'},
+         packed=['taking_test_answers'], flags=['is_retake']),
+    Flow('daily_question', ('daily_q_friend_id',),
+         {'daily_q_friend_id': 'friend_id', 'daily_q_question': 'question', 'daily_q_answer': 'answer'}),
+    Flow('remember_friend', ('remember_friend_id',),
+         {'remember_friend_id': 'friend_id', 'remember_question': 'question'}),
+]
+
+
+def _key_to_text(key: Tuple) -> str:
+    return ':'.join(str(part) for part in key)
+
+
+def _text_to_key(text: str) -> Tuple:
+    return tuple(int(part) if part.lstrip('-').isdigit() else part for part in text.split(':'))
+
+
+class SQLitePersistence(BasePersistence):
+    """user_data and conversation states in a local SQLite file.
+
+    Writes queued by PTB's update cycle are committed together; reads happen
+    once per user per process, on their first update.
+    """
+
+    def __init__(self, path: str, update_interval: float = 60, retention_days: int = 30):
+        super().__init__(store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True,
+                                                     callback_data=False),
+                         update_interval=update_interval)
+        self.path = path
+        self.retention_days = retention_days
+        self._connection: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self._loaded: Set[int] = set()
+        # user_id -> user_data snapshot (None = delete); (name, key) -> state (None = delete)
+        self._pending_users: Dict[int, Optional[Dict]] = {}
+        self._pending_conversations: Dict[Tuple[str, str], Optional[int]] = {}
+        self._write_lock = asyncio.Lock()
+
+    # Database (worker threads only)
+
+    def _db(self) -> sqlite3.Connection:
+        if self._connection is None:
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.executescript(SCHEMA)
+            self._connection = connection
+            self._prune()
+        return self._connection
+
+    def _prune(self):
+        """Forget abandoned flows and conversations (language preferences stay)"""
+        cutoff = int(time.time()) - self.retention_days * 86400
+        with self._connection:
+            removed = sum(self._connection.execute(f"DELETE FROM {table} WHERE updated_at < ?", (cutoff,)).rowcount
+                          for table in [flow.table for flow in FLOWS[1:]] + ['conversations'])
+        if removed:
+            logger.info(f"PERSISTENCE_PRUNED: {removed} rows older than {self.retention_days} days")
+
+    def _read_user(self, user_id: int) -> Dict:
+        user_data = {}
+        with self._db_lock:
+            db = self._db()
+            for flow in FLOWS:
+                row = db.execute(flow.select, (user_id,)).fetchone()
+                if row:
+                    flow.load(row, user_data)
+        return user_data
+
+    def _read_conversations(self, name: str) -> Dict[Tuple, object]:
+        with self._db_lock:
+            rows = self._db().execute("SELECT key, state FROM conversations WHERE name = ?", (name,)).fetchall()
+        return {_text_to_key(key): state for key, state in rows}
+
+    def _write(self, users: Dict[int, Optional[Dict]], conversations: Dict[Tuple[str, str], Optional[int]]):
+        now = int(time.time())
+        with self._db_lock:
+            db = self._db()
+            with db:
+                for user_id, user_data in users.items():
+                    for flow in FLOWS:
+                        row = flow.to_row(user_data) if user_data is not None else None
+                        if row is None:
+                            db.execute(flow.delete, (user_id,))
+                        else:
+                            db.execute(flow.upsert, (user_id, *row, now))
+                for (name, key), state in conversations.items():
+                    if state is None:
+                        db.execute("DELETE FROM conversations WHERE name = ? AND key = ?", (name, key))
+                    else:
+                        db.execute("INSERT OR REPLACE INTO conversations (name, key, state, updated_at) "
+                                   "VALUES (?, ?, ?, ?)", (name, key, state, now))
+
+    async def _write_pending(self):
+        # PTB gathers one coroutine per dirty entry; yielding once lets the
+        # rest queue theirs, so the whole update cycle is one transaction
+        await asyncio.sleep(0)
+        async with self._write_lock:
+            if not self._pending_users and not self._pending_conversations:
+                return
+            users, self._pending_users = self._pending_users, {}
+            conversations, self._pending_conversations = self._pending_conversations, {}
+            start = time.perf_counter()
+            await asyncio.to_thread(self._write, users, conversations)
+            logger.debug("PERSISTENCE_WRITE: %d users, %d conversations in %.1f ms",
+                         len(users), len(conversations), (time.perf_counter() - start) * 1000)
+
+    # user_data: loaded per user on demand
+
+    async def get_user_data(self) -> Dict[int, Dict]:
+        return {}
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict):
+        if user_id in self._loaded:
+            return
+        self._loaded.add(user_id)
+        if user_id in self._pending_users:
+            return  # dropped or rewritten since the last load; memory is current
+        stored = await asyncio.to_thread(self._read_user, user_id)
+        for key, value in stored.items():
+            user_data.setdefault(key, value)
+
+    def forget_user(self, user_id: int):
+        """Their user_data left memory (idle eviction): read it again on their next update"""
+        self._loaded.discard(user_id)
+
+    async def update_user_data(self, user_id: int, data: Dict):
+        self._pending_users[user_id] = data
+        await self._write_pending()
+
+    async def drop_user_data(self, user_id: int):
+        self._loaded.discard(user_id)
+        self._pending_users[user_id] = None
+        await self._write_pending()
+
+    # Conversation states: PTB asks for all of them at startup
+
+    async def get_conversations(self, name: str) -> Dict[Tuple, object]:
+        return await asyncio.to_thread(self._read_conversations, name)
+
+    async def update_conversation(self, name: str, key: Tuple, new_state: Optional[object]):
+        self._pending_conversations[(name, _key_to_text(key))] = new_state
+        await self._write_pending()
+
+    async def flush(self):
+        await self._write_pending()
+        if self._connection is not None:
+            with self._db_lock:
+                self._connection.close()
+                self._connection = None
+        logger.info(f"PERSISTENCE_FLUSHED: {self.path}")
+
+    # Not stored: chat_data, bot_data and callback_data are unused
+
+    async def get_chat_data(self) -> Dict[int, Dict]:
+        return {}
+
+    async def update_chat_data(self, chat_id: int, data: Dict):
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Dict):
+        pass
+
+    async def drop_chat_data(self, chat_id: int):
+        pass
+
+    async def get_bot_data(self) -> Dict:
+        return {}
+
+    async def update_bot_data(self, data: Dict):
+        pass
+
+    async def refresh_bot_data(self, bot_data: Dict):
+        pass
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def update_callback_data(self, data):
+        pass
@@ -0,0 +1,120 @@
+"""
+On-demand stack sampling profiler: collapsed stacks (flamegraph.pl / speedscope) plus a top-N summary
+"""
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_INTERVAL = 0.005  # seconds; ~200 Hz
+_PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+# Innermost frames that mean the thread is waiting, not working
+_IDLE_LEAVES = ('selectors.py:', 'threading.py:', 'queue.py:', 'thread.py:_worker')
+
+
+def _frame_label(code) -> str:
+    path = code.co_filename
+    name = os.path.relpath(path, _PROJECT_DIR) if path.startswith(_PROJECT_DIR) else os.path.basename(path)
+    return f"{name}:{code.co_name}"
+
+
+class Profile:
+    """Collapsed stacks, 'thread;outer;...;inner' -> samples"""
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.started = time.time()
+        self.elapsed = 0.0
+
+    def collapsed(self) -> str:
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def busy(self) -> Counter:
+        """Stacks whose innermost frame is doing work"""
+        return Counter({stack: count for stack, count in self.stacks.items()
+                        if not stack.rsplit(';', 1)[-1].startswith(_IDLE_LEAVES)})
+
+    def top(self, n: int = 10) -> Tuple[List[Tuple[str, int]], List[Tuple[str, int]]]:
+        """(self time, inclusive time) of the busiest project/library frames"""
+        own, inclusive = Counter(), Counter()
+        for stack, count in self.busy().items():
+            frames = stack.split(';')[1:]
+            own[frames[-1]] += count
+            for frame in set(frames):
+                inclusive[frame] += count
+        return own.most_common(n), inclusive.most_common(n)
+
+    def summary(self, n: int = 10) -> str:
+        busy = sum(self.busy().values())
+        own, inclusive = self.top(n)
+        lines = [f"{self.samples} samples in {self.elapsed:.1f} s, {busy} busy thread stacks", '', 'Self:']
+        lines += [f"  {count:>6}  {frame}" for frame, count in own]
+        lines += ['', 'Inclusive:']
+        lines += [f"  {count:>6}  {frame}" for frame, count in inclusive]
+        return '\n'.join(lines)
+
+
+class StackSampler:
+    """Samples every thread's stack from a thread of its own.
+
+    Nothing runs between profiles: the thread only exists while sampling.
+    """
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self.interval = interval
+        self.running = False
+        self._lock = threading.Lock()
+
+    def run(self, seconds: float) -> Profile:
+        """Blocking; call through asyncio.to_thread"""
+        with self._lock:
+            if self.running:
+                raise RuntimeError("a profile is already running")
+            self.running = True
+        try:
+            return self._sample(seconds)
+        finally:
+            self.running = False
+
+    def _sample(self, seconds: float) -> Profile:
+        profile = Profile(seconds)
+        me = threading.get_ident()
+        names: Dict[int, str] = {}
+        start = time.perf_counter()
+        deadline = start + seconds
+        while time.perf_counter() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == me:
+                    continue
+                if thread_id not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                frames = []
+                while frame is not None:
+                    frames.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                frames.append(names.get(thread_id, str(thread_id)))
+                profile.stacks[';'.join(reversed(frames))] += 1
+            profile.samples += 1
+            time.sleep(self.interval)
+        profile.elapsed = time.perf_counter() - start
+        return profile
+
+
+def save_profile(profile: Profile, directory: str) -> str:
+    """Write the collapsed stacks for flamegraph.pl / speedscope; returns the path"""
+    os.makedirs(directory, exist_ok=True)
+    stamp = time.strftime('%Y%m%d-%H%M%S', time.gmtime(profile.started))
+    path = os.path.join(directory, f"profile-{stamp}.collapsed")
+    with open(path, 'w', encoding='utf-8') as profile_file:
+        profile_file.write(profile.collapsed())
+    return path
+
+
+sampler = StackSampler()
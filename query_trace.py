@@ -0,0 +1,155 @@
+"""
+Per-update query tracing: every table access with its shape, repeated shapes flagged as N+1
+"""
+import logging
+import re
+import time
+from collections import Counter
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from log_pipeline import json_lines_logger
+
+logger = logging.getLogger(__name__)
+
+WRITE_OPS = ('insert', 'upsert', 'update', 'delete')
+NO_ARG_SHAPE = ('limit', 'range', 'single', 'maybe_single', 'execute')
+# "user_id.eq.123,friend_id.eq.123" -> "user_id.eq,friend_id.eq"
+_FILTER_VALUE = re.compile(r'(\.(?:eq|neq|gt|gte|lt|lte|is|in|like|ilike|cs|cd))\.[^,()]*')
+
+
+class QueryRecord(NamedTuple):
+    shape: str
+    rows: int
+    seconds: float
+
+
+def describe_call(name: str, args: tuple) -> str:
+    """Shape of one builder call: table/columns/filter columns, never values"""
+    name = name.rstrip('_')
+    if name == 'table':
+        return str(args[0]) if args else 'table'
+    if name == 'rpc':
+        return f"rpc:{args[0]}" if args else 'rpc'
+    if name in WRITE_OPS or name in NO_ARG_SHAPE or not args or not isinstance(args[0], str):
+        return f'.{name}'
+    if name == 'select':
+        return '.select(' + ','.join(column.strip() for column in args[0].split(',')) + ')'
+    if name in ('or', 'and'):
+        return f'.{name}(' + _FILTER_VALUE.sub(r'\1', args[0]) + ')'
+    return f'.{name}({args[0]})'
+
+
+def count_rows(response) -> int:
+    data = getattr(response, 'data', None)
+    if isinstance(data, list):
+        return len(data)
+    return 0 if data is None else 1
+
+
+class QueryTrace:
+    __slots__ = ('label', 'update_id', 'user_id', 'started', 'queries')
+
+    def __init__(self, label: str, update_id: Optional[int], user_id: Optional[int]):
+        self.label = label
+        self.update_id = update_id
+        self.user_id = user_id
+        self.started = time.perf_counter()
+        self.queries: List[QueryRecord] = []
+
+    def add(self, shape: str, rows: int, seconds: float):
+        self.queries.append(QueryRecord(shape, rows, seconds))
+
+    def repeated(self, threshold: int) -> List[Tuple[str, int]]:
+        """Shapes issued at least `threshold` times: probable N+1 loops"""
+        counts = Counter(q.shape for q in self.queries)
+        return [(shape, n) for shape, n in counts.most_common() if n >= threshold]
+
+    def summary(self, threshold: int) -> Dict:
+        return {
+            'at': datetime.now(timezone.utc).isoformat(),
+            'handler': self.label,
+            'update_id': self.update_id,
+            'user_id': self.user_id,
+            'handler_ms': round((time.perf_counter() - self.started) * 1000, 1),
+            'db_ms': round(sum(q.seconds for q in self.queries) * 1000, 1),
+            'rows': sum(q.rows for q in self.queries),
+            'n_plus_one': [{'shape': shape, 'count': n} for shape, n in self.repeated(threshold)],
+            'queries': [[q.shape, q.rows, round(q.seconds * 1000, 1)] for q in self.queries],
+        }
+
+
+class QueryTracer:
+    """Off by default; enable() turns it on for a while, then it switches itself off"""
+
+    def __init__(self):
+        self.until = 0.0  # time.monotonic() deadline
+        self.path: Optional[str] = None
+        self.threshold = 3
+        self.traced = 0
+        self.flagged = 0
+
+    @property
+    def enabled(self) -> bool:
+        return time.monotonic() < self.until
+
+    def enable(self, minutes: float, path: Optional[str] = None, threshold: int = 3):
+        self.until = time.monotonic() + minutes * 60
+        self.path = path
+        self.threshold = threshold
+        logger.info(f"QUERY_TRACE_ENABLED: {minutes} min | N+1 at {threshold} repeats | File: {path or '-'}")
+
+    def disable(self):
+        self.until = 0.0
+        logger.info(f"QUERY_TRACE_DISABLED: {self.traced} traced | {self.flagged} flagged")
+
+    def remaining_minutes(self) -> float:
+        return max(0.0, (self.until - time.monotonic()) / 60)
+
+    def start(self, label: str, update) -> QueryTrace:
+        user = getattr(update, 'effective_user', None)
+        return QueryTrace(label, getattr(update, 'update_id', None), user.id if user else None)
+
+    def finish(self, trace: QueryTrace):
+        if not trace.queries:
+            return
+        summary = trace.summary(self.threshold)
+        self.traced += 1
+
+        top = ', '.join(f"{shape} x{n}" for shape, n in Counter(q.shape for q in trace.queries).most_common(3))
+        line = (f"QUERY_TRACE: {trace.label} | Update {trace.update_id} | {len(trace.queries)} queries, "
+                f"{summary['rows']} rows, {summary['db_ms']} ms DB / {summary['handler_ms']} ms total | {top}")
+        if summary['n_plus_one']:
+            self.flagged += 1
+            logger.warning(line + " | N+1: " + ', '.join(f"{p['shape']} x{p['count']}" for p in summary['n_plus_one']))
+        else:
+            logger.info(line)
+
+        if self.path:
+            # Queued; the sink's thread serializes and appends it (log_pipeline.py)
+            json_lines_logger(self.path).info(summary)
+
+
+tracer = QueryTracer()
+
+_active: ContextVar[Optional[QueryTrace]] = ContextVar('query_trace', default=None)
+
+
+def active_trace() -> Optional[QueryTrace]:
+    return _active.get()
+
+
+def begin(label: str, update):
+    """Start tracing one handler call if tracing is on; pass the result to end()"""
+    if not tracer.enabled:
+        return None
+    trace = tracer.start(label, update)
+    return trace, _active.set(trace)
+
+
+def end(started):
+    if started is not None:
+        trace, token = started
+        _active.reset(token)
+        tracer.finish(trace)
@@ -0,0 +1,327 @@
+"""
+Command and callback routing: callback_data is parsed once, then dispatched by dict/trie
+"""
+import logging
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from telegram import Update
+from telegram.constants import MessageEntityType
+from telegram.ext import BaseHandler, CallbackQueryHandler, CommandHandler, ConversationHandler
+
+logger = logging.getLogger(__name__)
+
+# callback_data is "<action>_<arg>_<arg>...": the action is one or more
+# underscore-separated words, each arg is one word converted by its type
+SEPARATOR = '_'
+CALLBACK_DATA_LIMIT = 64  # bytes, Telegram's limit
+
+
+class REST:
+    """Arg type for the last arg: every remaining word, joined back with '_'"""
+
+
+class RouteError(ValueError):
+    """Duplicate or unreachable route, raised while building the application"""
+
+
+class Route(NamedTuple):
+    action: str
+    arg_types: Tuple
+    callback: Callable
+    kwargs: Dict
+    conversation: bool  # dispatched by a ConversationHandler, not by the router
+
+    @property
+    def variadic(self) -> bool:
+        return bool(self.arg_types) and self.arg_types[-1] is REST
+
+    def sample(self) -> str:
+        """A callback_data this route must resolve to (used by validate)"""
+        return callback_data(self.action, *('1' if t is int else 'x' for t in self.arg_types))
+
+    def parse(self, words: List[str]) -> Optional[list]:
+        arg_types = self.arg_types
+        if arg_types[-1] is REST:
+            fixed = len(arg_types) - 1
+            if len(words) <= fixed:
+                return None
+            words = words[:fixed] + [SEPARATOR.join(words[fixed:])]
+        elif len(words) != len(arg_types):
+            return None
+        try:
+            return [w if t is str or t is REST else t(w) for t, w in zip(arg_types, words)]
+        except ValueError:
+            return None
+
+
+def callback_data(action: str, *args) -> str:
+    """Build the callback_data a route parses back into (action, args)"""
+    data = SEPARATOR.join([action, *map(str, args)])
+    if len(data.encode()) > CALLBACK_DATA_LIMIT:
+        raise ValueError(f"callback_data over {CALLBACK_DATA_LIMIT} bytes: {data}")
+    return data
+
+
+class _Node:
+    __slots__ = ('children', 'routes', 'rest')
+
+    def __init__(self):
+        self.children: Dict[str, '_Node'] = {}
+        self.routes: Dict[int, Route] = {}  # by arg count
+        self.rest: Optional[Route] = None
+
+
+class Router:
+    """Every callback route and top-level command in one place.
+
+    No-arg callbacks resolve with one dict lookup. Callbacks with args walk a
+    word trie once, and the longest action that accepts the remaining words
+    wins, so the cost doesn't grow with the number of routes.
+    """
+
+    def __init__(self):
+        self.exact: Dict[str, Route] = {}
+        self.root = _Node()
+        self.commands: Dict[str, Route] = {}
+        self.hits = 0
+        self.misses = 0
+
+    # ==================== REGISTRATION ====================
+
+    def _add(self, action: str, callback: Callable, arg_types: Tuple, kwargs: Dict, conversation: bool) -> Route:
+        if not action or SEPARATOR * 2 in action or action.endswith(SEPARATOR):
+            raise RouteError(f"Invalid action: {action!r}")
+        if REST in arg_types[:-1]:
+            raise RouteError(f"{action}: REST must be the last arg")
+
+        route = Route(action, arg_types, callback, kwargs, conversation)
+        if not arg_types:
+            existing = self.exact.get(action)
+            if existing:
+                raise RouteError(f"Duplicate route {action!r}: {_name(existing)} and {_name(route)}")
+            self.exact[action] = route
+            return route
+
+        node = self.root
+        for word in action.split(SEPARATOR):
+            node = node.children.setdefault(word, _Node())
+        existing = node.rest if route.variadic else node.routes.get(len(arg_types))
+        if existing:
+            raise RouteError(f"Duplicate route {action!r}/{len(arg_types)}: {_name(existing)} and {_name(route)}")
+        if route.variadic:
+            node.rest = route
+        else:
+            node.routes[len(arg_types)] = route
+        return route
+
+    def callback(self, action: str, callback: Callable, /, *arg_types, **kwargs) -> Route:
+        """Route callback_data `action[_arg...]` to callback(update, context, **kwargs).
+
+        Converted args are passed as context.args.
+        """
+        return self._add(action, callback, arg_types, kwargs, conversation=False)
+
+    def conversation_callback(self, action: str, callback: Callable, /, *arg_types, **kwargs) -> BaseHandler:
+        """Handler for a ConversationHandler entry point or state, parsed the same way"""
+        route = self._add(action, callback, arg_types, kwargs, conversation=True)
+        return RouteHandler(self, route)
+
+    def command(self, name: str, callback: Callable, /, **kwargs) -> Route:
+        if name in self.commands:
+            raise RouteError(f"Duplicate command /{name}: {_name(self.commands[name])} and {_name(callback)}")
+        route = Route(name, (), callback, kwargs, conversation=False)
+        self.commands[name] = route
+        return route
+
+    def wrap(self, wrapper: Callable[[str, Callable], Callable]):
+        """Replace every callback with wrapper(label, callback), e.g. for metrics.
+
+        Labels are the action for callbacks and '/name' for commands.
+        """
+        self.exact = {action: route._replace(callback=wrapper(action, route.callback))
+                      for action, route in self.exact.items()}
+        self.commands = {name: route._replace(callback=wrapper(f'/{name}', route.callback))
+                         for name, route in self.commands.items()}
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            node.routes = {n: r._replace(callback=wrapper(r.action, r.callback)) for n, r in node.routes.items()}
+            if node.rest:
+                node.rest = node.rest._replace(callback=wrapper(node.rest.action, node.rest.callback))
+            stack.extend(node.children.values())
+
+    # ==================== DISPATCH ====================
+
+    def resolve(self, data: str) -> Optional[Tuple[Route, list]]:
+        """(route, converted args) for callback_data, or None"""
+        route = self.exact.get(data)
+        if route is not None:
+            return route, []
+
+        words = data.split(SEPARATOR)
+        node = self.root
+        matched = []
+        for depth, word in enumerate(words[:-1], 1):
+            node = node.children.get(word)
+            if node is None:
+                break
+            if node.routes or node.rest:
+                matched.append((depth, node))
+
+        for depth, node in reversed(matched):
+            rest = words[depth:]
+            route = node.routes.get(len(rest))
+            args = route.parse(rest) if route is not None else None
+            if args is None and node.rest is not None:
+                route, args = node.rest, node.rest.parse(rest)
+            if args is not None:
+                return route, args
+        return None
+
+    def resolve_command(self, message) -> Optional[Tuple[Route, list]]:
+        if not message or not message.text or not message.entities:
+            return None
+        entity = message.entities[0]
+        if entity.type != MessageEntityType.BOT_COMMAND or entity.offset != 0:
+            return None
+
+        command, _, mention = message.text[1:entity.length].partition('@')
+        if mention and mention.lower() != (message.get_bot().username or '').lower():
+            return None
+        route = self.commands.get(command.lower())
+        if route is None:
+            return None
+        return route, message.text.split()[1:]
+
+    def callback_handler(self) -> BaseHandler:
+        """The one CallbackQueryHandler replacement for every non-conversation route"""
+        return RouteHandler(self)
+
+    def command_handler(self) -> BaseHandler:
+        return CommandRouteHandler(self)
+
+    # ==================== VALIDATION ====================
+
+    def routes(self) -> List[Route]:
+        found = list(self.exact.values())
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            found.extend(node.routes.values())
+            if node.rest:
+                found.append(node.rest)
+            stack.extend(node.children.values())
+        return found
+
+    def validate(self, application):
+        """Raise RouteError for routes no update can reach.
+
+        A route is unreachable when its own callback_data resolves to another
+        route, when an earlier CallbackQueryHandler/CommandHandler would take
+        the update first, or when a conversation route is in no conversation.
+        """
+        problems = []
+        conversation_routes = set()
+        earlier = []  # plain PTB handlers that run before the router
+        router_seen = False
+
+        for group in sorted(application.handlers):
+            for handler in application.handlers[group]:
+                if isinstance(handler, ConversationHandler):
+                    for inner in handler.entry_points + handler.fallbacks + \
+                            [h for hs in handler.states.values() for h in hs]:
+                        if isinstance(inner, RouteHandler) and inner.route:
+                            conversation_routes.add(inner.route.action)
+                elif isinstance(handler, RouteHandler) and handler.route is None:
+                    router_seen = True
+                elif isinstance(handler, (CallbackQueryHandler, CommandHandler)) and not router_seen:
+                    earlier.append(handler)
+
+        for route in self.routes():
+            data = route.sample()
+            resolved = self.resolve(data)
+            if resolved is None or not _same(resolved[0], route):
+                other = _name(resolved[0]) if resolved else 'nothing'
+                problems.append(f"{data!r} ({_name(route)}) resolves to {other}")
+            if route.conversation and route.action not in conversation_routes:
+                problems.append(f"{data!r} ({_name(route)}) is not in any ConversationHandler")
+            for handler in earlier:
+                if isinstance(handler, CallbackQueryHandler) and handler.pattern is not None \
+                        and not callable(handler.pattern) and handler.pattern.match(data):
+                    problems.append(f"{data!r} ({_name(route)}) is shadowed by {handler!r}")
+
+        for name, route in self.commands.items():
+            for handler in earlier:
+                if isinstance(handler, CommandHandler) and name in handler.commands:
+                    problems.append(f"/{name} ({_name(route)}) is shadowed by {handler!r}")
+
+        if problems:
+            raise RouteError("Unreachable routes:\n  " + "\n  ".join(problems))
+
+        logger.info(f"ROUTES_VALIDATED: {len(self.routes())} callbacks | {len(self.commands)} commands")
+
+
+def _same(a: Route, b: Route) -> bool:
+    """Same route, even after wrap() replaced the callback"""
+    return a.action == b.action and a.arg_types == b.arg_types
+
+
+def _name(route_or_callback) -> str:
+    callback = getattr(route_or_callback, 'callback', route_or_callback)
+    return getattr(callback, '__qualname__', repr(callback))
+
+
+class RouteHandler(BaseHandler):
+    """Resolves callback_data through the router.
+
+    With a `route`, matches only that route (for ConversationHandler entry
+    points and states); without, dispatches every non-conversation route.
+    """
+
+    def __init__(self, router: Router, route: Route = None):
+        super().__init__(route.callback if route else None)
+        self.router = router
+        self.route = route
+
+    def check_update(self, update: object):
+        if not isinstance(update, Update) or not update.callback_query or update.callback_query.data is None:
+            return None
+        match = self.router.resolve(update.callback_query.data)
+        if match is None:
+            if self.route is None:
+                self.router.misses += 1
+                logger.debug(f"ROUTE_MISS: {update.callback_query.data}")
+            return None
+        if self.route is None and match[0].conversation or self.route is not None and not _same(match[0], self.route):
+            return None
+        return match
+
+    def collect_additional_context(self, context, update, application, check_result):
+        context.args = check_result[1]
+
+    async def handle_update(self, update, application, check_result, context):
+        self.collect_additional_context(context, update, application, check_result)
+        self.router.hits += 1
+        route = check_result[0]
+        return await route.callback(update, context, **route.kwargs)
+
+
+class CommandRouteHandler(BaseHandler):
+    """Dispatches every routed /command with one dict lookup"""
+
+    def __init__(self, router: Router):
+        super().__init__(None)
+        self.router = router
+
+    def check_update(self, update: object):
+        if not isinstance(update, Update):
+            return None
+        return self.router.resolve_command(update.message or update.edited_message)
+
+    def collect_additional_context(self, context, update, application, check_result):
+        context.args = check_result[1]
+
+    async def handle_update(self, update, application, check_result, context):
+        self.collect_additional_context(context, update, application, check_result)
+        route = check_result[0]
+        return await route.callback(update, context, **route.kwargs)
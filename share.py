@@ -12,6 +12,7 @@ logger = logging.getLogger(__name__)
 
 # Import from main
 from config import supabase
+from router import Router
 
 # Translations for share messages
 SHARE_TRANSLATIONS = {
@@ -261,4 +262,8 @@ async def back_to_main_callback(update: Update, context: ContextTypes.DEFAULT_TY
     await query.answer()
     
     lang = get_user_language(query.from_user.id)
-    await show_main_menu(update, context, lang)
\ No newline at end of file
+    await show_main_menu(update, context, lang)
+
+
+def register_routes(router: Router):
+    router.callback('share_bot', share_main)
@@ -0,0 +1,56 @@
+"""
+Request coalescing: concurrent identical reads share one in-flight call
+"""
+import asyncio
+import functools
+from typing import Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    """Maps a key to the task currently computing it.
+
+    The first caller for a key starts the work; everyone arriving before it
+    finishes awaits the same task and gets the same result (or exception).
+    Once the task completes the key is forgotten, so nothing is cached.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self.calls = 0
+        self.shared = 0
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._inflight
+
+    async def do(self, key: Hashable, fn: Callable[..., Awaitable], *args, **kwargs):
+        task = self._inflight.get(key)
+        if task is not None:
+            self.shared += 1
+        else:
+            self.calls += 1
+            task = asyncio.ensure_future(fn(*args, **kwargs))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+
+        # Shield so one cancelled waiter doesn't cancel the work for the rest
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+
+    def stats(self) -> Dict:
+        return {'calls': self.calls, 'shared': self.shared, 'in_flight': len(self._inflight)}
+
+
+def single_flight(fn: Callable[..., Awaitable]):
+    """Decorator: coalesce concurrent calls of an async function with equal arguments"""
+    flight = SingleFlight()
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        key = (args, tuple(sorted(kwargs.items())))
+        return await flight.do(key, fn, *args, **kwargs)
+
+    wrapper.flight = flight
+    return wrapper
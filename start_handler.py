@@ -14,20 +14,21 @@ from telegram.ext import (
     CallbackQueryHandler, filters, ContextTypes
 )
 from telegram.constants import ParseMode
-from config import supabase, model, TELEGRAM_BOT_TOKEN, FREE_BIRTHDAY_LIMIT, FREE_TEST_LIMIT
+from config import supabase, model, TELEGRAM_BOT_TOKEN, FREE_BIRTHDAY_LIMIT, FREE_TEST_LIMIT, UX_PAUSE_SECONDS
 from share import share_main
 from balance import premium_info_handler, subscribe_callback, approve_premium_payment, decline_premium_payment
 import urllib.parse
 from admin import *
+from test_cache import load_test_definition, get_cache_stats
+from activity import get_active_user_counts
+from router import Router
 
 async def notify_admin_new_user(context: ContextTypes.DEFAULT_TYPE, user_id: int, username: str, first_name: str, last_name: str):
     """Notify admin about new user registration"""
     try:
-        # Get total counts
-        total_users, total_streaks = await asyncio.gather(
-            get_total_users(),
-            get_total_streaks()
-        )
+        # Counts come from the in-memory dashboard snapshot
+        stats = await get_dashboard_stats()
+        total_users, total_streaks = stats['total_users'], stats['total_streaks']
         
         # Format user info
         full_name = f"{first_name or ''} {last_name or ''}".strip()
@@ -135,7 +136,7 @@ async def language_selected(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     
-    lang = query.data.split('_')[1]
+    lang = context.args[0]
     user = update.effective_user
 
     logger.info(f"LANGUAGE_SELECTED: User {user.id} (@{user.username}) selected language: {lang}")
@@ -157,12 +158,12 @@ async def language_selected(update: Update, context: ContextTypes.DEFAULT_TYPE):
         welcome_text = get_text(lang, 'welcome')
         await query.edit_message_text(welcome_text, parse_mode=ParseMode.HTML)
         
-        await asyncio.sleep(1)
+        await asyncio.sleep(UX_PAUSE_SECONDS)
         
         try:
-            result = supabase.table('tests').select('*').eq('id', test_id).execute()
-            
-            if not result.data:
+            definition = await load_test_definition(test_id)
+
+            if not definition or definition.archived:
                 await context.bot.send_message(
                     chat_id=update.effective_chat.id,
                     text="❌ Test not found",
@@ -217,7 +218,7 @@ async def language_selected(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             
             # Wait a bit before showing first question
-            await asyncio.sleep(1)
+            await asyncio.sleep(UX_PAUSE_SECONDS)
             
             # Show first question
             await show_taking_test_question(update, context, lang)
@@ -308,34 +309,37 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             
             # Show admin dashboard if admin
             if user.id in NOTIFICATION_ADMIN_IDS:
-                total_users, total_birthdays, total_tests, total_results, todays_active, premium_count, total_streaks, longest_streak, avg_streak = await asyncio.gather(
-                    get_total_users(),
-                    get_total_birthdays(),
-                    get_total_tests(),
-                    get_total_test_results(),
-                    get_todays_active_users(),
-                    get_premium_users(),
-                    get_total_streaks(),
-                    get_longest_streak(),
-                    get_average_streak()
-                )
+                stats = await get_dashboard_stats()
+                total_users = stats['total_users']
+                total_birthdays = stats['total_birthdays']
+                total_tests = stats['total_tests']
+                total_results = stats['total_results']
+                updated_at = stats['updated_at'].strftime('%H:%M UTC') if stats['updated_at'] else '—'
+                cache_stats = get_cache_stats()
+                active = get_active_user_counts()
 
                 admin_message = (
                     "👑 <b>Admin Dashboard</b>\n\n"
                     f"👤 <b>Total Users:</b> {total_users}\n"
-                    f"💎 <b>Premium Users:</b> {premium_count}\n"
-                    f"👥 <b>Active Today:</b> {todays_active}\n\n"
+                    f"💎 <b>Premium Users:</b> {stats['premium_users']}\n"
+                    f"👥 <b>Active Today:</b> {active['day']}\n"
+                    f"📅 <b>Active This Week / Month:</b> {active['week']} / {active['month']}\n\n"
                     f"📈 <b>Content:</b>\n"
                     f"  🎂 Birthdays saved: {total_birthdays}\n"
                     f"  📝 Tests created: {total_tests}\n"
                     f"  ✅ Tests taken: {total_results}\n"
-                    f"  🔥 Active streaks: {total_streaks}\n\n"
+                    f"  🔥 Active streaks: {stats['total_streaks']}\n\n"
                     f"📊 <b>Averages:</b>\n"
                     f"  • Birthdays / user: {total_birthdays / total_users if total_users else 0:.1f}\n"
                     f"  • Tests taken / test: {total_results / total_tests if total_tests else 0:.1f}\n\n"
                     f"🏆 <b>Streak Stats:</b>\n"
-                    f"  • Longest streak: {longest_streak} days\n"
-                    f"  • Average streak: {avg_streak:.1f} days"
+                    f"  • Longest streak: {stats['longest_streak']} days\n"
+                    f"  • Average streak: {float(stats['average_streak']):.1f} days\n\n"
+                    f"⚡ <b>Test Cache:</b>\n"
+                    f"  • Hit rate: {cache_stats['hit_rate'] * 100:.1f}% "
+                    f"({cache_stats['hits']}/{cache_stats['hits'] + cache_stats['misses']})\n"
+                    f"  • Entries: {cache_stats['size']}/{cache_stats['max_entries']}\n\n"
+                    f"🕒 <i>Stats as of {updated_at} · /admin_refresh</i>"
                 )
 
                 await update.message.reply_text(
@@ -356,6 +360,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 last_name=user.last_name or ''
             )
             logger.info(f"NEW_USER_AUTO_SAVED: User {user.id} auto-saved with default language 'uz'")
+            bump_stat('total_users')
             await notify_admin_new_user(
                 context=context,
                 user_id=user.id,
@@ -517,6 +522,7 @@ async def start_taking_test(update: Update, context: ContextTypes.DEFAULT_TYPE,
                 last_name=user.last_name or ''
             )
             logger.info(f"NEW_USER_AUTO_SAVED: User {user.id} auto-saved with default 'uz' before test")
+            bump_stat('total_users')
             
             await notify_admin_new_user(
                 context=context,
@@ -558,14 +564,14 @@ async def start_taking_test(update: Update, context: ContextTypes.DEFAULT_TYPE,
         return
 
     try:
-        result = supabase.table('tests').select('*').eq('id', test_id).execute()
-        
-        if not result.data:
+        definition = await load_test_definition(test_id)
+
+        # Recreated (archived) versions are no longer open to new takers
+        if not definition or definition.archived:
             await update.message.reply_text("❌ Test not found", parse_mode=ParseMode.HTML)
             return
-        
-        test = result.data[0]
-        test_owner_id = test['user_id']
+
+        test_owner_id = definition.owner_id
         
         # Check if user is taking their own test
         if str(user_id) == test_owner_id:
@@ -712,7 +718,7 @@ async def start_taking_test(update: Update, context: ContextTypes.DEFAULT_TYPE,
         await update.message.reply_text(intro_text, parse_mode=ParseMode.HTML)
         
         # Wait a bit before showing first question
-        await asyncio.sleep(1)
+        await asyncio.sleep(UX_PAUSE_SECONDS)
         
         # Show first question
         await show_taking_test_question(update, context, lang)
@@ -720,3 +726,9 @@ async def start_taking_test(update: Update, context: ContextTypes.DEFAULT_TYPE,
     except Exception as e:
         logger.error(f"Error starting test: {e}")
         await update.message.reply_text("❌ Error loading test", parse_mode=ParseMode.HTML)
+
+
+def register_routes(router: Router):
+    router.command('start', start)
+    router.callback('lang', language_selected, str)
+    router.callback('change_language', show_language_selection)
@@ -6,9 +6,12 @@ from telegram.ext import ContextTypes, ConversationHandler, MessageHandler, filt
 from telegram.constants import ParseMode
 from config import supabase
 from friendship_streaks import (
-    get_or_create_streak, update_streak, get_user_friends,
+    find_streak, get_or_create_streak, update_streak, get_user_friends,
     get_streak_text, DAILY_QUESTIONS, FRIEND_INFO_QUESTIONS, GUESS_QUESTIONS
 )
+from friend_graph import are_friends
+from streak_bitmap import DayBitmap, bitmap_from_row, active_days, longest_run, calendar_weeks
+from router import Router, callback_data
 import urllib.parse
 
 
@@ -217,7 +220,11 @@ async def handle_daily_question_start(update: Update, context: ContextTypes.DEFA
     lang = context.user_data.get('language', 'en')
     
     # Extract friend_id
-    friend_id = int(query.data.split('_')[-1])
+    friend_id = context.args[0]
+    
+    if not await are_friends(user_id, friend_id):
+        await query.edit_message_text(get_streak_text(lang, 'not_friends'))
+        return
     
     # Get random question
     question = random.choice(DAILY_QUESTIONS.get(lang, DAILY_QUESTIONS['en']))
@@ -230,7 +237,7 @@ async def handle_daily_question_start(update: Update, context: ContextTypes.DEFA
     text = get_streak_text(lang, 'daily_q_title').format(question=question)
     
     keyboard = [
-        [InlineKeyboardButton(get_streak_text(lang, 'answer'), callback_data=f'daily_q_answer_{friend_id}')],
+        [InlineKeyboardButton(get_streak_text(lang, 'answer'), callback_data=callback_data('daily_q_answer', friend_id))],
         [InlineKeyboardButton(get_streak_text(lang, 'skip'), callback_data='streaks_menu')],
     ]
     
@@ -286,7 +293,7 @@ async def handle_daily_question_answer_text(update: Update, context: ContextType
         keyboard = [
             [InlineKeyboardButton(
                 get_streak_text(lang, 'send_to_friend'),
-                callback_data=f'daily_q_send_{friend_id}'
+                callback_data=callback_data('daily_q_send', friend_id)
             )],
             [InlineKeyboardButton(get_streak_text(lang, 'back'), callback_data='streaks_menu')]
         ]
@@ -313,7 +320,7 @@ async def handle_daily_question_send(update: Update, context: ContextTypes.DEFAU
     user_id = update.effective_user.id
     lang = context.user_data.get('language', 'en')
     
-    friend_id = int(query.data.split('_')[-1])
+    friend_id = context.args[0]
     question = context.user_data.get('daily_q_question')
     answer = context.user_data.get('daily_q_answer')
     
@@ -363,7 +370,7 @@ async def handle_remember_friend_start(update: Update, context: ContextTypes.DEF
     user_id = update.effective_user.id
     lang = context.user_data.get('language', 'en')
     
-    friend_id = int(query.data.split('_')[-1])
+    friend_id = context.args[0]
     
     # Get random question
     question = random.choice(FRIEND_INFO_QUESTIONS.get(lang, FRIEND_INFO_QUESTIONS['en']))
@@ -449,7 +456,11 @@ async def handle_guess_game(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     lang = context.user_data.get('language', 'en')
     
-    friend_id = int(query.data.split('_')[-1])
+    friend_id = context.args[0]
+    
+    if not await are_friends(user_id, friend_id):
+        await query.edit_message_text(get_streak_text(lang, 'not_friends'))
+        return
     
     # Get random question
     question = random.choice(GUESS_QUESTIONS.get(lang, GUESS_QUESTIONS['en']))
@@ -474,8 +485,8 @@ async def handle_guess_game(update: Update, context: ContextTypes.DEFAULT_TYPE):
     random.shuffle(options)
     
     keyboard = [
-        [InlineKeyboardButton(options[0][0], callback_data=f'guess_answer_{friend_id}_{options[0][1]}')],
-        [InlineKeyboardButton(options[1][0], callback_data=f'guess_answer_{friend_id}_{options[1][1]}')],
+        [InlineKeyboardButton(options[0][0], callback_data=callback_data('guess_answer', friend_id, options[0][1]))],
+        [InlineKeyboardButton(options[1][0], callback_data=callback_data('guess_answer', friend_id, options[1][1]))],
         [InlineKeyboardButton(get_streak_text(lang, 'back'), callback_data='streaks_menu')]
     ]
     
@@ -490,10 +501,7 @@ async def handle_guess_answer(update: Update, context: ContextTypes.DEFAULT_TYPE
     user_id = update.effective_user.id
     lang = context.user_data.get('language', 'en')
     
-    # Parse callback data
-    parts = query.data.split('_')
-    friend_id = int(parts[2])
-    answer = parts[3]  # 'user' or 'friend'
+    friend_id, answer = context.args  # answer: 'user' or 'friend'
     
     # Random correct answer
     correct = random.choice(['user', 'friend'])
@@ -527,6 +535,70 @@ async def handle_guess_answer(update: Update, context: ContextTypes.DEFAULT_TYPE
         await query.edit_message_text("❌ Error")
 
 
+CALENDAR_WEEKS = 5
+CONSISTENCY_WINDOW_DAYS = 90
+
+
+def render_calendar(bitmap: DayBitmap, today) -> str:
+    """Emoji grid, one Monday-first row per week"""
+    cells = {True: '🟩', False: '⬜', None: '▫️'}
+    return '\n'.join(
+        ''.join(cells[day] for day in week)
+        for week in calendar_weeks(bitmap, today, CALENDAR_WEEKS)
+    )
+
+
+async def handle_streak_calendar(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show a pair's interaction calendar and consistency stats from the day bitmap"""
+    query = update.callback_query
+    await query.answer()
+    
+    user_id = update.effective_user.id
+    lang = context.user_data.get('language', 'en')
+    
+    friend_id = context.args[0]
+    
+    if not await are_friends(user_id, friend_id):
+        await query.edit_message_text(get_streak_text(lang, 'not_friends'))
+        return
+    
+    # Read-only view: a pair with no row yet gets an empty calendar, not a new row
+    try:
+        streak = find_streak(user_id, friend_id) or {}
+    except Exception as e:
+        logger.error(f"Error loading streak calendar: {e}")
+        await query.edit_message_text("❌ Error loading calendar")
+        return
+    
+    friend_info = supabase.table('friends_users')\
+        .select('first_name')\
+        .eq('telegram_id', str(friend_id))\
+        .execute()
+    friend_name = friend_info.data[0].get('first_name') or 'Friend' if friend_info.data else 'Friend'
+    
+    bitmap = bitmap_from_row(streak)
+    today = datetime.now(timezone.utc).date()
+    
+    # Consistency over the part of the window the pair has existed for
+    window = CONSISTENCY_WINDOW_DAYS
+    if bitmap.start is not None:
+        window = max(1, min(window, (today - bitmap.start).days + 1))
+    
+    text = get_streak_text(lang, 'calendar_title').format(name=friend_name) + '\n\n'
+    text += render_calendar(bitmap, today) + '\n\n'
+    text += get_streak_text(lang, 'calendar_stats').format(
+        current=streak.get('current_streak') or 0,
+        longest=max(longest_run(bitmap), streak.get('longest_streak') or 0),
+        week=active_days(bitmap, today, 7),
+        month=active_days(bitmap, today, 30),
+        consistency=round(100 * active_days(bitmap, today, window) / window)
+    )
+    
+    keyboard = [[InlineKeyboardButton(get_streak_text(lang, 'back'), callback_data='streaks_menu')]]
+    
+    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.HTML)
+
+
 async def handle_weekly_checkin(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show weekly check-in"""
     query = update.callback_query
@@ -535,7 +607,7 @@ async def handle_weekly_checkin(update: Update, context: ContextTypes.DEFAULT_TY
     user_id = update.effective_user.id
     lang = context.user_data.get('language', 'en')
     
-    friend_id = int(query.data.split('_')[-1])
+    friend_id = context.args[0]
     
     # Get friend name
     friend_info = supabase.table('friends_users')\
@@ -549,8 +621,8 @@ async def handle_weekly_checkin(update: Update, context: ContextTypes.DEFAULT_TY
     text = get_streak_text(lang, 'weekly_title').format(friend_name=friend_name)
     
     keyboard = [
-        [InlineKeyboardButton(get_streak_text(lang, 'yes'), callback_data=f'weekly_yes_{friend_id}')],
-        [InlineKeyboardButton(get_streak_text(lang, 'not_yet'), callback_data=f'weekly_no_{friend_id}')],
+        [InlineKeyboardButton(get_streak_text(lang, 'yes'), callback_data=callback_data('weekly_yes', friend_id))],
+        [InlineKeyboardButton(get_streak_text(lang, 'not_yet'), callback_data=callback_data('weekly_no', friend_id))],
         [InlineKeyboardButton(get_streak_text(lang, 'back'), callback_data='streaks_menu')]
     ]
     
@@ -565,7 +637,7 @@ async def handle_weekly_yes(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     lang = context.user_data.get('language', 'en')
     
-    friend_id = int(query.data.split('_')[-1])
+    friend_id = context.args[0]
     
     try:
         # Update streak
@@ -609,11 +681,11 @@ async def handle_quiz_retake(update: Update, context: ContextTypes.DEFAULT_TYPE)
     await query.answer()
     
     user_id = update.effective_user.id
-    friend_id = int(query.data.split('_')[-1])
+    friend_id = context.args[0]
     
     try:
         # Get friend's test
-        test_result = supabase.table('tests').select('id').eq('user_id', str(friend_id)).execute()
+        test_result = supabase.table('tests').select('id').eq('user_id', str(friend_id)).is_('archived_at', 'null').order('created_at', desc=True).limit(1).execute()
         
         if test_result.data:
             test_id = test_result.data[0]['id']
@@ -632,4 +704,18 @@ async def handle_quiz_retake(update: Update, context: ContextTypes.DEFAULT_TYPE)
             
     except Exception as e:
         logger.error(f"Error starting quiz retake: {e}")
-        await query.edit_message_text("❌ Error")
\ No newline at end of file
+        await query.edit_message_text("❌ Error")
+
+
+def register_routes(router: Router):
+    router.callback('streak_ping', handle_ping_friend)
+    router.callback('streak_friend_ping', handle_ping_friend, int)
+    router.callback('streak_friend_daily_q', handle_daily_question_start, int)
+    router.callback('daily_q_send', handle_daily_question_send, int)
+    router.callback('streak_friend_guess', handle_guess_game, int)
+    router.callback('guess_answer', handle_guess_answer, int, str)
+    router.callback('streak_friend_weekly', handle_weekly_checkin, int)
+    router.callback('weekly_yes', handle_weekly_yes, int)
+    router.callback('weekly_no', handle_weekly_no, int)
+    router.callback('streak_friend_quiz', handle_quiz_retake, int)
+    router.callback('streak_friend_calendar', handle_streak_calendar, int)
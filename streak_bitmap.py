@@ -0,0 +1,162 @@
+"""
+Per-pair day bitmaps: bit i set = the pair interacted on bitmap_start + i days
+"""
+from datetime import date, datetime, timedelta
+from typing import List, NamedTuple, Optional, Tuple
+
+
+class DayBitmap(NamedTuple):
+    bits: int
+    start: Optional[date]
+
+    def day_index(self, day: date) -> int:
+        return (day - self.start).days
+
+    def has_day(self, day: date) -> bool:
+        if self.start is None:
+            return False
+        index = self.day_index(day)
+        return index >= 0 and bool(self.bits >> index & 1)
+
+    def with_day(self, day: date) -> 'DayBitmap':
+        """Copy with `day` marked; the window grows backwards if needed"""
+        if self.start is None:
+            return DayBitmap(1, day)
+        index = self.day_index(day)
+        if index < 0:
+            return DayBitmap((self.bits << -index) | 1, day)
+        return DayBitmap(self.bits | (1 << index), self.start)
+
+
+EMPTY_BITMAP = DayBitmap(0, None)
+
+
+# ==================== STORAGE ====================
+# Stored as friendship_streaks.day_bitmap (bytea, little-endian so bit i is
+# Postgres get_bit/set_bit index i) plus friendship_streaks.bitmap_start (date).
+
+def decode_bitmap(raw: Optional[str], start: Optional[str]) -> DayBitmap:
+    if not raw or not start:
+        return EMPTY_BITMAP
+    hex_digits = raw[2:] if raw.startswith('\\x') else raw
+    return DayBitmap(int.from_bytes(bytes.fromhex(hex_digits), 'little'), date.fromisoformat(start[:10]))
+
+
+def encode_bitmap(bitmap: DayBitmap) -> dict:
+    if bitmap.start is None:
+        return {'day_bitmap': None, 'bitmap_start': None}
+    size = max(1, (bitmap.bits.bit_length() + 7) // 8)
+    return {
+        'day_bitmap': '\\x' + bitmap.bits.to_bytes(size, 'little').hex(),
+        'bitmap_start': bitmap.start.isoformat()
+    }
+
+
+def bitmap_from_row(row: dict) -> DayBitmap:
+    return decode_bitmap(row.get('day_bitmap'), row.get('bitmap_start'))
+
+
+# ==================== RUNS ====================
+
+def run_ending_at(bitmap: DayBitmap, day: date) -> int:
+    """Length of the run of consecutive set days ending at `day` (inclusive)"""
+    if bitmap.start is None:
+        return 0
+    index = bitmap.day_index(day)
+    if index < 0:
+        return 0
+    # Invert the window up to `day`; its highest set bit is the latest missing day
+    window = bitmap.bits & ((1 << (index + 1)) - 1)
+    missing = ~window & ((1 << (index + 1)) - 1)
+    if not missing:
+        return index + 1
+    return index - (missing.bit_length() - 1)
+
+
+def last_active_day(bitmap: DayBitmap, today: date) -> date:
+    """Today if the pair already interacted today, otherwise yesterday"""
+    return today if bitmap.has_day(today) else today - timedelta(days=1)
+
+
+def current_run(bitmap: DayBitmap, today: date) -> int:
+    """The streak as the bitmap sees it: a run reaching today or yesterday"""
+    return run_ending_at(bitmap, last_active_day(bitmap, today))
+
+
+def window_bits(bitmap: DayBitmap, end: date, days: int) -> int:
+    """The `days` bits ending at `end`, shifted so bit 0 = end - days + 1"""
+    if bitmap.start is None:
+        return 0
+    first = bitmap.day_index(end) - days + 1
+    bits = bitmap.bits >> first if first >= 0 else bitmap.bits << -first
+    return bits & ((1 << days) - 1)
+
+
+def active_days(bitmap: DayBitmap, end: date, days: int) -> int:
+    """How many of the last `days` days (ending at `end`) had an interaction"""
+    return bin(window_bits(bitmap, end, days)).count('1')
+
+
+def longest_run(bitmap: DayBitmap) -> int:
+    """Longest-ever run: each `x & (x >> 1)` shortens every run by one day"""
+    bits, length = bitmap.bits, 0
+    while bits:
+        bits &= bits >> 1
+        length += 1
+    return length
+
+
+def calendar_weeks(bitmap: DayBitmap, today: date, weeks: int) -> List[List[Optional[bool]]]:
+    """Monday-first week rows ending with the current week; None = future day"""
+    first_monday = today - timedelta(days=today.weekday() + 7 * (weeks - 1))
+    rows = []
+    for week in range(weeks):
+        row = []
+        for weekday in range(7):
+            day = first_monday + timedelta(days=7 * week + weekday)
+            row.append(None if day > today else bitmap.has_day(day))
+        rows.append(row)
+    return rows
+
+
+class RestorePlan(NamedTuple):
+    missing_days: Tuple[date, ...]
+    restored_streak: int
+    resume_day: date  # last day of the restored run
+
+
+def plan_restore(bitmap: DayBitmap, today: date, max_gap_days: int) -> Optional[RestorePlan]:
+    """Find the most recent gap that broke a streak and what filling it gives.
+
+    Walks back from today: [run after the gap][gap][run before the gap].
+    Restorable when the gap is 1..max_gap_days long and a run precedes it.
+    """
+    if bitmap.start is None:
+        return None
+
+    end = last_active_day(bitmap, today)
+    after = run_ending_at(bitmap, end)
+    gap_end = end - timedelta(days=after)
+
+    gap = 0
+    day = gap_end
+    while gap <= max_gap_days and day >= bitmap.start and not bitmap.has_day(day):
+        gap += 1
+        day -= timedelta(days=1)
+
+    if gap == 0 or gap > max_gap_days or day < bitmap.start:
+        return None
+
+    before = run_ending_at(bitmap, day)
+    missing = tuple(gap_end - timedelta(days=i) for i in range(gap))
+    return RestorePlan(missing_days=missing, restored_streak=before + gap + after, resume_day=end)
+
+
+def apply_restore(bitmap: DayBitmap, plan: RestorePlan) -> DayBitmap:
+    for day in plan.missing_days:
+        bitmap = bitmap.with_day(day)
+    return bitmap
+
+
+def utc_day(timestamp: str) -> date:
+    return datetime.fromisoformat(timestamp.replace('Z', '+00:00')).date()
@@ -0,0 +1,59 @@
+"""
+Nightly sweep that resets streaks whose pair stopped interacting
+"""
+import asyncio
+import logging
+from datetime import datetime, timezone, timedelta
+
+from telegram.ext import ContextTypes
+
+from config import supabase, STREAK_EXPIRY_BATCH_SIZE
+from job_runs import record_job_run
+from leaderboard import mark_leaderboard_dirty
+
+logger = logging.getLogger(__name__)
+
+JOB_NAME = 'expire_stale_streaks'
+
+
+def streak_expiry_cutoff(now: datetime) -> datetime:
+    """Start of yesterday (UTC): a pair that last talked before this has missed a day"""
+    today = now.astimezone(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    return today - timedelta(days=1)
+
+
+def expire_stale_streaks_batch(cutoff: datetime) -> int:
+    """Reset one batch of stale live streaks in a single statement. Returns rows reset."""
+    result = supabase.rpc('expire_stale_streaks', {
+        'p_cutoff': cutoff.isoformat(),
+        'p_batch_size': STREAK_EXPIRY_BATCH_SIZE
+    }).execute()
+    return result.data or 0
+
+
+def expire_stale_streaks_sync(now: datetime) -> int:
+    cutoff = streak_expiry_cutoff(now)
+    total = 0
+    while True:
+        expired = expire_stale_streaks_batch(cutoff)
+        total += expired
+        if expired < STREAK_EXPIRY_BATCH_SIZE:
+            return total
+
+
+async def expire_stale_streaks(context: ContextTypes.DEFAULT_TYPE):
+    """Daily job (just after midnight UTC): zero current_streak of abandoned pairs"""
+    started_at = datetime.now(timezone.utc)
+    cutoff = streak_expiry_cutoff(started_at)
+
+    try:
+        total = await asyncio.to_thread(expire_stale_streaks_sync, started_at)
+    except Exception as e:
+        logger.error(f"Error expiring stale streaks: {e}")
+        return
+
+    await asyncio.to_thread(record_job_run, JOB_NAME, started_at, total, {'cutoff': cutoff.isoformat()})
+    if total:
+        mark_leaderboard_dirty()
+
+    logger.info(f"STREAKS_EXPIRED: {total} streaks last active before {cutoff.date()}")
@@ -0,0 +1,266 @@
+"""
+"Streak at risk" evening reminders with one-tap ping
+"""
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from datetime import datetime, timezone, timedelta
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from telegram import Bot, Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.constants import ParseMode
+from telegram.error import Forbidden, RetryAfter, TelegramError
+from telegram.ext import ContextTypes
+
+from config import supabase, NOTIFICATION_SEND_RATE, STREAK_RISK_PAGE_SIZE, STREAK_RISK_MAX_BUTTONS
+from friend_graph import are_friends
+from friendship_streaks import get_or_create_streak, update_streak
+from job_runs import record_job_run
+from router import Router, callback_data
+from streak_actions import log_interaction
+
+logger = logging.getLogger(__name__)
+
+JOB_NAME = 'streak_risk_reminders'
+PROFILE_CHUNK = 100  # keep PostgREST URLs short
+
+STREAK_RISK_TRANSLATIONS = {
+    'uz': {
+        'title': "🔥 <b>Muloqotlaringiz bugun tugab qolishi mumkin!</b>",
+        'line': "• <b>{name}</b> — {days} kun",
+        'hint': "\n💡 Bir marta bosing — salom yuboriladi va muloqot saqlanadi.",
+        'ping_button': "👋 {name}ga salom",
+        'ping_sent': "✅ Salom yuborildi! 🔥 {name} bilan muloqot: {days} kun",
+        'ping_received': "👋 <b>{name}</b> sizga salom yubordi!\n\n🔥 Do'stlik muloqotingiz davom etmoqda: {days} kun",
+        'not_friends': "❌ Bu foydalanuvchi do'stlaringiz ro'yxatida yo'q",
+    },
+    'ru': {
+        'title': "🔥 <b>Ваши серии общения могут прерваться сегодня!</b>",
+        'line': "• <b>{name}</b> — {days} дней",
+        'hint': "\n💡 Одно нажатие — привет отправлен, серия сохранена.",
+        'ping_button': "👋 Привет, {name}",
+        'ping_sent': "✅ Привет отправлен! 🔥 Общение с {name}: {days} дней",
+        'ping_received': "👋 <b>{name}</b> передаёт вам привет!\n\n🔥 Ваша серия общения продолжается: {days} дней",
+        'not_friends': "❌ Этого пользователя нет в списке ваших друзей",
+    },
+    'en': {
+        'title': "🔥 <b>Your streaks end tonight!</b>",
+        'line': "• <b>{name}</b> — {days} days",
+        'hint': "\n💡 One tap sends a hi and keeps the streak alive.",
+        'ping_button': "👋 Say hi to {name}",
+        'ping_sent': "✅ Hi sent! 🔥 Streak with {name}: {days} days",
+        'ping_received': "👋 <b>{name}</b> says hi!\n\n🔥 Keep your friendship streak alive: {days} days",
+        'not_friends': "❌ This user isn't in your friends list",
+    }
+}
+
+
+def get_risk_text(lang: str, key: str) -> str:
+    """Get translated streak reminder text"""
+    return STREAK_RISK_TRANSLATIONS.get(lang, STREAK_RISK_TRANSLATIONS['en']).get(key, key)
+
+
+# ==================== CANDIDATE SELECTION ====================
+
+def iter_at_risk_streaks(since: datetime, until: datetime,
+                         page_size: int = STREAK_RISK_PAGE_SIZE) -> Iterator[Dict]:
+    """Live streaks with since <= last_interaction < until.
+
+    Keyset-paginated on (last_interaction, id) so every page is a bounded
+    range scan of friendship_streaks_live_last_id_idx, never an OFFSET.
+    """
+    last_key = None
+    while True:
+        query = supabase.table('friendship_streaks')\
+            .select('id, user_id, friend_id, current_streak, last_interaction')\
+            .gt('current_streak', 0)\
+            .gte('last_interaction', since.isoformat())\
+            .lt('last_interaction', until.isoformat())
+
+        if last_key:
+            last_ts, last_id = last_key
+            query = query.or_(
+                f'last_interaction.gt."{last_ts}",'
+                f'and(last_interaction.eq."{last_ts}",id.gt.{last_id})'
+            )
+
+        page = query.order('last_interaction').order('id').limit(page_size).execute().data or []
+        yield from page
+
+        if len(page) < page_size:
+            return
+        last_key = (page[-1]['last_interaction'], page[-1]['id'])
+
+
+def group_by_recipient(rows: Iterable[Dict]) -> Dict[int, List[Tuple[int, int]]]:
+    """Both sides of each pair get reminded: {recipient: [(friend_id, days), ...]}"""
+    grouped = defaultdict(list)
+    for row in rows:
+        user_id, friend_id = int(row['user_id']), int(row['friend_id'])
+        days = row['current_streak']
+        grouped[user_id].append((friend_id, days))
+        grouped[friend_id].append((user_id, days))
+
+    for friends in grouped.values():
+        friends.sort(key=lambda f: f[1], reverse=True)
+    return grouped
+
+
+def fetch_profiles(user_ids: List[int]) -> Dict[int, Dict]:
+    """Names and languages for every recipient and friend, in chunked batches"""
+    ids = [str(u) for u in user_ids]
+    profiles = {}
+    for i in range(0, len(ids), PROFILE_CHUNK):
+        result = supabase.table('friends_users')\
+            .select('telegram_id, first_name, last_name, username, language')\
+            .in_('telegram_id', ids[i:i + PROFILE_CHUNK])\
+            .execute()
+        for row in result.data or []:
+            profiles[int(row['telegram_id'])] = row
+    return profiles
+
+
+def _display_name(profile: Dict) -> str:
+    if not profile:
+        return 'Friend'
+    name = f"{profile.get('first_name') or ''} {profile.get('last_name') or ''}".strip()
+    return name or profile.get('username') or 'Friend'
+
+
+def build_reminder(lang: str, friends: List[Tuple[int, int]], profiles: Dict[int, Dict]):
+    """One message per recipient listing every at-risk friend"""
+    lines = [get_risk_text(lang, 'title'), '']
+    keyboard = []
+    for friend_id, days in friends:
+        name = _display_name(profiles.get(friend_id))
+        lines.append(get_risk_text(lang, 'line').format(name=name, days=days))
+        if len(keyboard) < STREAK_RISK_MAX_BUTTONS:
+            keyboard.append([InlineKeyboardButton(
+                get_risk_text(lang, 'ping_button').format(name=name),
+                callback_data=callback_data('risk_ping', friend_id)
+            )])
+    lines.append(get_risk_text(lang, 'hint'))
+    return '\n'.join(lines), InlineKeyboardMarkup(keyboard)
+
+
+# ==================== SENDING ====================
+
+class RateLimitedSender:
+    """Spaces sends to at most `rate` messages per second and honors RetryAfter"""
+
+    def __init__(self, bot: Bot, rate: float = NOTIFICATION_SEND_RATE):
+        self.bot = bot
+        self.interval = 1.0 / rate
+        self._next_slot = 0.0
+        self._lock = asyncio.Lock()
+        self.sent = 0
+        self.failed = 0
+        self.blocked = 0
+
+    async def _wait_for_slot(self):
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def send(self, chat_id: int, text: str, **kwargs) -> bool:
+        for attempt in range(2):
+            await self._wait_for_slot()
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text, **kwargs)
+                self.sent += 1
+                return True
+            except RetryAfter as e:
+                retry_after = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else e.retry_after
+                logger.warning(f"Flood control hit, sleeping {retry_after}s")
+                await asyncio.sleep(retry_after)
+            except Forbidden:
+                self.blocked += 1
+                return False
+            except TelegramError as e:
+                logger.error(f"Error sending to {chat_id}: {e}")
+                break
+        self.failed += 1
+        return False
+
+
+async def send_streak_risk_reminders(context: ContextTypes.DEFAULT_TYPE):
+    """Evening job: remind users whose streaks were fed yesterday but not today"""
+    started_at = datetime.now(timezone.utc)
+    today = started_at.replace(hour=0, minute=0, second=0, microsecond=0)
+    yesterday = today - timedelta(days=1)
+
+    try:
+        rows = await asyncio.to_thread(lambda: list(iter_at_risk_streaks(yesterday, today)))
+        grouped = group_by_recipient(rows)
+        profiles = await asyncio.to_thread(fetch_profiles, list(grouped))
+    except Exception as e:
+        logger.error(f"Error selecting at-risk streaks: {e}")
+        return
+
+    sender = RateLimitedSender(context.bot)
+    for recipient, friends in grouped.items():
+        profile = profiles.get(recipient)
+        if not profile:
+            continue
+        text, reply_markup = build_reminder(profile.get('language') or 'en', friends, profiles)
+        await sender.send(recipient, text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+
+    await asyncio.to_thread(record_job_run, JOB_NAME, started_at, sender.sent, {
+        'pairs': len(rows),
+        'recipients': len(grouped),
+        'failed': sender.failed,
+        'blocked': sender.blocked
+    })
+    logger.info(f"STREAK_RISK_REMINDERS: {len(rows)} pairs | {len(grouped)} recipients | "
+                f"Sent: {sender.sent} | Failed: {sender.failed} | Blocked: {sender.blocked}")
+
+
+async def handle_risk_ping(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """One-tap "say hi" from a reminder: counts as today's interaction"""
+    query = update.callback_query
+    await query.answer()
+
+    user = update.effective_user
+    friend_id = context.args[0]
+
+    profiles = fetch_profiles([user.id, friend_id])
+    lang = context.user_data.get('language') or profiles.get(user.id, {}).get('language') or 'en'
+    context.user_data['language'] = lang
+
+    if not await are_friends(user.id, friend_id):
+        await query.edit_message_reply_markup(reply_markup=None)
+        await query.message.reply_text(get_risk_text(lang, 'not_friends'))
+        return
+
+    try:
+        streak = get_or_create_streak(user.id, friend_id)
+        streak_days = update_streak(streak['id'], user.id, friend_id)
+        log_interaction(streak['id'], user.id, friend_id, 'risk_ping')
+
+        friend_lang = profiles.get(friend_id, {}).get('language') or 'en'
+        user_name = f"{user.first_name or ''} {user.last_name or ''}".strip() or 'Friend'
+        try:
+            await context.bot.send_message(
+                chat_id=friend_id,
+                text=get_risk_text(friend_lang, 'ping_received').format(name=user_name, days=streak_days),
+                parse_mode=ParseMode.HTML
+            )
+        except TelegramError as e:
+            logger.warning(f"Could not deliver risk ping to {friend_id}: {e}")
+
+        await query.message.reply_text(
+            get_risk_text(lang, 'ping_sent').format(name=_display_name(profiles.get(friend_id)), days=streak_days)
+        )
+        logger.info(f"STREAK_RISK_PING: User {user.id} -> Friend {friend_id} | Streak: {streak_days}")
+
+    except Exception as e:
+        logger.error(f"Error handling risk ping: {e}")
+        await query.message.reply_text("❌ Error sending ping")
+
+
+def register_routes(router: Router):
+    router.callback('risk_ping', handle_risk_ping, int)
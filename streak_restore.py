@@ -0,0 +1,242 @@
+"""
+Premium streak restore: refill a recent gap in a pair's day bitmap
+"""
+import logging
+from datetime import datetime, timezone, time as dt_time
+from typing import Dict, List, Optional
+
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.constants import ParseMode
+from telegram.ext import ContextTypes
+
+from balance import is_user_premium
+from config import supabase, STREAK_RESTORE_MAX_GAP_DAYS, STREAK_RESTORE_WINDOW_DAYS
+from leaderboard import mark_leaderboard_dirty
+from router import Router, callback_data
+from streak_bitmap import bitmap_from_row, encode_bitmap, plan_restore, apply_restore, utc_day, RestorePlan
+
+logger = logging.getLogger(__name__)
+
+STREAK_RESTORE_TRANSLATIONS = {
+    'uz': {
+        'title': "♻️ <b>Muloqotni tiklash</b>\n\nOyiga bir marta uzilib qolgan muloqotni qayta tiklashingiz mumkin.",
+        'option': "{name}: {before} → {after} kun",
+        'nothing': "✅ Tiklash kerak bo'lgan muloqotlar yo'q.",
+        'premium_only': "💎 Muloqotni tiklash faqat Premium foydalanuvchilar uchun.",
+        'premium_button': "💎 Premium",
+        'token_used': "⏳ Bu oy tiklash imkoniyatidan foydalangansiz. Keyingi oy yana urinib ko'ring!",
+        'restored': "🔥 <b>{name}</b> bilan muloqot tiklandi: {days} kun!",
+        'failed': "❌ Muloqotni tiklab bo'lmadi",
+        'back': '◀️ Orqaga',
+    },
+    'ru': {
+        'title': "♻️ <b>Восстановление серии</b>\n\nРаз в месяц можно восстановить прервавшуюся серию общения.",
+        'option': "{name}: {before} → {after} дней",
+        'nothing': "✅ Нет серий, которые нужно восстановить.",
+        'premium_only': "💎 Восстановление серий доступно только Premium-пользователям.",
+        'premium_button': "💎 Premium",
+        'token_used': "⏳ Вы уже использовали восстановление в этом месяце. Попробуйте в следующем!",
+        'restored': "🔥 Серия с <b>{name}</b> восстановлена: {days} дней!",
+        'failed': "❌ Не удалось восстановить серию",
+        'back': '◀️ Назад',
+    },
+    'en': {
+        'title': "♻️ <b>Restore a streak</b>\n\nOnce a month you can bring back a streak that broke.",
+        'option': "{name}: {before} → {after} days",
+        'nothing': "✅ No broken streaks to restore.",
+        'premium_only': "💎 Streak restore is a Premium feature.",
+        'premium_button': "💎 Premium",
+        'token_used': "⏳ You've already used this month's restore. Try again next month!",
+        'restored': "🔥 Streak with <b>{name}</b> restored: {days} days!",
+        'failed': "❌ Couldn't restore the streak",
+        'back': '◀️ Back',
+    }
+}
+
+
+def get_restore_text(lang: str, key: str) -> str:
+    """Get translated streak restore text"""
+    return STREAK_RESTORE_TRANSLATIONS.get(lang, STREAK_RESTORE_TRANSLATIONS['en']).get(key, key)
+
+
+def restore_period(now: datetime) -> str:
+    """Restore tokens are spent per calendar month"""
+    return now.strftime('%Y-%m')
+
+
+def plan_for_streak(streak: Dict, now: datetime) -> Optional[RestorePlan]:
+    """A restore plan if the pair's last break is recent and short enough"""
+    today = now.date()
+    plan = plan_restore(bitmap_from_row(streak), today, STREAK_RESTORE_MAX_GAP_DAYS)
+    if not plan or (today - plan.missing_days[0]).days > STREAK_RESTORE_WINDOW_DAYS:
+        return None
+    if plan.restored_streak <= (streak.get('current_streak') or 0):
+        return None
+    return plan
+
+
+def get_restorable_streaks(user_id: int, now: datetime) -> List[Dict]:
+    """The user's pairs with a restorable break, friend names attached"""
+    streaks = supabase.table('friendship_streaks')\
+        .select('id, user_id, friend_id, current_streak, longest_streak, last_interaction, day_bitmap, bitmap_start')\
+        .or_(f'user_id.eq.{user_id},friend_id.eq.{user_id}')\
+        .not_.is_('day_bitmap', 'null')\
+        .execute().data or []
+
+    restorable = []
+    for streak in streaks:
+        plan = plan_for_streak(streak, now)
+        if plan:
+            friend_id = streak['friend_id'] if str(streak['user_id']) == str(user_id) else streak['user_id']
+            restorable.append({'streak': streak, 'plan': plan, 'friend_id': str(friend_id)})
+
+    if restorable:
+        names = supabase.table('friends_users')\
+            .select('telegram_id, first_name, last_name, username')\
+            .in_('telegram_id', [r['friend_id'] for r in restorable])\
+            .execute().data or []
+        names_by_id = {str(u['telegram_id']): u for u in names}
+        for entry in restorable:
+            user = names_by_id.get(entry['friend_id'], {})
+            entry['name'] = f"{user.get('first_name') or ''} {user.get('last_name') or ''}".strip() \
+                or user.get('username') or 'Friend'
+
+    return restorable
+
+
+def spend_restore_token(user_id: int, streak_id: int, plan: RestorePlan, now: datetime) -> bool:
+    """Insert the period's token row; the unique (user_id, period) key makes it single-use"""
+    try:
+        supabase.table('streak_restores').insert({
+            'user_id': str(user_id),
+            'streak_id': streak_id,
+            'period': restore_period(now),
+            'restored_days': len(plan.missing_days),
+            'restored_streak': plan.restored_streak
+        }).execute()
+        return True
+    except Exception as e:
+        logger.info(f"STREAK_RESTORE_TOKEN_USED: User {user_id} | {e}")
+        return False
+
+
+def refund_restore_token(user_id: int, now: datetime):
+    supabase.table('streak_restores')\
+        .delete()\
+        .eq('user_id', str(user_id))\
+        .eq('period', restore_period(now))\
+        .execute()
+
+
+def apply_streak_restore(streak: Dict, plan: RestorePlan):
+    """Fill the gap days and write the recomputed streak back"""
+    update = {
+        'current_streak': plan.restored_streak,
+        'longest_streak': max(streak.get('longest_streak') or 0, plan.restored_streak),
+        **encode_bitmap(apply_restore(bitmap_from_row(streak), plan))
+    }
+
+    # If the run now ends on a refilled day, move last_interaction there so
+    # today's interaction counts as the next day
+    last_interaction = streak.get('last_interaction')
+    if not last_interaction or utc_day(last_interaction) < plan.resume_day:
+        update['last_interaction'] = datetime.combine(plan.resume_day, dt_time(12), tzinfo=timezone.utc).isoformat()
+
+    supabase.table('friendship_streaks').update(update).eq('id', streak['id']).execute()
+
+
+async def _show_premium_only(query, lang: str):
+    keyboard = [
+        [InlineKeyboardButton(get_restore_text(lang, 'premium_button'), callback_data='premium')],
+        [InlineKeyboardButton(get_restore_text(lang, 'back'), callback_data='streaks_menu')]
+    ]
+    await query.edit_message_text(get_restore_text(lang, 'premium_only'), reply_markup=InlineKeyboardMarkup(keyboard))
+
+
+async def show_streak_restore(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """List the user's restorable streaks"""
+    query = update.callback_query
+    await query.answer()
+
+    user_id = update.effective_user.id
+    lang = context.user_data.get('language', 'en')
+
+    if not is_user_premium(user_id):
+        await _show_premium_only(query, lang)
+        return
+
+    try:
+        restorable = get_restorable_streaks(user_id, datetime.now(timezone.utc))
+    except Exception as e:
+        logger.error(f"Error loading restorable streaks: {e}")
+        await query.edit_message_text(get_restore_text(lang, 'failed'))
+        return
+
+    keyboard = [
+        [InlineKeyboardButton(
+            get_restore_text(lang, 'option').format(
+                name=entry['name'],
+                before=entry['streak']['current_streak'],
+                after=entry['plan'].restored_streak
+            ),
+            callback_data=callback_data('streak_restore', entry['streak']['id'])
+        )]
+        for entry in restorable
+    ]
+    keyboard.append([InlineKeyboardButton(get_restore_text(lang, 'back'), callback_data='streaks_menu')])
+
+    text = get_restore_text(lang, 'title') + '\n\n'
+    if not restorable:
+        text += get_restore_text(lang, 'nothing')
+
+    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.HTML)
+
+
+async def handle_streak_restore(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Spend the period's restore token on one pair"""
+    query = update.callback_query
+    await query.answer()
+
+    user_id = update.effective_user.id
+    lang = context.user_data.get('language', 'en')
+    streak_id = context.args[0]
+    now = datetime.now(timezone.utc)
+    back = InlineKeyboardMarkup([[InlineKeyboardButton(get_restore_text(lang, 'back'), callback_data='streaks_menu')]])
+
+    if not is_user_premium(user_id):
+        await _show_premium_only(query, lang)
+        return
+
+    try:
+        entry = next((r for r in get_restorable_streaks(user_id, now) if r['streak']['id'] == streak_id), None)
+        if not entry:
+            await query.edit_message_text(get_restore_text(lang, 'nothing'), reply_markup=back)
+            return
+
+        if not spend_restore_token(user_id, streak_id, entry['plan'], now):
+            await query.edit_message_text(get_restore_text(lang, 'token_used'), reply_markup=back)
+            return
+
+        try:
+            apply_streak_restore(entry['streak'], entry['plan'])
+        except Exception:
+            refund_restore_token(user_id, now)
+            raise
+
+        mark_leaderboard_dirty()
+        await query.edit_message_text(
+            get_restore_text(lang, 'restored').format(name=entry['name'], days=entry['plan'].restored_streak),
+            reply_markup=back,
+            parse_mode=ParseMode.HTML
+        )
+        logger.info(f"STREAK_RESTORED: User {user_id} | Streak {streak_id} | "
+                    f"Days filled: {len(entry['plan'].missing_days)} | Now: {entry['plan'].restored_streak}")
+
+    except Exception as e:
+        logger.error(f"Error restoring streak: {e}")
+        await query.edit_message_text(get_restore_text(lang, 'failed'), reply_markup=back)
+
+
+def register_routes(router: Router):
+    router.callback('streak_restore', show_streak_restore)
+    router.callback('streak_restore', handle_streak_restore, int)
@@ -0,0 +1,157 @@
+"""
+Read-through cache of friendship test definitions (owner + packed answer key)
+"""
+import asyncio
+import json
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional
+
+from config import supabase, TOTAL_TEST_QUESTIONS, TEST_CACHE_MAX_ENTRIES
+from single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# Each answer is stored as (option_index + 1) in a 3-bit lane, 0 = unanswered.
+# 15 questions * 3 bits = 45 bits, so a whole answer sheet fits in one int.
+ANSWER_BITS = 3
+ANSWER_MASK = (1 << ANSWER_BITS) - 1
+
+
+class TestDefinition(NamedTuple):
+    owner_id: str
+    answer_key: int
+    archived: bool = False
+
+
+def pack_answers(answers: Dict) -> int:
+    """Pack a {question_index: option_index} dict into a single int"""
+    packed = 0
+    for question, option in answers.items():
+        question = int(question)
+        option = int(option)
+        if not 0 <= question < TOTAL_TEST_QUESTIONS or not 0 <= option < ANSWER_MASK:
+            continue
+        packed |= (option + 1) << (question * ANSWER_BITS)
+    return packed
+
+
+def unpack_answers(packed: int) -> Dict[int, int]:
+    """Inverse of pack_answers"""
+    answers = {}
+    for question in range(TOTAL_TEST_QUESTIONS):
+        lane = (packed >> (question * ANSWER_BITS)) & ANSWER_MASK
+        if lane:
+            answers[question] = lane - 1
+    return answers
+
+
+def count_matching_answers(answer_key: int, packed: int) -> int:
+    """Number of questions where both sheets gave the same (non-empty) answer"""
+    correct = 0
+    for question in range(TOTAL_TEST_QUESTIONS):
+        shift = question * ANSWER_BITS
+        lane = (answer_key >> shift) & ANSWER_MASK
+        if lane and lane == (packed >> shift) & ANSWER_MASK:
+            correct += 1
+    return correct
+
+
+class TestDefinitionCache:
+    """Thread-safe LRU cache of test definitions keyed by test id"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, TestDefinition]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, test_id: str) -> Optional[TestDefinition]:
+        with self._lock:
+            definition = self._entries.get(test_id)
+            if definition is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(test_id)
+            self.hits += 1
+            return definition
+
+    def put(self, test_id: str, definition: TestDefinition):
+        with self._lock:
+            self._entries[test_id] = definition
+            self._entries.move_to_end(test_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, test_id: str):
+        with self._lock:
+            self._entries.pop(test_id, None)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+test_cache = TestDefinitionCache(TEST_CACHE_MAX_ENTRIES)
+_definition_flight = SingleFlight()
+
+
+def get_test_definition(test_id: str) -> Optional[TestDefinition]:
+    """Get test owner and packed answer key, reading the DB only on a cache miss"""
+    definition = test_cache.get(test_id)
+    if definition is not None:
+        return definition
+    return _fetch_test_definition(test_id)
+
+
+def _fetch_test_definition(test_id: str) -> Optional[TestDefinition]:
+    try:
+        result = supabase.table('tests').select('user_id, answers, archived_at').eq('id', test_id).execute()
+    except Exception as e:
+        logger.error(f"Error loading test {test_id}: {e}")
+        return None
+
+    if not result.data or not result.data[0].get('answers'):
+        return None
+
+    answers = result.data[0]['answers']
+    if isinstance(answers, str):
+        answers = json.loads(answers)
+
+    definition = TestDefinition(
+        owner_id=str(result.data[0]['user_id']),
+        answer_key=pack_answers(answers),
+        archived=result.data[0].get('archived_at') is not None
+    )
+    test_cache.put(test_id, definition)
+    return definition
+
+
+async def load_test_definition(test_id: str) -> Optional[TestDefinition]:
+    """Async get_test_definition: concurrent misses for one test share a single DB read"""
+    definition = test_cache.get(test_id)
+    if definition is not None:
+        return definition
+    return await _definition_flight.do(test_id, asyncio.to_thread, _fetch_test_definition, test_id)
+
+
+def invalidate_test(test_id: str):
+    """Drop a test from the cache (after delete/recreate)"""
+    test_cache.invalidate(test_id)
+
+
+def get_cache_stats() -> Dict:
+    """Hit/miss counters for tuning TEST_CACHE_MAX_ENTRIES"""
+    return test_cache.stats()
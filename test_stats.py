@@ -0,0 +1,86 @@
+"""
+Per-test score aggregates maintained on every result write
+"""
+import logging
+from typing import Dict, List, Optional
+
+from config import supabase
+
+logger = logging.getLogger(__name__)
+
+HISTOGRAM_BUCKETS = 101  # scores 0-100
+
+
+def record_test_result(test_id: str, user_id: int, score: int, answers_packed: int) -> Optional[int]:
+    """Upsert a taker's result and update the test aggregate atomically.
+
+    Returns the taker's previous score if this overwrote an earlier result.
+    """
+    result = supabase.rpc('record_test_result', {
+        'p_test_id': test_id,
+        'p_user_id': str(user_id),
+        'p_score': score,
+        'p_answers_packed': answers_packed
+    }).execute()
+    return result.data
+
+
+def empty_aggregate() -> Dict:
+    return {
+        'participants': 0,
+        'avg_score': 0.0,
+        'min_score': None,
+        'max_score': None,
+        'histogram': [0] * HISTOGRAM_BUCKETS
+    }
+
+
+def get_test_aggregate(test_id: str) -> Dict:
+    """Get participant count, average, min, max and histogram for a test"""
+    try:
+        result = supabase.table('test_score_aggregates')\
+            .select('participants, score_sum, min_score, max_score, histogram')\
+            .eq('test_id', test_id)\
+            .execute()
+    except Exception as e:
+        logger.error(f"Error getting test aggregate: {e}")
+        return empty_aggregate()
+
+    if not result.data or not result.data[0]['participants']:
+        return empty_aggregate()
+
+    row = result.data[0]
+    return {
+        'participants': row['participants'],
+        'avg_score': row['score_sum'] / row['participants'],
+        'min_score': row['min_score'],
+        'max_score': row['max_score'],
+        'histogram': row.get('histogram') or [0] * HISTOGRAM_BUCKETS
+    }
+
+
+def get_top_results(test_id: str, limit: int) -> List[Dict]:
+    """Get the best `limit` results of a test with taker profile rows attached"""
+    results = supabase.table('test_results')\
+        .select('score, user_id, created_at')\
+        .eq('test_id', test_id)\
+        .order('score', desc=True)\
+        .order('created_at', desc=False)\
+        .limit(limit)\
+        .execute()
+
+    if not results.data:
+        return []
+
+    # One batch lookup for all names instead of one query per row
+    user_ids = list({r['user_id'] for r in results.data})
+    users = supabase.table('friends_users')\
+        .select('first_name, last_name, username, telegram_id')\
+        .in_('telegram_id', user_ids)\
+        .execute()
+    users_by_id = {str(u['telegram_id']): u for u in (users.data or [])}
+
+    return [
+        {**r, 'user': users_by_id.get(str(r['user_id']))}
+        for r in results.data
+    ]
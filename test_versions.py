@@ -0,0 +1,82 @@
+"""
+Soft-versioned friendship tests: archive on recreate, compact later
+"""
+import asyncio
+import logging
+from datetime import datetime, timezone, timedelta
+from typing import List
+
+from telegram.ext import ContextTypes
+
+from config import supabase, ARCHIVED_TEST_RETENTION_DAYS, TEST_COMPACTION_BATCH_SIZE, TEST_COMPACTION_MAX_BATCHES
+from test_cache import invalidate_test
+
+logger = logging.getLogger(__name__)
+
+
+def archive_active_tests(user_id: int) -> List[str]:
+    """Archive every active test of the user in a single statement.
+
+    Results stay in place so weekly leaderboards and history keep working;
+    the compaction job trims them once the retention period has passed.
+    """
+    result = supabase.table('tests')\
+        .update({'archived_at': datetime.now(timezone.utc).isoformat()})\
+        .eq('user_id', str(user_id))\
+        .is_('archived_at', 'null')\
+        .execute()
+
+    test_ids = [row['id'] for row in (result.data or [])]
+    for test_id in test_ids:
+        invalidate_test(test_id)
+
+    logger.info(f"TESTS_ARCHIVED: User {user_id} | Tests: {test_ids}")
+    return test_ids
+
+
+def compact_archived_tests_batch(cutoff: datetime) -> int:
+    """Compact one batch of archived tests older than cutoff. Returns batch size."""
+    pending = supabase.table('tests')\
+        .select('id')\
+        .lt('archived_at', cutoff.isoformat())\
+        .is_('compacted_at', 'null')\
+        .order('archived_at')\
+        .limit(TEST_COMPACTION_BATCH_SIZE)\
+        .execute()
+
+    test_ids = [row['id'] for row in (pending.data or [])]
+    if not test_ids:
+        return 0
+
+    # Per-taker rows go; the score aggregate row stays as the summary
+    supabase.table('test_results').delete().in_('test_id', test_ids).execute()
+    supabase.table('tests')\
+        .update({'compacted_at': datetime.now(timezone.utc).isoformat()})\
+        .in_('id', test_ids)\
+        .execute()
+
+    return len(test_ids)
+
+
+def run_compaction(cutoff: datetime) -> int:
+    """Compact up to TEST_COMPACTION_MAX_BATCHES batches; the next run resumes the backlog"""
+    total = 0
+    for _ in range(TEST_COMPACTION_MAX_BATCHES):
+        compacted = compact_archived_tests_batch(cutoff)
+        total += compacted
+        if compacted < TEST_COMPACTION_BATCH_SIZE:
+            break
+    return total
+
+
+async def compact_archived_tests(context: ContextTypes.DEFAULT_TYPE):
+    """Daily job: drop per-taker results of long-archived tests in bounded batches"""
+    cutoff = datetime.now(timezone.utc) - timedelta(days=ARCHIVED_TEST_RETENTION_DAYS)
+
+    try:
+        total = await asyncio.to_thread(run_compaction, cutoff)
+    except Exception as e:
+        logger.error(f"Error compacting archived tests: {e}")
+        return
+
+    logger.info(f"TESTS_COMPACTED: {total} archived tests older than {cutoff.date()}")
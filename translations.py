@@ -210,6 +210,7 @@ TRANSLATIONS = {
         'top_scorer': 'Eng yaxshi',
         'no_participants': 'Hali hech kim yechmagan',
         'test_completed_notification': '🎉 <b>Yangi natija!</b>\n\n<b>{user_name}</b> sizning testingizni yechdi.\n\n📊 <b>Natija:</b> {score}%',
+        'test_replaced': '🔄 Muallif bu testni yangisiga almashtirdi, shuning uchun javoblaringiz saqlanmadi. Yangi havolani so\'rang va qaytadan urinib ko\'ring.',
         'your_test': 'Sizning testingiz',
         'share_test': '📤 Testni Ulashish',
 "recreate_test": '🔄 Testni qayta yaratish',
@@ -322,6 +323,7 @@ TRANSLATIONS = {
         'top_scorer': 'Лидер',
         'no_participants': 'Тест еще никто не прошел',
         'test_completed_notification': '🎉 <b>Новый результат!</b>\n\n<b>{user_name}</b> прошел ваш тест.\n\n📊 <b>Результат:</b> {score}%',
+        'test_replaced': '🔄 Автор заменил этот тест новым, поэтому ваши ответы не сохранены. Попросите новую ссылку и попробуйте снова.',
         'your_test': 'Ваш тест',
         'share_test': '📤 Поделиться',
 "recreate_test": '🔄 Пересоздать тест',
@@ -434,6 +436,7 @@ TRANSLATIONS = {
         'top_scorer': 'Top',
         'no_participants': 'No one has taken this test yet',
         'test_completed_notification': '🎉 <b>New result!</b>\n\n<b>{user_name}</b> completed your test.\n\n📊 <b>Result:</b> {score}%',
+        'test_replaced': '🔄 The author replaced this test with a new one, so your answers were not saved. Ask for the new link and try again.',
         'your_test': 'Your test',
         'share_test': '📤 Share',
 'streaks': '🔥 Streaks',
@@ -0,0 +1,209 @@
+"""
+Viral-test load generator: one shared test link, hundreds of people starting it at once
+
+A creator makes one test, then each load level releases N takers who open the
+link, pick a language and answer all 15 questions with think time between
+taps (start_taking_test, taking_test_answer, calculate_test_score, the owner
+notification and streak creation). Levels grow until p95 breaks the SLO, the
+error rate climbs or throughput stops scaling with the load.
+
+Usage:
+    python viral_load.py                                    # levels 25,50,100,200
+    python viral_load.py --levels 100,400,1600 --think-ms 3000 --ramp-seconds 10
+    python viral_load.py --db supabase --chat-limit 1       # configured DB, Telegram-like flood limit
+    python viral_load.py --json viral.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import sys
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+from e2e_bench import DB_BACKENDS, Harness, git_commit, percentile, start_harness, stop_harness
+from translations import TRANSLATIONS
+
+logger = logging.getLogger(__name__)
+
+OWNER_ID = 20_000_000
+TAKER_ID_BASE = 30_000_000
+RESULT_MARKER = TRANSLATIONS['en']['test_result_title']
+SCALING_FLOOR = 0.8  # a level must deliver 80% of the throughput its extra load asks for
+
+
+async def create_shared_test(harness: Harness) -> str:
+    await harness.step('owner_start', OWNER_ID, text='/start')
+    await harness.step('owner_language', OWNER_ID, data='lang_en')
+    await harness.step('owner_create_test', OWNER_ID, data='create_test')
+    for question in range(15):
+        await harness.step('owner_answer', OWNER_ID, data=f'test_answer_{question % 4}')
+    test_id = harness.test_link(OWNER_ID)
+    if test_id is None:
+        raise RuntimeError("the owner got no test link")
+    return test_id
+
+
+async def take_test(harness: Harness, taker_id: int, test_id: str, args, rng: random.Random) -> bool:
+    """One taker: arrive within the ramp, then tap through with think time; True if they saw their score"""
+    think = args.think_ms / 1000
+
+    async def pause():
+        if think:
+            await asyncio.sleep(rng.uniform(0.5, 1.5) * think)
+
+    await asyncio.sleep(rng.uniform(0, args.ramp_seconds))
+    await harness.step('open_link', taker_id, text=f'/start s_{test_id}')
+    await pause()
+    await harness.step('choose_language', taker_id, data='lang_en')
+    for question in range(15):
+        await pause()
+        await harness.step('submit_test' if question == 14 else 'answer',
+                           taker_id, data=f'taking_answer_{rng.randrange(4)}')
+    return any(RESULT_MARKER in text for text in harness.api.sent[taker_id])
+
+
+def owner_fan_in(harness: Harness, delivered_before: int, rejected_before: int, completed: int) -> Dict:
+    """How the owner's chat took one notification per finished taker"""
+    sent_at = harness.api.sent_at[OWNER_ID][delivered_before:]
+    per_second = Counter(int(at) for at in sent_at)
+    delivered = len(sent_at)
+    return {
+        'delivered': delivered,
+        'rejected': harness.api.rejected[OWNER_ID] - rejected_before,
+        'lost': max(0, completed - delivered),
+        'peak_per_second': max(per_second.values(), default=0),
+    }
+
+
+async def run_level(harness: Harness, level: int, index: int, test_id: str, args) -> Dict:
+    harness.timings.clear()
+    harness.calls.clear()
+    harness.errors = 0
+    delivered_before = len(harness.api.sent_at[OWNER_ID])
+    rejected_before = harness.api.rejected[OWNER_ID]
+    rng = random.Random(args.seed + index)
+    first_taker = TAKER_ID_BASE + index * 1_000_000
+
+    start = time.perf_counter()
+    outcomes = await asyncio.gather(
+        *(take_test(harness, first_taker + n, test_id, args, rng) for n in range(level)),
+        return_exceptions=True
+    )
+    wall = time.perf_counter() - start
+
+    completed = sum(1 for outcome in outcomes if outcome is True)
+    crashed = [outcome for outcome in outcomes if isinstance(outcome, BaseException)]
+    for error in crashed[:3]:
+        logger.error(f"VIRAL_LOAD_TAKER_FAILED: {error!r}")
+
+    all_timings = sorted(t for timings in harness.timings.values() for t in timings)
+    submit = sorted(harness.timings.get('submit_test', []))
+    db_calls = sum(c.db for calls in harness.calls.values() for c in calls)
+    api_calls = sum(c.api for calls in harness.calls.values() for c in calls)
+    return {
+        'takers': level,
+        'completed': completed,
+        'error_rate': round((level - completed) / level, 4),
+        'handler_errors': harness.errors,
+        'wall_seconds': round(wall, 3),
+        'updates': len(all_timings),
+        'updates_per_second': round(len(all_timings) / wall, 1) if wall else 0.0,
+        'p50_ms': round(percentile(all_timings, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(all_timings, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(all_timings, 0.99) * 1000, 2),
+        'submit_p95_ms': round(percentile(submit, 0.95) * 1000, 2),
+        'db_calls_per_taker': round(db_calls / level, 1),
+        'api_calls_per_taker': round(api_calls / level, 1),
+        'owner_notifications': owner_fan_in(harness, delivered_before, rejected_before, completed),
+    }
+
+
+def saturation(previous: Optional[Dict], current: Dict, args) -> Optional[str]:
+    """Why this level is past the saturation point, or None"""
+    if current['p95_ms'] > args.slo_ms:
+        return f"p95 {current['p95_ms']} ms over the {args.slo_ms:.0f} ms SLO"
+    if current['error_rate'] > args.max_error_rate:
+        return f"error rate {current['error_rate']:.1%} over {args.max_error_rate:.1%}"
+    if previous and previous['updates_per_second']:
+        wanted = previous['updates_per_second'] * current['takers'] / previous['takers']
+        if current['updates_per_second'] < wanted * SCALING_FLOOR:
+            return (f"throughput {current['updates_per_second']}/s, "
+                    f"{current['updates_per_second'] / wanted:.0%} of the {wanted:.0f}/s the load asks for")
+    return None
+
+
+def print_level(report: Dict):
+    owner = report['owner_notifications']
+    print(f"  {report['takers']:>6}{report['completed']:>7}{report['error_rate']:>8.1%}{report['updates_per_second']:>9}"
+          f"{report['p50_ms']:>9}{report['p95_ms']:>9}{report['p99_ms']:>9}{report['submit_p95_ms']:>10}"
+          f"{report['db_calls_per_taker']:>7}{owner['delivered']:>6}{owner['rejected']:>6}{owner['peak_per_second']:>6}"
+          + (f"  <- {report['saturated']}" if report.get('saturated') else ''))
+
+
+async def run(args) -> Dict:
+    harness, _ = await start_harness(args.api_latency_ms / 1000, args.db, args.db_latency_ms / 1000, 0.0)
+    levels = []
+    saturated_at = None
+    try:
+        test_id = await create_shared_test(harness)
+        harness.api.chat_limit = args.chat_limit  # the owner's own setup isn't what's under test
+        print(f"viral load: test {test_id} | db {args.db} | think {args.think_ms:.0f} ms | "
+              f"ramp {args.ramp_seconds} s | chat limit {args.chat_limit or 'off'}")
+        print(f"  {'takers':>6}{'done':>7}{'errors':>8}{'upd/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+              f"{'submit95':>10}{'db/tk':>7}{'owner':>6}{'429':>6}{'peak':>6}")
+        for index, level in enumerate(args.levels):
+            report = await run_level(harness, level, index, test_id, args)
+            report['saturated'] = saturation(levels[-1] if levels else None, report, args)
+            levels.append(report)
+            print_level(report)
+            if report['saturated'] and saturated_at is None:
+                saturated_at = {'takers': level, 'reason': report['saturated']}
+                if not args.all_levels:
+                    break
+    finally:
+        await stop_harness(harness)
+
+    params = {k: v for k, v in vars(args).items() if k != 'json'}
+    if saturated_at:
+        print(f"saturation: {saturated_at['takers']} concurrent takers ({saturated_at['reason']})")
+    else:
+        print(f"saturation: not reached up to {args.levels[-1]} takers")
+    return {'commit': git_commit(), 'params': params, 'levels': levels, 'saturation': saturated_at}
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--levels', type=lambda v: [int(n) for n in v.split(',')], default=[25, 50, 100, 200],
+                        help='concurrent takers per level, comma-separated')
+    parser.add_argument('--think-ms', type=float, default=1500.0, help='mean pause between taps (±50%%)')
+    parser.add_argument('--ramp-seconds', type=float, default=2.0, help='takers arrive spread over this window')
+    parser.add_argument('--db', choices=DB_BACKENDS, default='memory',
+                        help='memory: in-memory stand-in; supabase: the configured client (e.g. a local stack)')
+    parser.add_argument('--db-latency-ms', type=float, default=2.0, help='per query, memory backend only')
+    parser.add_argument('--api-latency-ms', type=float, default=20.0)
+    parser.add_argument('--chat-limit', type=int, default=0, help='messages per chat per second before 429 (0 = off)')
+    parser.add_argument('--slo-ms', type=float, default=1000.0, help='p95 update latency that counts as saturated')
+    parser.add_argument('--max-error-rate', type=float, default=0.01)
+    parser.add_argument('--all-levels', action='store_true', help='keep going past the saturation point')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--json', help='write the report here')
+    parser.add_argument('--log-level', default='ERROR')
+    return parser.parse_args(argv)
+
+
+def run_cli(argv: List[str]) -> int:
+    args = parse_args(argv)
+    logging.getLogger().setLevel(args.log_level.upper())
+
+    report = asyncio.run(run(args))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as report_file:
+            json.dump(report, report_file, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(run_cli(sys.argv[1:]))